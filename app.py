@@ -1,18 +1,71 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, Response, render_template, request, redirect, url_for, session, stream_with_context
+from markupsafe import escape
 import uuid
-import qrcode
+import functools
+import hmac
+import base64
 import os
 from datetime import datetime
-from db import get_db_connection
-import psycopg2
-import psycopg2.extras
+import db
+import assets
+import metrics
+import offload
+import tracing
+from assets import asset_url, inline_css
+from owner_cache import get_owner_card, get_owner_id_for_code, invalidate_owner, cache_stats
+from geo import GEOHASH_PRECISION
+from jobs import (
+    JOB_QUEUE_ENABLED, RERENDER_CONCURRENCY, enqueue_render, enqueue_rerender, job_status,
+    queue_stats, render_owner_sticker,
+)
+from scan_geo import HEATMAP_PRECISION, MAX_AREA_RESULTS
+from ratelimit import limit, ratelimit_stats
+from scan_filter import log_scan, filter_stats
+from scan_export import export_response, FORMATS as EXPORT_FORMATS
+from scan_ingest import ingest_stats, make_scan_token, read_scan_token
+from shortcode import decode as decode_short_code, is_short_code, owner_code
+from storage import storage
 from werkzeug.security import generate_password_hash, check_password_hash
-from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
+from sticker import DEFAULT_TEMPLATE, TEMPLATES, qr_url_for
+from sticker_cache import (
+    CONTENT_TYPES as STICKER_CONTENT_TYPES, IMMUTABLE, UNVERSIONED,
+    get_sticker, render_variant, sticker_cache_stats, sticker_etag, sticker_url, valid_variant,
+)
+from sticker_variants import STICKER_THUMB_SIZES, THUMB_FORMATS, variant_stats
+from sticker_vector import VECTOR_FORMATS
 
 # load_dotenv()
 app = Flask(__name__)
 app.secret_key =os.environ.get("SECRET_KEY")
+db.init_app(app)
+assets.init_app(app)
+offload.init_app(app)
+tracing.init_app(app)
+metrics.init_app(app)
+
+SCAN_PAGE_SIZE = int(os.environ.get("SCAN_PAGE_SIZE", 20))
+MAX_SCAN_PAGE_SIZE = 100
+MAX_LOCATION_BATCH = 500
+MAX_NEARBY_RADIUS_M = 50000
+
+
+# scanned_at is a timestamptz; show it in server local time as before
+@app.template_filter("timestamp")
+def format_timestamp(value):
+    if isinstance(value, datetime):
+        return value.astimezone().strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+# Maps link for a scan/location; built at render time, not stored
+@app.template_filter("map_link")
+def map_link(latitude, longitude=None):
+    if latitude is not None and not isinstance(latitude, (int, float)):
+        # A scan row
+        latitude, longitude = latitude["latitude"], latitude["longitude"]
+    if latitude is None or longitude is None:
+        return None
+    return f"https://www.google.com/maps?q={latitude},{longitude}"
 
 
 
@@ -20,41 +73,70 @@ app.secret_key =os.environ.get("SECRET_KEY")
 # Log scan location API
 # -------------------------
 @app.route("/log_location", methods=["POST"])
+@limit("location")
 def log_location():
-    data = request.get_json()
-    print("Location data received:", data)
-
-    owner_id = data.get("owner_id")
-    latitude = data.get("latitude")
-    longitude = data.get("longitude")
+    data = request.get_json(silent=True) or {}
 
-    if not owner_id:
+    location, error = parse_location_event(data)
+    if error:
         return "Invalid", 400
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    map_link = f"https://www.google.com/maps?q={latitude},{longitude}"
-
-    # Update latest scan for this owner
-    c.execute("""
-        UPDATE scan_logs
-        SET latitude=%s, longitude=%s, map_link=%s
-        WHERE id = (
-            SELECT id FROM scan_logs
-            WHERE owner_id=%s
-            ORDER BY id DESC
-            LIMIT 1
-        )
-    """, (latitude, longitude, map_link, owner_id))
-
-    conn.commit()
-    c.close()
-    conn.close()
+    # Update the row this scan page was issued for
+    storage.record_locations([location])
 
     return "OK"
 
 
+# -------------------------
+# Batched location API
+# -------------------------
+# Accepts [{scan_token, latitude, longitude}, ...] (or {"events": [...]})
+# from pages that queued locations offline or from fleet trackers. Valid
+# events are applied in one round trip; invalid ones are reported back.
+@app.route("/log_location/batch", methods=["POST"])
+@limit("location_batch")
+def log_location_batch():
+    data = request.get_json(silent=True)
+    events = data.get("events") if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return {"error": "expected a list of location events"}, 400
+    if len(events) > MAX_LOCATION_BATCH:
+        return {"error": f"at most {MAX_LOCATION_BATCH} events per batch"}, 413
+
+    locations = []
+    rejected = []
+    for index, event in enumerate(events):
+        location, error = parse_location_event(event)
+        if error:
+            rejected.append({"index": index, "error": error})
+        else:
+            locations.append(location)
+
+    if locations:
+        storage.record_locations(locations)
+
+    return {"accepted": len(locations), "rejected": rejected}
+
+
+def parse_location_event(event):
+    if not isinstance(event, dict):
+        return None, "not an object"
+
+    scan_id = read_scan_token(event.get("scan_token"))
+    if scan_id is None:
+        return None, "invalid scan_token"
+
+    latitude = event.get("latitude")
+    longitude = event.get("longitude")
+    for value in (latitude, longitude):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None, "latitude and longitude must be numbers"
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, "coordinates out of range"
+
+    return (scan_id, latitude, longitude), None
+
+
 # -------------------------
 # QR Form Page
 # -------------------------
@@ -72,26 +154,17 @@ def signup():
         email = request.form["email"]
         password = request.form["password"]
 
-        password_hash = generate_password_hash(password)
+        password_hash = offload.run(generate_password_hash, password)
 
         uid = str(uuid.uuid4())
 
-        conn = get_db_connection()
-        c = conn.cursor()
-
         try:
-            c.execute("""
-                INSERT INTO owners (id, name, phone, vehicle, email, password_hash)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (uid, name, phone, vehicle, email, password_hash))
-
-            conn.commit()
+            storage.create_owner(uid, name, phone, vehicle, email, password_hash)
         except Exception as e:
-            conn.rollback()
             return f"Error: {e}"
-        finally:
-            c.close()
-            conn.close()
+
+        # Drop any cached "unknown UID" entry
+        invalidate_owner(uid)
 
         return redirect(url_for("dashboard"))
 
@@ -104,19 +177,9 @@ def login():
         email = request.form["email"]
         password = request.form["password"]
 
-        conn = get_db_connection()
-        c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        c.execute(
-            "SELECT id, name, password_hash FROM owners WHERE email=%s",
-            (email,)
-        )
-        user = c.fetchone()
-
-        c.close()
-        conn.close()
+        user = storage.find_login(email)
 
-        if user and check_password_hash(user["password_hash"], password):
+        if user and offload.run(check_password_hash, user["password_hash"], password):
             session["owner_id"] = user["id"]
             session["owner_name"] = user["name"]
             return redirect(url_for("dashboard"))
@@ -141,61 +204,166 @@ def dashboard():
         return redirect("/login")
 
     owner_id = session["owner_id"]
-    conn = get_db_connection()
-    c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    # Owner, summary, render job status and the first page of history
+    # (one round trip on Postgres)
+    owner, scan_history = storage.dashboard(owner_id, SCAN_PAGE_SIZE + 1)
 
-    # Owner details
-    c.execute(
-        "SELECT id, name, vehicle, qr_path FROM owners WHERE id=%s",
-        (owner_id,)
-    )
-    owner = c.fetchone()
+    if owner is None:
+        session.clear()
+        return redirect("/login")
 
-    # Total scans
-    c.execute(
-        "SELECT COUNT(*) FROM scan_logs WHERE owner_id=%s",
-        (owner_id,)
-    )
-    total_scans = c.fetchone()[0]
-
-    # Last scan
-    c.execute(
-        """
-        SELECT scanned_at, latitude, longitude, map_link
-        FROM scan_logs
-        WHERE owner_id=%s
-        ORDER BY scanned_at DESC
-        LIMIT 1
-        """,
-        (owner_id,)
-    )
-    last_scan = c.fetchone()
-
-    # Full scan history
-    c.execute(
-    """
-    SELECT scanned_at, latitude, longitude, map_link
-    FROM scan_logs
-    WHERE owner_id=%s
-    ORDER BY scanned_at DESC
-    """,
-    (owner_id,)
-    )
-    scan_history = c.fetchall()
+    next_cursor = None
+    if len(scan_history) > SCAN_PAGE_SIZE:
+        scan_history = scan_history[:SCAN_PAGE_SIZE]
+        next_cursor = encode_scan_cursor(scan_history[-1])
 
+    code = owner_code(owner_id, owner["short_id"])
 
+    render_job = None
+    if JOB_QUEUE_ENABLED and owner["render_job_id"] is not None:
+        render_job = {"id": owner["render_job_id"], "status": owner["render_job_status"]}
 
-    c.close()
-    conn.close()
+    last_scan = None
+    if owner["last_scan_at"] is not None:
+        last_scan = {
+            "scanned_at": owner["last_scan_at"],
+            "map_link": map_link(owner["last_latitude"], owner["last_longitude"]),
+        }
 
     return render_template(
         "dashboard.html",
         owner=owner,
-        total_scans=total_scans,
+        total_scans=owner["total_scans"],
         last_scan=last_scan,
         scan_history=scan_history,
+        next_cursor=next_cursor,
+        qr_link=qr_url_for(request.host_url, code),
+        downloads=sticker_downloads(code),
+        preview=sticker_preview(code),
+        render_job=render_job,
     )
 
+
+# -------------------------
+# Scan History Pages (JSON)
+# -------------------------
+# Keyset pagination on (scanned_at, id): each page is an index range scan
+# no matter how deep into the history it is.
+@app.route("/dashboard/scans")
+def dashboard_scans():
+    if "owner_id" not in session:
+        return {"error": "login required"}, 401
+
+    cursor = decode_scan_cursor(request.args.get("cursor", ""))
+    if cursor is None:
+        return {"error": "invalid cursor"}, 400
+    limit = min(request.args.get("limit", SCAN_PAGE_SIZE, type=int), MAX_SCAN_PAGE_SIZE)
+
+    rows = storage.scan_page(session["owner_id"], cursor, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_scan_cursor(rows[-1])
+
+    return {
+        "scans": [
+            {
+                "scanned_at": format_timestamp(r["scanned_at"]),
+                "latitude": r["latitude"],
+                "longitude": r["longitude"],
+                "map_link": map_link(r),
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+def encode_scan_cursor(row):
+    raw = f"{row['scanned_at'].isoformat()}|{row['scan_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_scan_cursor(value):
+    try:
+        scanned_at, scan_id = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+        return datetime.fromisoformat(scanned_at), int(scan_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# -------------------------
+# Scan Locations (nearby / heatmap)
+# -------------------------
+# ?lat=&lon=&radius_m= for a radius, or ?bbox=min_lat,min_lon,max_lat,max_lon
+def area_scans(owner_id):
+    limit = min(request.args.get("limit", MAX_AREA_RESULTS, type=int), MAX_AREA_RESULTS)
+
+    if "bbox" in request.args:
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in request.args["bbox"].split(","))
+        except ValueError:
+            return {"error": "bbox must be min_lat,min_lon,max_lat,max_lon"}, 400
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+            return {"error": "bbox out of range"}, 400
+        rows = storage.scans_in_bbox(min_lat, min_lon, max_lat, max_lon, owner_id, limit)
+    else:
+        lat = request.args.get("lat", type=float)
+        lon = request.args.get("lon", type=float)
+        radius_m = request.args.get("radius_m", 1000, type=float)
+        if lat is None or lon is None:
+            return {"error": "lat and lon (or bbox) are required"}, 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return {"error": "lat/lon out of range"}, 400
+        if not 0 < radius_m <= MAX_NEARBY_RADIUS_M:
+            return {"error": f"radius_m must be between 0 and {MAX_NEARBY_RADIUS_M}"}, 400
+        rows = storage.scans_near(lat, lon, radius_m, owner_id, limit)
+
+    scans = []
+    for r in rows:
+        scan = {
+            "scanned_at": format_timestamp(r["scanned_at"]),
+            "latitude": r["latitude"],
+            "longitude": r["longitude"],
+            "map_link": map_link(r),
+        }
+        if owner_id is None:
+            scan["owner_id"] = r["owner_id"]
+        if "distance_m" in r:
+            scan["distance_m"] = round(r["distance_m"], 1)
+        scans.append(scan)
+    return {"scans": scans}
+
+
+@app.route("/dashboard/scans/nearby")
+def dashboard_scans_nearby():
+    if "owner_id" not in session:
+        return {"error": "login required"}, 401
+    return area_scans(session["owner_id"])
+
+
+@app.route("/admin/scans/nearby")
+def admin_scans_nearby():
+    if not is_admin_request():
+        return {"error": "forbidden"}, 403
+    return area_scans(None)
+
+
+@app.route("/dashboard/heatmap")
+def dashboard_heatmap():
+    if "owner_id" not in session:
+        return {"error": "login required"}, 401
+    precision = request.args.get("precision", HEATMAP_PRECISION, type=int)
+    if not 1 <= precision <= GEOHASH_PRECISION:
+        return {"error": f"precision must be between 1 and {GEOHASH_PRECISION}"}, 400
+
+    cells = storage.heatmap(session["owner_id"], precision)
+    for cell in cells:
+        cell["last_scan_at"] = format_timestamp(cell["last_scan_at"])
+    return {"precision": precision, "cells": cells}
+
+
 ## -------------------------#
 ## QR Generation Endpoint
 ## -------------------------#
@@ -245,141 +413,105 @@ def generate_qr():
         return redirect("/login")
 
     owner_id = session["owner_id"]
-    qr_url = f"{request.host_url}q/{owner_id}"
-
-    import qrcode
-    from PIL import Image, ImageDraw, ImageFont
-    import os
-
-    # ================= CONFIG =================
-    STICKER_SIZE = 720
-    OUTER_RADIUS = 60
-
-    YELLOW = "#FFD500"
-    QR_COLOR = "#166077"
-    TEXT_COLOR = "#111111"
 
-    QR_SIZE = 400
+    if JOB_QUEUE_ENABLED:
+        # Rendered by the job worker (jobs.py); the dashboard polls the job
+        job_id = enqueue_render(owner_id, request.host_url)
+        if request.accept_mimetypes.best == "application/json":
+            return {"job_id": job_id, "status_url": url_for("job_detail", job_id=job_id)}, 202
+    else:
+        # No queue (SQLite): render on the offload pool, CPU-bound
+        offload.run(render_owner_sticker, owner_id, request.host_url)
+        invalidate_owner(owner_id)
 
-    OUTPUT_DIR = "static/qr"
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    # ================= BASE STICKER =================
-    sticker = Image.new("RGBA", (STICKER_SIZE, STICKER_SIZE), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(sticker)
-
-    # Outer rounded yellow box
-    draw.rounded_rectangle(
-        (0, 0, STICKER_SIZE, STICKER_SIZE),
-        radius=OUTER_RADIUS,
-        fill=YELLOW
-    )
-
-    # ================= INNER WHITE CARD =================
-    MARGIN = 55
-    BOTTOM_SPACE = 160
-
-    WHITE_LEFT   = MARGIN
-    WHITE_TOP    = MARGIN
-    WHITE_RIGHT  = STICKER_SIZE - MARGIN
-    WHITE_BOTTOM = STICKER_SIZE - BOTTOM_SPACE
-
-    WHITE_WIDTH  = WHITE_RIGHT - WHITE_LEFT
-    WHITE_HEIGHT = WHITE_BOTTOM - WHITE_TOP
-
-    draw.rounded_rectangle(
-        (WHITE_LEFT, WHITE_TOP, WHITE_RIGHT, WHITE_BOTTOM),
-        radius=40,
-        fill="white"
-    )
-
-    # ================= QR GENERATION =================
-    qr = qrcode.QRCode(
-        version=3,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=1
-    )
-    qr.add_data(qr_url)
-    qr.make(fit=True)
-
-    qr_img = qr.make_image(
-        fill_color=QR_COLOR,
-        back_color="white"
-    ).convert("RGBA")
-
-    qr_img = qr_img.resize((QR_SIZE, QR_SIZE))
-
-    # ================= CENTER QR PERFECTLY =================
-    qr_x = WHITE_LEFT + (WHITE_WIDTH - QR_SIZE) // 2
-    qr_y = WHITE_TOP + (WHITE_HEIGHT - QR_SIZE) // 2
+    return redirect("/dashboard")
 
-    sticker.paste(qr_img, (qr_x, qr_y), qr_img)
 
-    # ================= FONTS =================
-    try:
-        font_bold = ImageFont.truetype("arialbd.ttf", 36)
-        font = ImageFont.truetype("arial.ttf", 26)
-    except:
-        font_bold = font = ImageFont.load_default()
-
-    # ================= WEBSITE TEXT =================
-    draw.text(
-        (STICKER_SIZE // 2, qr_y + QR_SIZE + 18),
-        "letstrackme.com",
-        fill=TEXT_COLOR,
-        font=font,
-        anchor="mm"
-    )
+# Dashboard links go through /sticker/, which works on every dyno whether
+# or not this one has the static/qr/ files
+def sticker_downloads(code):
+    return [(fmt.upper(), sticker_url(code, fmt)) for fmt in ("png",) + VECTOR_FORMATS]
 
-    # ================= SIDE "SCAN ME" =================
-    side_text = Image.new("RGBA", (220, 40), (0, 0, 0, 0))
-    side_draw = ImageDraw.Draw(side_text)
-    side_draw.text(
-        (110, 20),
-        "Scan Me",
-        fill=TEXT_COLOR,
-        font=font,
-        anchor="mm"
-    )
 
-    sticker.paste(
-        side_text.rotate(90, expand=True),
-        (WHITE_LEFT + 10, qr_y + 80),
-        side_text.rotate(90, expand=True)
-    )
+def sticker_preview(code):
+    preview = {
+        fmt: ", ".join(f"{sticker_url(code, fmt, size)} {size}w" for size in STICKER_THUMB_SIZES)
+        for fmt in THUMB_FORMATS
+    }
+    preview["src"] = sticker_url(code, "png", STICKER_THUMB_SIZES[0])
+    return preview
 
-    sticker.paste(
-        side_text.rotate(-90, expand=True),
-        (WHITE_RIGHT - 55, qr_y + 80),
-        side_text.rotate(-90, expand=True)
-    )
 
-    # ================= CTA =================
-    draw.text(
-        (STICKER_SIZE // 2, STICKER_SIZE - 70),
-        "SCAN TO CONTACT OWNER",
-        fill=QR_COLOR,
-        font=font_bold,
-        anchor="mm"
-    )
+# -------------------------
+# On-demand Stickers
+# -------------------------
+@app.route("/sticker/<code>.<fmt>")
+@limit("sticker")
+def sticker_file(code, fmt):
+    template = request.args.get("t")
+    size = request.args.get("size", type=int)
+    if (template is not None and template not in TEMPLATES) or not valid_variant(fmt, size):
+        return "Not found", 404
+    owner_id = resolve_owner_id(code)
+    card = get_owner_card(owner_id, load_owner_card) if owner_id else None
+    if card is None:
+        return "Not found", 404
+
+    # The QR always carries the short code, even on a /sticker/<uuid> URL.
+    # So a UUID URL changes content when the owner gets a code: only
+    # short-code URLs (what sticker_url() builds) are immutable.
+    qr_url = qr_url_for(request.host_url, owner_code(owner_id, card.get("short_id")))
+    cache_control = IMMUTABLE if template and is_short_code(code) else UNVERSIONED
+    template = template or DEFAULT_TEMPLATE
+
+    # The ETag comes from the inputs: a revalidation never renders
+    etag = sticker_etag(qr_url, template, fmt, size)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # Cache misses render on the offload pool
+        _, data = get_sticker(
+            qr_url, template, fmt, size,
+            render=functools.partial(offload.run, render_variant)
+        )
+        response = Response(data, mimetype=STICKER_CONTENT_TYPES[fmt])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
 
-    # ================= SAVE =================
-    qr_path = f"{OUTPUT_DIR}/{owner_id}.png"
-    sticker.save(qr_path, "PNG")
 
-    # ================= DB UPDATE =================
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(
-        "UPDATE owners SET qr_path=%s WHERE id=%s",
-        (qr_path, owner_id)
-    )
-    conn.commit()
-    c.close()
-    conn.close()
 
-    return redirect("/dashboard")
+# -------------------------
+# Background Jobs
+# -------------------------
+@app.route("/jobs/<int:job_id>")
+def job_detail(job_id):
+    if not JOB_QUEUE_ENABLED:
+        return {"error": "not found"}, 404
+    job = job_status(job_id)
+    # Owners see their own jobs
+    if job is None or not (job["owner_id"] == session.get("owner_id") or is_admin_request()):
+        return {"error": "not found"}, 404
+    return job
+
+
+# Re-render every issued sticker, e.g. after a template change:
+# POST template=v1&concurrency=4
+@app.route("/admin/jobs/rerender", methods=["POST"])
+def admin_rerender():
+    if not is_admin_request():
+        return {"error": "forbidden"}, 403
+    if not JOB_QUEUE_ENABLED:
+        return {"error": "job queue disabled"}, 400
+    template = request.values.get("template", DEFAULT_TEMPLATE)
+    concurrency = request.values.get("concurrency", RERENDER_CONCURRENCY, type=int)
+    if template not in TEMPLATES:
+        return {"error": f"unknown template {template!r}"}, 400
+    if not 1 <= concurrency <= 64:
+        return {"error": "concurrency must be between 1 and 64"}, 400
+
+    job_id = enqueue_rerender(request.host_url, template, concurrency)
+    return {"job_id": job_id, "status_url": url_for("job_detail", job_id=job_id)}, 202
 
 
 
@@ -419,82 +551,49 @@ def generate_qr():
 # QR Scan Page
 # -------------------------
 @app.route("/q/<uid>")
+@limit("scan")
 def show(uid):
-    conn = get_db_connection()
-    c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    # Fetch owner details
-    c.execute("SELECT name, phone, vehicle, qr_path FROM owners WHERE id=%s", (uid,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+    # A short code, or the owner UUID printed on older stickers
+    owner_id = resolve_owner_id(uid)
+
+    # Owner card (cached, including "no such owner")
+    owner = get_owner_card(owner_id, load_owner_card) if owner_id else None
+    if owner is None:
         return "Invalid QR"
 
-    # Log scan
-    scan_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO scan_logs (owner_id, scanned_at) VALUES (%s, %s)",
-              (uid, scan_time))
-    conn.commit()
-    c.close()
-    conn.close()
+    # Log scan (skips previews/bots/prefetches, collapses quick repeats)
+    scan_id = log_scan(request, owner_id, storage.record_scan)
+    scan_token = make_scan_token(scan_id) if scan_id is not None else ""
 
     # -------------------------
     # Responsive Scan Page
     # -------------------------
-    return f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>Vehicle Owner</title>
-  <script src="https://cdn.tailwindcss.com"></script>
-</head>
-<body class="bg-gray-100 min-h-screen flex items-center justify-center p-4">
-
-  <!-- Card -->
-  <div class="bg-white p-6 sm:p-8 rounded-xl shadow-lg w-full max-w-md">
-    <h2 class="text-xl sm:text-2xl font-bold mb-2 text-center">{row[0]}</h2>
-    <p class="text-gray-600 mb-6 text-center text-sm sm:text-base">Vehicle: {row[2]}</p>
-
-    <a href="tel:{row[1]}"
-       class="block w-full text-center bg-blue-600 hover:bg-blue-700 text-white py-3 rounded-lg mb-4 sm:mb-6 transition font-medium text-sm sm:text-base">
-      📞 Call Owner
-    </a>
-
-    <a href="/history/{uid}"
-       class="block w-full text-center bg-gray-200 hover:bg-gray-300 text-gray-800 py-2 rounded-lg transition font-medium text-sm sm:text-base">
-      📄 View Scan History
-    </a>
-  </div>
+    return scan_page_template().render(
+        owner=owner,
+        uid=owner_id,
+        scan_token=scan_token,
+        critical_css=inline_css("scan.css"),
+    )
 
-  <script>
-    if ("geolocation" in navigator) {{
-      navigator.geolocation.getCurrentPosition(
-        function(position) {{
-          fetch("/log_location", {{
-            method: "POST",
-            headers: {{
-              "Content-Type": "application/json"
-            }},
-            body: JSON.stringify({{
-              owner_id: "{uid}",
-              latitude: position.coords.latitude,
-              longitude: position.coords.longitude
-            }})
-          }});
-        }},
-        function(error) {{
-          console.log("Location denied");
-        }}
-      );
-    }}
-  </script>
 
-</body>
-</html>
+def load_owner_card(uid):
+    return storage.owner_card(uid)
 
-"""
+
+def resolve_owner_id(value):
+    if is_short_code(value):
+        return get_owner_id_for_code(value, load_owner_by_code)
+    return value
+
+
+def load_owner_by_code(code):
+    return storage.owner_by_short_id(decode_short_code(code))
+
+
+# Compiled once per process; rendering skips the template lookup
+@functools.lru_cache(maxsize=None)
+def scan_page_template():
+    return app.jinja_env.get_template("scan.html")
 
 
 # -------------------------
@@ -502,48 +601,26 @@ def show(uid):
 # -------------------------
 @app.route("/history/<uid>")
 def history(uid):
-    conn = sqlite3.connect("data.db")
-    c = conn.cursor()
-
-    c.execute("SELECT name, vehicle FROM owners WHERE id=?", (uid,))
-    owner = c.fetchone()
+    owner = storage.owner_summary(uid)
     if not owner:
-        conn.close()
         return "Invalid QR ID"
 
-    # Fetch scan logs
-    c.execute("""
-        SELECT scanned_at, latitude, longitude
-        FROM scan_logs
-        WHERE owner_id=?
-        ORDER BY id DESC
-    """, (uid,))
-    rows = c.fetchall()
-    conn.close()
-
-    table_rows = ""
-    for r in rows:
-        lat = r[1]
-        lon = r[2]
-        if lat is not None and lon is not None:
-            map_link = f'<a href="https://www.google.com/maps?q={lat},{lon}" target="_blank" class="text-blue-600 underline">View Map</a>'
-        else:
-            map_link = "-"
-        table_rows += f"<tr class='border-b'><td class='px-3 py-2'>{r[0]}</td><td class='px-3 py-2'>{lat if lat else '-'}</td><td class='px-3 py-2'>{lon if lon else '-'}</td><td class='px-3 py-2'>{map_link}</td></tr>"
+    name, vehicle, total_scans = escape(owner["name"]), escape(owner["vehicle"]), owner["total_scans"]
 
-    return f"""
+    def generate():
+        yield f"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
   <meta charset="UTF-8">
   <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>{owner[0]} - Scan History</title>
-  <script src="https://cdn.tailwindcss.com"></script>
+  <title>{name} - Scan History</title>
+  <link rel="stylesheet" href="{asset_url("app.css")}">
 </head>
 <body class="bg-gray-100 min-h-screen p-4">
   <div class="max-w-4xl mx-auto bg-white p-6 sm:p-8 rounded-xl shadow-lg">
-    <h2 class="text-2xl font-bold mb-4">{owner[0]} - {owner[1]} Scan History</h2>
-    <p class="mb-4 font-medium">Total Scans: {len(rows)}</p>
+    <h2 class="text-2xl font-bold mb-4">{name} - {vehicle} Scan History</h2>
+    <p class="mb-4 font-medium">Total Scans: {total_scans}</p>
 
     <div class="overflow-x-auto">
       <table class="min-w-full border border-gray-300 divide-y divide-gray-200">
@@ -556,7 +633,16 @@ def history(uid):
           </tr>
         </thead>
         <tbody class="divide-y divide-gray-100">
-          {table_rows}
+"""
+        # Rows are streamed (server-side cursor on Postgres)
+        for _, _, scanned_at, lat, lon in storage.iter_scans(uid):
+            if lat is not None and lon is not None:
+                link = f'<a href="{map_link(lat, lon)}" target="_blank" class="text-blue-600 underline">View Map</a>'
+            else:
+                link = "-"
+            yield f"<tr class='border-b'><td class='px-3 py-2'>{format_timestamp(scanned_at)}</td><td class='px-3 py-2'>{lat if lat else '-'}</td><td class='px-3 py-2'>{lon if lon else '-'}</td><td class='px-3 py-2'>{link}</td></tr>\n"
+
+        yield """
         </tbody>
       </table>
     </div>
@@ -565,6 +651,35 @@ def history(uid):
 </html>
 """
 
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
+
+# -------------------------
+# Scan Exports (CSV / NDJSON)
+# -------------------------
+EXPORT_COLUMNS = ["owner_id", "scanned_at", "latitude", "longitude"]
+
+
+@app.route("/dashboard/export.<fmt>")
+def export_my_scans(fmt):
+    if "owner_id" not in session:
+        return redirect("/login")
+    if fmt not in EXPORT_FORMATS:
+        return "Unknown format", 404
+
+    rows = (r[1:] for r in storage.iter_scans(session["owner_id"]))
+    return export_response(fmt, EXPORT_COLUMNS, rows, filename="scan-history")
+
+
+@app.route("/admin/export/scans.<fmt>")
+def export_all_scans(fmt):
+    if not is_admin_request():
+        return "Forbidden", 403
+    if fmt not in EXPORT_FORMATS:
+        return "Unknown format", 404
+
+    return export_response(fmt, ["id"] + EXPORT_COLUMNS, storage.iter_scans(), filename="scans")
+
 
 
 # -------------------------
@@ -701,19 +816,114 @@ def history(uid):
 # -------------------------
 @app.route("/debug/scans")
 def debug_scans():
-    conn = get_db_connection()
-    c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    c.execute("""
-        SELECT owner_id, scanned_at, latitude, longitude
-        FROM scan_logs
-    """)
-    rows = c.fetchall()
-    conn.close()
-
-    return "<br>".join([
-        f"{r['owner_id']} | {r['scanned_at']} | {r['latitude']} | {r['longitude']}"
-        for r in rows
-    ])
+    if not is_admin_request():
+        return "Forbidden", 403
+
+    def generate():
+        for _, owner_id, scanned_at, lat, lon in storage.iter_scans():
+            yield f"{owner_id} | {scanned_at} | {lat} | {lon}<br>"
+
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
+
+# -------------------------
+# Debug Pool Stats
+# -------------------------
+@app.route("/debug/pool")
+def debug_pool():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return db.pool_stats()
+
+
+def is_admin_request():
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        return False
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(supplied, token)
+
+
+# -------------------------
+# Debug Scan Ingestion
+# -------------------------
+@app.route("/debug/ingest")
+def debug_ingest():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return ingest_stats()
+
+
+# -------------------------
+# Debug Owner Cache
+# -------------------------
+@app.route("/debug/owner-cache")
+def debug_owner_cache():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return cache_stats()
+
+
+# -------------------------
+# Debug Scan Filter
+# -------------------------
+@app.route("/debug/scan-filter")
+def debug_scan_filter():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return filter_stats()
+
+
+# -------------------------
+# Debug Rate Limits
+# -------------------------
+@app.route("/debug/ratelimit")
+def debug_ratelimit():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return ratelimit_stats()
+
+
+# -------------------------
+# Debug Offload Pool
+# -------------------------
+@app.route("/debug/offload")
+def debug_offload():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return offload.offload_stats()
+
+
+# -------------------------
+# Debug Sticker Variants
+# -------------------------
+@app.route("/debug/stickers")
+def debug_stickers():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return variant_stats()
+
+
+# -------------------------
+# Debug Sticker Cache
+# -------------------------
+@app.route("/debug/sticker-cache")
+def debug_sticker_cache():
+    if not is_admin_request():
+        return "Forbidden", 403
+    return sticker_cache_stats()
+
+
+# -------------------------
+# Debug Job Queue
+# -------------------------
+@app.route("/debug/jobs")
+def debug_jobs():
+    if not is_admin_request():
+        return "Forbidden", 403
+    if not JOB_QUEUE_ENABLED:
+        return {"enabled": False}
+    return queue_stats()
 
 
 # -------------------------
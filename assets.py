@@ -0,0 +1,47 @@
+import functools
+import json
+import os
+
+from flask import request, url_for
+
+# Written by build_css.py
+CSS_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "css", "manifest.json")
+
+# Hashed build output never changes under the same name
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@functools.lru_cache(maxsize=None)
+def _manifest():
+    with open(CSS_MANIFEST) as f:
+        return json.load(f)
+
+
+def asset_url(name):
+    return url_for("static", filename=_manifest()[name])
+
+
+@functools.lru_cache(maxsize=None)
+def inline_css(name):
+    static_dir = os.path.dirname(os.path.dirname(CSS_MANIFEST))
+    with open(os.path.join(static_dir, _manifest()[name]), encoding="utf-8") as f:
+        return f.read()
+
+
+def is_hashed_asset(path):
+    return path.startswith("/static/") and path[len("/static/"):] in _manifest().values()
+
+
+def init_app(app):
+    @app.context_processor
+    def _asset_helpers():
+        return {"asset_url": asset_url}
+
+    @app.after_request
+    def _cache_hashed_assets(response):
+        if response.status_code == 200 and is_hashed_asset(request.path):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
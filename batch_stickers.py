@@ -0,0 +1,388 @@
+"""Render stickers for many owners at once.
+
+    python batch_stickers.py --base-url https://letstrackme.com --all --zip stickers.zip
+    python batch_stickers.py --base-url https://letstrackme.com --owner ID --owner ID --pdf sheets.pdf
+    python batch_stickers.py --base-url https://letstrackme.com --where "vehicle LIKE 'KA%'"
+
+Stickers are rendered across a process pool with the same pipeline as
+/generate, saved to static/qr/ (every raster variant plus SVG/PDF) and
+written to owners.qr_path in one bulk update at the end. Owner IDs are
+appended to a state file once their sticker is safely in the output, so
+an interrupted run can be started again with the same arguments.
+"""
+import argparse
+import io
+import os
+import struct
+import sys
+import zipfile
+import zlib
+from multiprocessing import Pool
+
+import psycopg2.extras
+from PIL import Image
+
+from db import get_db_connection
+from shortcode import owner_code
+from sticker import DEFAULT_TEMPLATE, compile_template, qr_url_for, render_sticker
+from sticker_variants import encode, encode_variants, quantize, render_variants, write_variants
+from sticker_vector import save_vector_files
+
+OUTPUT_DIR = "static/qr"
+
+# A4 at 300 dpi
+SHEET_SIZE = (2480, 3508)
+SHEET_MARGIN = 90
+SHEET_GAP = 40
+
+
+# -------------------------
+# Owner selection
+# -------------------------
+def iter_owner_ids(where=None, fetch_size=1000):
+    conn = get_db_connection()
+    try:
+        # Named cursor so the ID list is streamed from the server
+        c = conn.cursor(name="batch_owner_ids")
+        c.itersize = fetch_size
+        sql = "SELECT id FROM owners"
+        if where:
+            sql += f" WHERE {where}"
+        c.execute(sql + " ORDER BY id")
+        for (owner_id,) in c:
+            yield owner_id
+        c.close()
+    finally:
+        conn.close()
+
+
+def load_codes(owner_ids):
+    # {owner_id: short code, or the UUID for owners without one yet}
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, short_id FROM owners WHERE id = ANY(%s)", (list(owner_ids),))
+    short_ids = dict(c.fetchall())
+    c.close()
+    conn.close()
+    return {owner_id: owner_code(owner_id, short_ids.get(owner_id)) for owner_id in owner_ids}
+
+
+def load_state(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -------------------------
+# Worker
+# -------------------------
+def _init_worker(template):
+    compile_template(template)
+
+
+def render_one(job):
+    owner_id, code, base_url, template, save_files = job
+
+    qr_url = qr_url_for(base_url, code)
+
+    qr_path = f"{OUTPUT_DIR}/{owner_id}.png"
+    if save_files:
+        encoded = encode_variants(render_variants(qr_url, template))
+        write_variants(encoded, qr_path)
+        save_vector_files(qr_url, qr_path, template)
+        png = encoded["png"][0]
+    else:
+        png = encode(quantize(render_sticker(qr_url, template)), "png")
+
+    return owner_id, qr_path, png
+
+
+# -------------------------
+# Outputs
+# -------------------------
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def _valid_zip(path):
+    try:
+        with zipfile.ZipFile(path) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError, EOFError):
+        return False
+
+
+def recover_zip(path):
+    """Rebuild a ZIP whose central directory was lost; returns the names kept.
+
+    Mode "a" writes new entries over the old central directory and only
+    writes a new one on close, so a run killed mid-chunk leaves entries
+    and no directory. Every entry before the cut is still intact: walk
+    the local headers and keep the complete, CRC-checked ones.
+    """
+    entries = []
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                break
+            (signature, _, flags, method, _, _, crc, size, _,
+             name_len, extra_len) = LOCAL_HEADER.unpack(header)
+            # Only what add() writes: stored, sizes in the header
+            if signature != b"PK\x03\x04" or method != zipfile.ZIP_STORED or flags & 0x08:
+                break
+            name = f.read(name_len).decode("utf-8")
+            f.seek(extra_len, os.SEEK_CUR)
+            data = f.read(size)
+            if len(data) < size or zlib.crc32(data) != crc:
+                break
+            entries.append((name, data))
+
+    tmp = f"{path}.recover"
+    with zipfile.ZipFile(tmp, "w") as z:
+        for name, data in entries:
+            z.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+    os.replace(tmp, path)
+    return [name for name, _ in entries]
+
+
+class ZipOutput:
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path) and not _valid_zip(path):
+            kept = recover_zip(path)
+            print(f"{path} was not closed cleanly: recovered {len(kept)} stickers", file=sys.stderr)
+        self.zip = zipfile.ZipFile(path, "a")
+        self.names = set(self.zip.namelist())
+        self.pending = []
+
+    def verify(self, done):
+        # State-file IDs whose sticker is not actually in the ZIP get redone
+        return {owner_id for owner_id in done if f"{owner_id}.png" in self.names}
+
+    def add(self, owner_id, png):
+        name = f"{owner_id}.png"
+        if name not in self.names:
+            # PNG is already compressed
+            self.zip.writestr(name, png, compress_type=zipfile.ZIP_STORED)
+            self.names.add(name)
+        self.pending.append(owner_id)
+
+    def checkpoint(self):
+        # The central directory is only written on close
+        self.zip.close()
+        self.zip = zipfile.ZipFile(self.path, "a")
+        durable, self.pending = self.pending, []
+        return durable
+
+    def close(self):
+        self.zip.close()
+        durable, self.pending = self.pending, []
+        return durable
+
+
+class SheetOutput:
+    def __init__(self, path, cols, rows):
+        self.path = path
+        self.cols = cols
+        self.rows = rows
+        self.append = os.path.exists(path)
+        self.sheet = None
+        self.slot = 0
+        self.on_sheet = []
+        self.pending = []
+
+        width, height = SHEET_SIZE
+        cell_w = (width - 2 * SHEET_MARGIN - (cols - 1) * SHEET_GAP) // cols
+        cell_h = (height - 2 * SHEET_MARGIN - (rows - 1) * SHEET_GAP) // rows
+        self.cell = min(cell_w, cell_h)
+
+    def add(self, owner_id, png):
+        if self.sheet is None:
+            self.sheet = Image.new("RGB", SHEET_SIZE, "white")
+
+        sticker = Image.open(io.BytesIO(png)).convert("RGBA")
+        if sticker.size != (self.cell, self.cell):
+            sticker = sticker.resize((self.cell, self.cell), Image.LANCZOS)
+
+        col = self.slot % self.cols
+        row = self.slot // self.cols
+        x = SHEET_MARGIN + col * (self.cell + SHEET_GAP)
+        y = SHEET_MARGIN + row * (self.cell + SHEET_GAP)
+        self.sheet.paste(sticker, (x, y), sticker)
+        self.on_sheet.append(owner_id)
+
+        self.slot += 1
+        if self.slot == self.cols * self.rows:
+            self.flush()
+
+    def flush(self):
+        if self.sheet is None:
+            return
+        # One page at a time, appended to the same PDF
+        self.sheet.save(self.path, "PDF", resolution=300, append=self.append)
+        self.append = True
+        self.sheet = None
+        self.slot = 0
+        self.pending.extend(self.on_sheet)
+        self.on_sheet = []
+
+    def verify(self, done):
+        # Pages are only appended once complete
+        return done
+
+    def checkpoint(self):
+        # Stickers on a half-filled sheet are not durable yet
+        durable, self.pending = self.pending, []
+        return durable
+
+    def close(self):
+        self.flush()
+        return self.checkpoint()
+
+
+# -------------------------
+# DB update
+# -------------------------
+def bulk_update_qr_paths(pairs, page_size=1000):
+    if not pairs:
+        return
+    conn = get_db_connection()
+    c = conn.cursor()
+    psycopg2.extras.execute_values(
+        c,
+        """
+        UPDATE owners AS o
+        SET qr_path = v.qr_path
+        FROM (VALUES %s) AS v(id, qr_path)
+        WHERE o.id = v.id
+        """,
+        pairs,
+        page_size=page_size
+    )
+    conn.commit()
+    c.close()
+    conn.close()
+
+
+# -------------------------
+# Main
+# -------------------------
+def run(owner_ids, base_url, template=DEFAULT_TEMPLATE, processes=None,
+        chunk_size=200, output=None, state_path=None, save_files=True,
+        update_db=True):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    done = load_state(state_path)
+    if output is not None:
+        done = output.verify(done)
+    state = open(state_path, "a") if state_path else None
+    rendered = 0
+
+    def mark_done(owner_ids):
+        done.update(owner_ids)
+        if state is not None:
+            state.writelines(owner_id + "\n" for owner_id in owner_ids)
+            state.flush()
+
+    try:
+        with Pool(processes, initializer=_init_worker, initargs=(template,)) as pool:
+            todo = (owner_id for owner_id in owner_ids if owner_id not in done)
+
+            # Work in bounded chunks so only chunk_size PNGs are ever in flight
+            for chunk in chunked(todo, chunk_size):
+                codes = load_codes(chunk)
+                jobs = [(owner_id, codes[owner_id], base_url, template, save_files)
+                        for owner_id in chunk]
+                for owner_id, qr_path, png in pool.imap(render_one, jobs):
+                    if output is not None:
+                        output.add(owner_id, png)
+                    rendered += 1
+
+                mark_done(output.checkpoint() if output is not None else chunk)
+                print(f"rendered {rendered} stickers", file=sys.stderr)
+
+        if output is not None:
+            mark_done(output.close())
+            output = None
+    finally:
+        if output is not None:
+            output.close()
+        if state is not None:
+            state.close()
+
+    # Includes owners finished by an earlier, interrupted run. Without
+    # files there is nothing at static/qr/ to point qr_path at.
+    if update_db and save_files:
+        bulk_update_qr_paths(
+            [(owner_id, f"{OUTPUT_DIR}/{owner_id}.png") for owner_id in sorted(done)]
+        )
+
+    return rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render QR stickers in bulk")
+    parser.add_argument("--base-url", required=True, help="public site URL used in the QR")
+    parser.add_argument("--owner", action="append", default=[], help="owner ID (repeatable)")
+    parser.add_argument("--where", help="SQL condition on owners, e.g. \"vehicle LIKE 'KA%%'\"")
+    parser.add_argument("--all", action="store_true", help="every owner")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--zip", help="write stickers into this ZIP")
+    parser.add_argument("--pdf", help="write multi-up A4 print sheets into this PDF")
+    parser.add_argument("--cols", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--state", help="resume file (default: <output>.state)")
+    parser.add_argument("--no-files", action="store_true", help="don't write static/qr/ files (implies --no-db)")
+    parser.add_argument("--no-db", action="store_true", help="don't update owners.qr_path")
+    args = parser.parse_args(argv)
+
+    if not (args.owner or args.where or args.all):
+        parser.error("pass --owner, --where or --all")
+    if args.zip and args.pdf:
+        parser.error("pick one of --zip or --pdf")
+
+    if args.owner:
+        owner_ids = args.owner
+    else:
+        owner_ids = iter_owner_ids(args.where)
+
+    output = None
+    if args.zip:
+        output = ZipOutput(args.zip)
+    elif args.pdf:
+        output = SheetOutput(args.pdf, args.cols, args.rows)
+
+    state_path = args.state
+    if state_path is None and (args.zip or args.pdf):
+        state_path = (args.zip or args.pdf) + ".state"
+
+    rendered = run(
+        owner_ids,
+        args.base_url,
+        template=args.template,
+        processes=args.processes,
+        chunk_size=args.chunk_size,
+        output=output,
+        state_path=state_path,
+        save_files=not args.no_files,
+        update_db=not args.no_db,
+    )
+    print(f"done: {rendered} stickers rendered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""Replay benchmark for the main routes.
+
+    python bench.py seed [--owners 200] [--scans 50]
+        Create bench-NNNN owners (password "bench-password") and scan
+        history in the configured storage (STORAGE_BACKEND, DB_* or
+        SQLITE_PATH). Use a scratch database.
+    python bench.py synth [--out traces.jsonl] [--requests 2000]
+        Write a synthetic trace (scan / location / dashboard / generate mix)
+        in the same format tracing.py records (TRACE_FILE=...).
+    python bench.py replay [--traces traces.jsonl] [--concurrency 8]
+                           [--repeat 1] [--url http://127.0.0.1:8000]
+                           [--out report.json]
+        Replay a trace against the app in-process (Flask test client) or a
+        running server (--url), mapping trace placeholders onto the seeded
+        owners. Prints/writes a JSON report: p50/p95/p99 latency,
+        throughput and (in-process only) queries per request per route.
+    python bench.py compare OLD.json NEW.json [--threshold 10]
+        Show per-route changes; exits 1 if p95 latency or queries per
+        request got worse by more than threshold percent.
+    python bench.py stickers [--count 200] [--template v1]
+        Time the QR tile (qrcode/PIL image + resize vs the numpy matrix
+        rasteriser, cold and cached) and whole sticker renders per
+        rasteriser. Prints a JSON report.
+
+Rate limiting is off during in-process replay (one process plays every
+client); pass --ratelimit to keep it.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+BENCH_PREFIX = "bench-"
+BENCH_PASSWORD = "bench-password"
+DEFAULT_TRACES = "traces.jsonl"
+PLACEHOLDER = re.compile(r"\{(\w+)(?::(\w+))?\}")
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+]
+BOT_USER_AGENT = "WhatsApp/2.24.6.77 A"
+
+
+# -------------------------
+# Seeding
+# -------------------------
+def seed(owners=200, scans=50):
+    from storage import storage
+    from werkzeug.security import generate_password_hash
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    rng = random.Random(1)
+    for i in range(owners):
+        owner_id = f"{BENCH_PREFIX}{i:04d}"
+        if storage.owner_card(owner_id) is None:
+            storage.create_owner(owner_id, f"Bench {i}", "0000000000", "BENCH-1",
+                                 f"{owner_id}@example.com", password_hash)
+        locations = []
+        for _ in range(scans):
+            scan_id = storage.record_scan(owner_id)
+            if scan_id is not None and rng.random() < 0.7:
+                locations.append((scan_id, 12.9 + rng.random() * 0.2, 77.5 + rng.random() * 0.2))
+        storage.record_locations(locations)
+    print(f"Seeded {owners} owners with {scans} scans each ({storage.name})")
+
+
+def load_fixtures():
+    from storage import storage
+
+    owners = []
+    while storage.owner_card(f"{BENCH_PREFIX}{len(owners):04d}") is not None:
+        owner_id = f"{BENCH_PREFIX}{len(owners):04d}"
+        owners.append((owner_id, f"{owner_id}@example.com"))
+    scan_ids = []
+    for owner_id, _ in owners[:100]:
+        scan_ids += [scan["scan_id"] for scan in storage.dashboard(owner_id, 50)[1]]
+    if not owners or not scan_ids:
+        sys.exit("No bench owners/scans in this storage; run: python bench.py seed")
+    return owners, scan_ids
+
+
+# -------------------------
+# Synthetic traces
+# -------------------------
+def synth(out=DEFAULT_TRACES, requests=2000, owners=100, clients=300, seed_value=1):
+    rng = random.Random(seed_value)
+
+    def token(kind):
+        return "{%s:%08x}" % (kind, rng.randrange(owners if kind == "uid" else clients))
+
+    with open(out, "w") as f:
+        for n in range(requests):
+            roll = rng.random()
+            record = {"ts": n, "query": {}, "client": token("client"), "owner": None,
+                      "headers": {"User-Agent": rng.choice(USER_AGENTS)}}
+            if roll < 0.70:
+                uid = token("uid")
+                if rng.random() < 0.05:
+                    record["headers"]["User-Agent"] = BOT_USER_AGENT
+                record.update(method="GET", route="/q/<uid>", path=f"/q/{uid}")
+            elif roll < 0.85:
+                record.update(method="POST", route="/log_location", path="/log_location",
+                              json={"scan_token": "{scan_token}",
+                                    "latitude": round(12.9 + rng.random() * 0.2, 3),
+                                    "longitude": round(77.5 + rng.random() * 0.2, 3)})
+                record["headers"]["Content-Type"] = "application/json"
+            elif roll < 0.96:
+                record.update(method="GET", route="/dashboard", path="/dashboard",
+                              owner=token("uid"))
+            else:
+                record.update(method="POST", route="/generate", path="/generate",
+                              owner=token("uid"))
+            f.write(json.dumps(record) + "\n")
+    print(f"Wrote {requests} synthetic requests to {out}")
+
+
+# -------------------------
+# Materializing trace records
+# -------------------------
+class Fixtures:
+    """Maps trace placeholders onto seeded owners, consistently."""
+
+    def __init__(self, owners, scan_ids, make_token):
+        self.owners = owners
+        self.scan_ids = scan_ids
+        self.make_token = make_token
+        self._map = {}
+        self._lock = threading.Lock()
+
+    def owner(self, key):
+        with self._lock:
+            if key not in self._map:
+                self._map[key] = self.owners[len(self._map) % len(self.owners)]
+            return self._map[key]
+
+    def client_ip(self, key):
+        n = int(key, 16) if key and all(ch in "0123456789abcdef" for ch in key) else hash(key)
+        return f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+    def fill(self, value, route):
+        if isinstance(value, dict):
+            return {k: self.fill(v, route) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.fill(v, route) for v in value]
+        if not isinstance(value, str):
+            return value
+
+        def sub(m):
+            kind, key = m.group(1), m.group(2)
+            if kind == "uid":
+                return self.owner(("uid", key))[0]
+            if kind == "email":
+                if route == "/signup":
+                    return f"{BENCH_PREFIX}{uuid.uuid4().hex[:12]}@example.com"
+                return self.owner(("email", key))[1]
+            if kind == "password":
+                return BENCH_PASSWORD
+            if kind == "scan_token":
+                return self.make_token(random.choice(self.scan_ids))
+            if kind == "text":
+                return "Bench"
+            return m.group(0)
+        return PLACEHOLDER.sub(sub, value)
+
+    def request(self, record):
+        route = record.get("route")
+        client = PLACEHOLDER.match(record.get("client") or "")
+        headers = dict(record.get("headers") or {})
+        headers["X-Forwarded-For"] = self.client_ip(client.group(2) if client else "")
+        owner = record.get("owner")
+        return {
+            "route": f"{record['method']} {route or record['path']}",
+            "method": record["method"],
+            "path": self.fill(record["path"], route),
+            "query": self.fill(record.get("query") or {}, route),
+            "headers": headers,
+            "json": self.fill(record["json"], route) if "json" in record else None,
+            "form": self.fill(record["form"], route) if "form" in record else None,
+            "owner": self.owner(("uid", PLACEHOLDER.match(owner).group(2))) if owner else None,
+        }
+
+
+# -------------------------
+# Clients
+# -------------------------
+class TestClientRunner:
+    """In-process: one test client per (thread, owner) so sessions stick."""
+
+    def __init__(self, app, db, count_queries=True):
+        self.app = app
+        self.db = db
+        self.count_queries = count_queries
+        self.local = threading.local()
+
+    def _client(self, owner):
+        clients = getattr(self.local, "clients", None)
+        if clients is None:
+            clients = self.local.clients = {}
+        key = owner[0] if owner else None
+        if key not in clients:
+            client = self.app.test_client(use_cookies=owner is not None)
+            if owner:
+                with client.session_transaction() as s:
+                    s["owner_id"] = owner[0]
+                    s["owner_name"] = "Bench"
+            clients[key] = client
+        return clients[key]
+
+    def send(self, req):
+        client = self._client(req["owner"])
+        before = self.db.queries_on_this_thread()
+        start = time.perf_counter()
+        response = client.open(
+            req["path"], method=req["method"], query_string=req["query"],
+            headers=req["headers"], json=req["json"], data=req["form"],
+        )
+        response.get_data()     # drain streamed bodies
+        elapsed = time.perf_counter() - start
+        response.close()
+        queries = self.db.queries_on_this_thread() - before if self.count_queries else None
+        return response.status_code, elapsed, queries
+
+
+class HttpRunner:
+    """Against a running server; logs each bench owner in once per thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.local = threading.local()
+
+    def _opener(self, owner):
+        openers = getattr(self.local, "openers", None)
+        if openers is None:
+            openers = self.local.openers = {}
+        key = owner[0] if owner else None
+        if key not in openers:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+            if owner:
+                data = urllib.parse.urlencode({"email": owner[1], "password": BENCH_PASSWORD}).encode()
+                opener.open(self.base_url + "/login", data=data, timeout=30).read()
+            openers[key] = opener
+        return openers[key]
+
+    def send(self, req):
+        url = self.base_url + req["path"]
+        if req["query"]:
+            url += "?" + urllib.parse.urlencode(req["query"])
+        headers = dict(req["headers"])
+        data = None
+        if req["json"] is not None:
+            data = json.dumps(req["json"]).encode()
+            headers["Content-Type"] = "application/json"
+        elif req["form"] is not None:
+            data = urllib.parse.urlencode(req["form"]).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        request = urllib.request.Request(url, data=data, headers=headers, method=req["method"])
+        start = time.perf_counter()
+        try:
+            with self._opener(req["owner"]).open(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        return status, time.perf_counter() - start, None
+
+
+# -------------------------
+# Replay + report
+# -------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # nearest rank
+    rank = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s[1] * 1000 for s in samples)
+    statuses = Counter(str(s[0]) for s in samples)
+    queries = [s[2] for s in samples if s[2] is not None]
+    return {
+        "count": len(samples),
+        "errors": sum(1 for s in samples if s[0] == "error" or s[0] >= 500),
+        "statuses": dict(statuses),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "max_ms": round(latencies[-1], 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "queries_per_request": round(sum(queries) / len(queries), 3) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replay(traces=DEFAULT_TRACES, concurrency=8, repeat=1, url=None, ratelimit=False):
+    if not ratelimit:
+        os.environ.setdefault("RATELIMIT_ENABLED", "0")
+
+    with open(traces) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        sys.exit(f"{traces} has no requests")
+
+    import db
+    from flask import Flask
+    from scan_ingest import make_scan_token
+
+    if url:
+        runner = HttpRunner(url)
+        token_app = Flask(__name__)
+        token_app.secret_key = os.environ.get("SECRET_KEY")
+    else:
+        from app import app
+        from storage import storage
+        # Counted at the Postgres cursor / SQLite connection (db.record_query);
+        # offload.run credits its pool thread's queries to the request
+        db.count_queries()
+        runner = TestClientRunner(app, db)
+        token_app = app
+
+    owners, scan_ids = load_fixtures()
+
+    def make_token(scan_id):
+        with token_app.app_context():
+            return make_scan_token(scan_id)
+
+    fixtures = Fixtures(owners, scan_ids, make_token)
+    requests = [fixtures.request(r) for r in records] * repeat
+
+    def run(req):
+        try:
+            status, elapsed, queries = runner.send(req)
+        except Exception as e:
+            print(f"{req['route']}: {e}")
+            return req["route"], ("error", 0.0, None)
+        return req["route"], (status, elapsed, queries)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, requests))
+    elapsed = time.perf_counter() - start
+
+    by_route = defaultdict(list)
+    for route, sample in results:
+        by_route[route].append(sample)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "traces": traces,
+            "mode": "http" if url else "test-client",
+            "storage": None if url else storage.name,
+            "url": url,
+            "concurrency": concurrency,
+            "requests": len(requests),
+            "elapsed_s": round(elapsed, 3),
+            "python": sys.version.split()[0],
+        },
+        "total": summarize([s for _, s in results], elapsed),
+        "routes": {route: summarize(samples, elapsed) for route, samples in sorted(by_route.items())},
+    }
+
+
+def compare(old_path, new_path, threshold=10.0):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    regressed = False
+    print(f"{'route':32} {'p95 ms':>20} {'queries/req':>16}")
+    for route, stats in new["routes"].items():
+        before = old["routes"].get(route)
+        if before is None:
+            print(f"{route:32} {'(new)':>20}")
+            continue
+        cells = []
+        for key in ("p95_ms", "queries_per_request"):
+            a, b = before.get(key), stats.get(key)
+            if a is None or b is None:
+                cells.append("-")
+                continue
+            change = (b - a) / a * 100 if a else 0.0
+            if change > threshold:
+                regressed = True
+            cells.append(f"{a:g} -> {b:g} ({change:+.0f}%)")
+        print(f"{route:32} {cells[0]:>20} {cells[1]:>16}")
+    return 1 if regressed else 0
+
+
+# -------------------------
+# Sticker rendering
+# -------------------------
+def _timings(fn, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+    }
+
+
+def bench_stickers(count=200, template=None):
+    import shortcode
+    import sticker
+
+    template = template or sticker.DEFAULT_TEMPLATE
+    qr_spec = sticker.TEMPLATES[template]["qr"]
+    size = qr_spec["size"]
+    urls = [sticker.qr_url_for("https://bench.example.com", shortcode.encode(shortcode.new_short_id()))
+            for _ in range(count)]
+    # QR encoding is the same for both rasterisers: time it once, apart
+    qrs = [sticker.build_qr(url, template) for url in urls]
+    sticker.compile_template(template)
+
+    def pil_tile(qr):
+        qr.make_image(fill_color=qr_spec["color"], back_color=qr_spec["background"]) \
+            .convert("RGBA").resize((size, size))
+
+    def numpy_tile(qr):
+        sticker.rasterize_matrix(qr.get_matrix(), size, qr_spec["color"], qr_spec["background"])
+
+    report = {
+        "meta": {"commit": git_commit(), "template": template, "qr_size": size,
+                 "modules": len(qrs[0].get_matrix()), "numpy": sticker.np is not None},
+        "qr_encode": _timings(lambda url: sticker.build_qr(url, template), urls),
+        "tile_pil": _timings(pil_tile, qrs),
+    }
+    if sticker.np is not None:
+        sticker._cached_tile.cache_clear()
+        report["tile_numpy"] = _timings(numpy_tile, qrs)
+        report["tile_numpy_cached"] = _timings(
+            lambda qr: sticker.qr_tile(qr.get_matrix(), qr_spec), qrs[:1] * count
+        )
+    for rasterizer in ("pil", "numpy") if sticker.np is not None else ("pil",):
+        report[f"sticker_{rasterizer}"] = _timings(
+            lambda url: sticker.render_sticker(url, template, rasterizer), urls
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace replay benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("seed")
+    p.add_argument("--owners", type=int, default=200)
+    p.add_argument("--scans", type=int, default=50)
+
+    p = sub.add_parser("synth")
+    p.add_argument("--out", default=DEFAULT_TRACES)
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--owners", type=int, default=100)
+    p.add_argument("--seed", type=int, default=1)
+
+    p = sub.add_parser("replay")
+    p.add_argument("--traces", default=DEFAULT_TRACES)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--url")
+    p.add_argument("--ratelimit", action="store_true")
+    p.add_argument("--out")
+
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0)
+
+    p = sub.add_parser("stickers")
+    p.add_argument("--count", type=int, default=200)
+    p.add_argument("--template")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args.owners, args.scans)
+    elif args.command == "synth":
+        synth(args.out, args.requests, args.owners, seed_value=args.seed)
+    elif args.command == "replay":
+        report = replay(args.traces, args.concurrency, args.repeat, args.url, args.ratelimit)
+        output = json.dumps(report, indent=2)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(output + "\n")
+        print(output)
+    elif args.command == "compare":
+        sys.exit(compare(args.old, args.new, args.threshold))
+    elif args.command == "stickers":
+        print(json.dumps(bench_stickers(args.count, args.template), indent=2))
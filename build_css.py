@@ -0,0 +1,356 @@
+"""Build the site stylesheet from the utility classes the pages actually use.
+
+    python build_css.py
+
+Scans templates/*.html and the inline HTML in app.py for class names and
+writes static/css/<bundle>.<hash>.css for each bundle plus
+static/css/manifest.json mapping bundle names to the hashed files. Only
+the small Tailwind subset we use is supported; unknown classes are
+reported so they can be added to RULES below.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+CSS_DIR = "static/css"
+MANIFEST = os.path.join(CSS_DIR, "manifest.json")
+
+# bundle name -> source files. "scan.css" is the critical CSS inlined into
+# the public scan page, so it only covers that template.
+BUNDLES = {
+    "app.css": ["templates/*.html", "app.py"],
+    "scan.css": ["templates/scan.html"],
+}
+
+BREAKPOINTS = {"sm": "640px", "md": "768px", "lg": "1024px"}
+STATES = {"hover": ":hover", "focus": ":focus", "active": ":active"}
+
+
+# -------------------------
+# Design tokens (Tailwind v3 values)
+# -------------------------
+COLORS = {
+    "white": "#fff",
+    "black": "#000",
+    "transparent": "transparent",
+    "gray-50": "#f9fafb", "gray-100": "#f3f4f6", "gray-200": "#e5e7eb",
+    "gray-300": "#d1d5db", "gray-400": "#9ca3af", "gray-500": "#6b7280",
+    "gray-600": "#4b5563", "gray-700": "#374151", "gray-800": "#1f2937",
+    "gray-900": "#111827",
+    "blue-50": "#eff6ff", "blue-100": "#dbeafe", "blue-500": "#3b82f6",
+    "blue-600": "#2563eb", "blue-700": "#1d4ed8",
+    "green-50": "#f0fdf4", "green-100": "#dcfce7", "green-500": "#22c55e",
+    "green-600": "#16a34a", "green-700": "#15803d",
+    "red-50": "#fef2f2", "red-500": "#ef4444", "red-600": "#dc2626",
+    "red-700": "#b91c1c",
+    "purple-50": "#faf5ff", "purple-600": "#9333ea", "purple-700": "#7e22ce",
+    "yellow-50": "#fefce8", "yellow-100": "#fef9c3", "yellow-400": "#facc15",
+    "yellow-500": "#eab308",
+}
+
+FONT_SIZES = {
+    "xs": ("0.75rem", "1rem"),
+    "sm": ("0.875rem", "1.25rem"),
+    "base": ("1rem", "1.5rem"),
+    "lg": ("1.125rem", "1.75rem"),
+    "xl": ("1.25rem", "1.75rem"),
+    "2xl": ("1.5rem", "2rem"),
+    "3xl": ("1.875rem", "2.25rem"),
+    "4xl": ("2.25rem", "2.5rem"),
+}
+
+FONT_WEIGHTS = {"normal": 400, "medium": 500, "semibold": 600, "bold": 700}
+
+MAX_WIDTHS = {
+    "xs": "20rem", "sm": "24rem", "md": "28rem", "lg": "32rem", "xl": "36rem",
+    "2xl": "42rem", "3xl": "48rem", "4xl": "56rem", "5xl": "64rem",
+    "full": "100%",
+}
+
+RADII = {"": "0.25rem", "md": "0.375rem", "lg": "0.5rem", "xl": "0.75rem", "full": "9999px"}
+
+SHADOWS = {
+    "": "0 1px 3px 0 rgb(0 0 0 / .1), 0 1px 2px -1px rgb(0 0 0 / .1)",
+    "md": "0 4px 6px -1px rgb(0 0 0 / .1), 0 2px 4px -2px rgb(0 0 0 / .1)",
+    "lg": "0 10px 15px -3px rgb(0 0 0 / .1), 0 4px 6px -4px rgb(0 0 0 / .1)",
+}
+
+SPACING_SIDES = {
+    "p": ["padding"],
+    "px": ["padding-left", "padding-right"],
+    "py": ["padding-top", "padding-bottom"],
+    "pt": ["padding-top"], "pb": ["padding-bottom"],
+    "m": ["margin"],
+    "mx": ["margin-left", "margin-right"],
+    "my": ["margin-top", "margin-bottom"],
+    "mt": ["margin-top"], "mb": ["margin-bottom"],
+    "ml": ["margin-left"], "mr": ["margin-right"],
+}
+
+CHILDREN = ">:not([hidden])~:not([hidden])"
+
+STATIC = {
+    "block": "display:block",
+    "inline-block": "display:inline-block",
+    "hidden": "display:none",
+    "flex": "display:flex",
+    "grid": "display:grid",
+    "flex-col": "flex-direction:column",
+    "flex-row": "flex-direction:row",
+    "items-center": "align-items:center",
+    "justify-center": "justify-content:center",
+    "justify-between": "justify-content:space-between",
+    "mx-auto": "margin-left:auto;margin-right:auto",
+    "w-full": "width:100%",
+    "min-w-full": "min-width:100%",
+    "min-h-screen": "min-height:100vh",
+    "overflow-x-auto": "overflow-x:auto",
+    "break-all": "word-break:break-all",
+    "underline": "text-decoration-line:underline",
+    "text-left": "text-align:left",
+    "text-center": "text-align:center",
+    "text-right": "text-align:right",
+    "border": "border-width:1px",
+    "border-t": "border-top-width:1px",
+    "border-b": "border-bottom-width:1px",
+    "transition": "transition-property:color,background-color,border-color,"
+                  "box-shadow,transform;transition-timing-function:"
+                  "cubic-bezier(.4,0,.2,1);transition-duration:150ms",
+    "outline-none": "outline:2px solid transparent;outline-offset:2px",
+    "ring-2": "box-shadow:0 0 0 2px var(--ring-color,rgb(59 130 246 / .5))",
+    "scale-95": "transform:scale(.95)",
+}
+
+PREFLIGHT = (
+    "*,::before,::after{box-sizing:border-box;border:0 solid #e5e7eb}"
+    "html{line-height:1.5;-webkit-text-size-adjust:100%;font-family:ui-sans-serif,"
+    "system-ui,-apple-system,'Segoe UI',Roboto,'Helvetica Neue',Arial,sans-serif}"
+    "body{margin:0;line-height:inherit}"
+    "h1,h2,h3,h4,p{margin:0;font-size:inherit;font-weight:inherit}"
+    "a{color:inherit;text-decoration:inherit}"
+    "table{border-collapse:collapse;border-color:inherit;text-indent:0}"
+    "th{font-weight:inherit;text-align:inherit}"
+    "button,input{font:inherit;color:inherit;margin:0;padding:0;line-height:inherit}"
+    "button{background-color:transparent;background-image:none;cursor:pointer}"
+    "img{display:block;max-width:100%;height:auto}"
+    "[hidden]{display:none}"
+)
+
+
+def _spacing(value):
+    if value == "px":
+        return "1px"
+    if value == "0":
+        return "0"
+    return f"{float(value) * 0.25:g}rem"
+
+
+# -------------------------
+# Rules
+# -------------------------
+# Each rule maps a bare utility (no variant prefix) to
+# (selector suffix, declarations) or None. Rule order is output order.
+def _rule_static(name):
+    if name in STATIC:
+        return "", STATIC[name]
+
+
+def _rule_spacing(name):
+    m = re.fullmatch(r"(p|px|py|pt|pb|m|mx|my|mt|mb|ml|mr)-(px|\d+(?:\.\d+)?)", name)
+    if m:
+        value = _spacing(m.group(2))
+        return "", ";".join(f"{prop}:{value}" for prop in SPACING_SIDES[m.group(1)])
+
+
+def _rule_gap(name):
+    m = re.fullmatch(r"gap-(\d+(?:\.\d+)?)", name)
+    if m:
+        return "", f"gap:{_spacing(m.group(1))}"
+    m = re.fullmatch(r"space-y-(\d+(?:\.\d+)?)", name)
+    if m:
+        return CHILDREN, f"margin-top:{_spacing(m.group(1))}"
+
+
+def _rule_sizing(name):
+    m = re.fullmatch(r"(w|h)-(\d+(?:\.\d+)?)", name)
+    if m:
+        prop = "width" if m.group(1) == "w" else "height"
+        return "", f"{prop}:{_spacing(m.group(2))}"
+    m = re.fullmatch(r"max-w-(\w+)", name)
+    if m and m.group(1) in MAX_WIDTHS:
+        return "", f"max-width:{MAX_WIDTHS[m.group(1)]}"
+
+
+def _rule_grid(name):
+    m = re.fullmatch(r"grid-cols-(\d+)", name)
+    if m:
+        return "", f"grid-template-columns:repeat({m.group(1)},minmax(0,1fr))"
+
+
+def _rule_typography(name):
+    m = re.fullmatch(r"text-(\w+)", name)
+    if m and m.group(1) in FONT_SIZES:
+        size, line_height = FONT_SIZES[m.group(1)]
+        return "", f"font-size:{size};line-height:{line_height}"
+    m = re.fullmatch(r"font-(\w+)", name)
+    if m and m.group(1) in FONT_WEIGHTS:
+        return "", f"font-weight:{FONT_WEIGHTS[m.group(1)]}"
+
+
+def _rule_color(name):
+    m = re.fullmatch(r"(bg|text|border|divide|ring)-([a-z]+(?:-\d+)?)", name)
+    if not m or m.group(2) not in COLORS:
+        return None
+    kind, color = m.group(1), COLORS[m.group(2)]
+    if kind == "bg":
+        return "", f"background-color:{color}"
+    if kind == "text":
+        return "", f"color:{color}"
+    if kind == "border":
+        return "", f"border-color:{color}"
+    if kind == "ring":
+        return "", f"--ring-color:{color}"
+    return CHILDREN, f"border-color:{color}"
+
+
+def _rule_divide(name):
+    if name == "divide-y":
+        return CHILDREN, "border-top-width:1px"
+
+
+def _rule_decoration(name):
+    m = re.fullmatch(r"rounded(?:-(\w+))?", name)
+    if m and (m.group(1) or "") in RADII:
+        return "", f"border-radius:{RADII[m.group(1) or '']}"
+    m = re.fullmatch(r"shadow(?:-(\w+))?", name)
+    if m and (m.group(1) or "") in SHADOWS:
+        return "", f"box-shadow:{SHADOWS[m.group(1) or '']}"
+
+
+RULES = [
+    _rule_static,
+    _rule_grid,
+    _rule_sizing,
+    _rule_spacing,
+    _rule_gap,
+    _rule_divide,
+    _rule_decoration,
+    _rule_color,
+    _rule_typography,
+]
+
+
+# -------------------------
+# Extraction
+# -------------------------
+CLASS_ATTR = re.compile(r"""class(?:Name)?\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+def extract_classes(paths):
+    classes = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        for m in CLASS_ATTR.finditer(text):
+            value = m.group(1) if m.group(1) is not None else m.group(2)
+            # Drop Jinja / f-string expressions inside the attribute
+            value = re.sub(r"\{\{.*?\}\}|\{%.*?%\}|\{[^}]*\}", " ", value)
+            classes.update(value.split())
+    return classes
+
+
+def _escape(name):
+    return re.sub(r"([:./])", r"\\\1", name)
+
+
+def _compile(name):
+    variants = name.split(":")
+    base = variants.pop()
+    for index, rule in enumerate(RULES):
+        result = rule(base)
+        if result:
+            break
+    else:
+        return None
+
+    suffix, body = result
+    media = None
+    pseudo = ""
+    for variant in variants:
+        if variant in BREAKPOINTS and media is None:
+            media = BREAKPOINTS[variant]
+        elif variant in STATES:
+            pseudo += STATES[variant]
+        else:
+            return None
+
+    selector = f".{_escape(name)}{pseudo}{suffix}"
+    # Sort key: plain first, then state variants, then breakpoints
+    order = (media or "", 1 if pseudo else 0, index, name)
+    return order, media, f"{selector}{{{body}}}"
+
+
+def build_css(classes):
+    compiled = []
+    unknown = []
+    for name in classes:
+        result = _compile(name)
+        if result is None:
+            unknown.append(name)
+        else:
+            compiled.append(result)
+
+    compiled.sort(key=lambda item: item[0])
+    parts = [PREFLIGHT]
+    for media in [None] + sorted(set(BREAKPOINTS.values()), key=lambda v: int(v[:-2])):
+        rules = [css for _, m, css in compiled if m == media]
+        if not rules:
+            continue
+        if media is None:
+            parts.extend(rules)
+        else:
+            parts.append(f"@media (min-width:{media}){{{''.join(rules)}}}")
+    return "\n".join(parts) + "\n", sorted(unknown)
+
+
+# -------------------------
+# Main
+# -------------------------
+def main():
+    os.makedirs(CSS_DIR, exist_ok=True)
+    manifest = {}
+    status = 0
+
+    for bundle, patterns in BUNDLES.items():
+        paths = sorted(p for pattern in patterns for p in glob.glob(pattern))
+        css, unknown = build_css(extract_classes(paths))
+        if unknown:
+            print(f"{bundle}: unsupported classes: {' '.join(unknown)}", file=sys.stderr)
+            status = 1
+
+        digest = hashlib.sha256(css.encode()).hexdigest()[:10]
+        stem, ext = os.path.splitext(bundle)
+        filename = f"{stem}.{digest}{ext}"
+        with open(os.path.join(CSS_DIR, filename), "w", encoding="utf-8") as f:
+            f.write(css)
+        manifest[bundle] = f"css/{filename}"
+        print(f"{bundle} -> {CSS_DIR}/{filename} ({len(css)} bytes)")
+
+    # Remove stale hashed builds
+    current = {os.path.basename(path) for path in manifest.values()}
+    for path in glob.glob(os.path.join(CSS_DIR, "*.*.css")):
+        if os.path.basename(path) not in current:
+            os.remove(path)
+
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,386 @@
 import psycopg2
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 
-def get_db_connection():
-    conn = psycopg2.connect(
+
+# -------------------------
+# Pool settings
+# -------------------------
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", 1))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+# Connections idle for longer than this get a "SELECT 1" before reuse
+POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", 30))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _connect():
+    return psycopg2.connect(
         host=os.getenv("DB_HOST"),
         database=os.getenv("DB_NAME"),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         port=os.getenv("DB_PORT")
     )
+
+
+# -------------------------
+# Connection pool
+# -------------------------
+class ConnectionPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, check_after=POOL_CHECK_AFTER,
+                 connect=_connect):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, released_at)]
+        self._in_use = 0
+        self._waiting = 0
+        self._pid = os.getpid()
+
+        # Counters for sizing the pool
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    # After a gunicorn fork the child inherits the parent's sockets.
+    # Never use them: drop (without closing) and start from scratch.
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = 0
+        self._waiting = 0
+        self._pid = os.getpid()
+
+    def _healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.check_after:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        self._check_fork()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn = None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    metrics.DB_POOL_TIMEOUTS.inc()
+                    raise PoolTimeout(
+                        f"no database connection available after {self.timeout}s"
+                    )
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._checkouts += 1
+            if waited:
+                elapsed = time.monotonic() - start
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+
+        # Connect / health check outside the lock
+        try:
+            if conn is not None and not self._healthy(conn, released_at):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        metrics.DB_POOL_ACQUIRE.observe(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn):
+        if self._pid != os.getpid():
+            return
+
+        keep = not conn.closed
+        if keep:
+            # Reset session state so the next request gets a clean connection
+            try:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._discard(conn)
+
+    def fill(self):
+        # Warm the pool up to min_size
+        self._check_fork()
+        conns = []
+        with self._cond:
+            missing = self.min_size - len(self._idle) - self._in_use
+        for _ in range(max(missing, 0)):
+            conns.append(self._connect())
+        with self._cond:
+            for conn in conns:
+                self._idle.append((conn, time.monotonic()))
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def saturated(self, max_waiting):
+        # Every connection is checked out and max_waiting requests are
+        # already queued for one: a new request would only wait and time out
+        with self._cond:
+            return (not self._idle and self._in_use >= self.max_size
+                    and self._waiting >= max_waiting)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pid": self._pid,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 6),
+                "wait_time_max": round(self._max_wait, 6),
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+
+pool = ConnectionPool()
+
+
+# -------------------------
+# Pooled connection handle
+# -------------------------
+# Routes keep calling conn.close(); for a pooled connection that hands it
+# back to the pool instead of tearing down the socket.
+class PooledConnection:
+    def __init__(self, conn, owner):
+        self._conn = conn
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        if COUNT_QUERIES or metrics.METRICS_ENABLED:
+            return InstrumentedCursor(cursor)
+        return cursor
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._owner.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn is not None:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+
+
+# -------------------------
+# Query counting and timing
+# -------------------------
+# Every statement is timed into metrics.py (unless METRICS_ENABLED=0).
+# Per-thread counting is off unless count_queries() is called (bench.py
+# does, to report queries per request); a request in the test client runs
+# start to finish on one thread.
+COUNT_QUERIES = False
+_query_counts = threading.local()
+
+
+def count_queries(enabled=True):
+    global COUNT_QUERIES
+    COUNT_QUERIES = enabled
+
+
+def queries_on_this_thread():
+    return getattr(_query_counts, "n", 0)
+
+
+def add_queries(n):
+    # Queries another thread ran on this one's behalf (offload.run)
+    if n:
+        _query_counts.n = queries_on_this_thread() + n
+
+
+def record_query(query, seconds):
+    # Shared with storage_sqlite's connections
+    if COUNT_QUERIES:
+        _query_counts.n = queries_on_this_thread() + 1
+    metrics.observe_query(query, seconds)
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        object.__setattr__(self, "_cursor", cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - start)
+
+
+def _request_handles():
+    try:
+        from flask import g, has_app_context
+    except ImportError:
+        return None
+    if not has_app_context():
+        return None
+    if "_db_handles" not in g:
+        g._db_handles = []
+    return g._db_handles
+
+
+def get_db_connection():
+    conn = PooledConnection(pool.getconn(), pool)
+    handles = _request_handles()
+    if handles is not None:
+        handles.append(conn)
     return conn
+
+
+def release_request_connections(exc=None):
+    handles = _request_handles()
+    if not handles:
+        return
+    for conn in handles:
+        conn.close()
+    handles.clear()
+
+
+def pool_stats():
+    return pool.stats()
+
+
+def init_app(app):
+    # Anything a route forgot to close goes back to the pool (rolled back)
+    app.teardown_appcontext(release_request_connections)
+
+
+# -------------------------
+# Cooperative waits (gevent workers)
+# -------------------------
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def make_green():
+    # psycopg2 normally blocks the whole process in libpq; with a wait
+    # callback it polls the socket and lets other greenlets run meanwhile
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
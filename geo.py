@@ -0,0 +1,146 @@
+import math
+
+# Geohash: interleaved lon/lat bits in base32. Prefixes are coarser cells,
+# so a btree on the hash answers "inside this cell" with a range scan and
+# heatmaps are a GROUP BY on a prefix.
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DECODE = {ch: i for i, ch in enumerate(BASE32)}
+
+# What we store per scan: ~4.8m x 4.8m cells
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_M = 6371000
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_lo = mid
+            else:
+                value = value * 2
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value = value * 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def decode_bbox(geohash):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for ch in geohash:
+        value = DECODE[ch]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def decode(geohash):
+    lat_lo, lon_lo, lat_hi, lon_hi = decode_bbox(geohash)
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+
+
+def cell_size(precision):
+    # (height, width) in degrees
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+# -------------------------
+# Covering cells
+# -------------------------
+def cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Geohash prefixes whose cells together cover the box.
+
+    Uses the finest precision that needs at most max_cells cells.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(max_lat / height) - math.floor(min_lat / height) + 1
+        cols = math.floor(max_lon / width) - math.floor(min_lon / width) + 1
+        if rows * cols <= max_cells:
+            break
+
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode(min(lat, max_lat), min(lon, max_lon), precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + width, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + height, max_lat)
+    return sorted(cells)
+
+
+def radius_bbox(latitude, longitude, radius_m):
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    coslat = max(math.cos(math.radians(latitude)), 1e-6)
+    dlon = min(math.degrees(radius_m / (EARTH_RADIUS_M * coslat)), 180.0)
+    return (
+        max(latitude - dlat, -90.0),
+        max(longitude - dlon, -180.0),
+        min(latitude + dlat, 90.0),
+        min(longitude + dlon, 180.0),
+    )
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    # Haversine, same formula as scan_geo.DISTANCE_SQL
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def prefix_ranges_sql(column, prefixes, placeholder="%s"):
+    """SQL condition + params matching any of the prefixes with range scans.
+
+    The column must compare in byte order (Postgres: "C" collation, SQLite:
+    the default BINARY) so ranges line up with prefixes.
+    """
+    clauses = []
+    params = []
+    for prefix in prefixes:
+        clauses.append(f"({column} >= {placeholder} AND {column} < {placeholder})")
+        params.extend([prefix, prefix + "~"])
+    return "(" + " OR ".join(clauses) + ")", params
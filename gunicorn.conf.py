@@ -0,0 +1,42 @@
+"""Gunicorn settings (web: gunicorn -c gunicorn.conf.py app:app).
+
+GUNICORN_WORKER_CLASS picks the concurrency model per worker process:
+
+    gthread (default)  GUNICORN_THREADS requests at once on OS threads
+    gevent             GUNICORN_WORKER_CONNECTIONS greenlets (gevent is in
+                       requirements.txt); Postgres waits yield (db.make_green)
+
+Keep DB_POOL_MAX near the per-worker concurrency: requests beyond it wait
+for a connection (DB_POOL_TIMEOUT) or get shed (see ratelimit.py).
+
+Workers share metrics through METRICS_DIR (see metrics.py).
+"""
+import os
+import tempfile
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 20))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Don't preload: each worker imports the app after gevent has patched
+# threading, so module-level locks/conditions are greenlet-aware.
+preload_app = False
+
+# Set before the workers fork so they all inherit it
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "qr-vehicle-tag-metrics"))
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear_dir(os.environ["METRICS_DIR"])
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        import db
+        db.make_green()
+        print(f"Worker {worker.pid}: gevent, psycopg2 wait callback installed")
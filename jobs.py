@@ -0,0 +1,462 @@
+"""Durable background jobs in Postgres (the jobs table).
+
+    python jobs.py worker [--threads N]     run jobs (the Procfile "worker")
+    python jobs.py rerender --base-url https://letstrackme.com [--template v1] [--concurrency 4]
+    python jobs.py status ID
+
+A claim is one UPDATE over SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of worker threads and dynos share the table without handing a job
+out twice or queueing on each other's row locks. The claim commits at
+once and the job runs outside any transaction. A job that raises goes
+back to "queued" with run_at pushed out (JOB_BACKOFF_BASE * 2^attempt,
+capped at JOB_BACKOFF_MAX, jittered) until max_attempts, then stays
+"failed" with last_error. A worker that dies mid-job leaves it "running";
+after JOB_LOCK_TIMEOUT another worker puts it back in the queue, so jobs
+must finish well within that.
+
+    render_sticker   {owner_id, base_url, template}: what /generate used
+                     to do in the request. Only one per owner and template
+                     is queued or running at a time.
+    rerender_all     {base_url, template, concurrency}: every owner with a
+                     sticker, in id order, keeping at most `concurrency`
+                     render_sticker children queued or running. Between
+                     rounds it reschedules itself instead of holding a
+                     worker, and interactive renders only ever wait behind
+                     that many children.
+
+Status (GET /jobs/<id>, the dashboard polls it) is the row itself. Files
+a worker writes land on the worker's disk: with per-dyno disks run
+STICKER_WRITE_FILES=0, where /sticker/ renders on demand and the job
+pre-renders every variant into STICKER_DISK_CACHE if that is shared.
+
+Postgres only: with STORAGE_BACKEND=sqlite (or JOB_QUEUE=0) /generate
+renders inline as before.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+import psycopg2.extras
+
+from db import get_db_connection
+from shortcode import owner_code
+from sticker import DEFAULT_TEMPLATE, TEMPLATES, qr_url_for
+from sticker_cache import STICKER_DISK_CACHE, STICKER_WRITE_FILES, get_sticker
+from sticker_variants import STICKER_THUMB_SIZES, THUMB_FORMATS, render_variants, save_variants
+from sticker_vector import VECTOR_FORMATS, save_vector_files
+from storage import STORAGE_BACKEND, storage
+
+
+# -------------------------
+# Settings
+# -------------------------
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE", "1") == "1" and STORAGE_BACKEND == "postgres"
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", 10))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 3600))
+JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", 600))
+RERENDER_CONCURRENCY = int(os.getenv("RERENDER_CONCURRENCY", 4))
+
+OUTPUT_DIR = "static/qr"
+ACTIVE = ("queued", "running")
+STATUS_COLUMNS = ("id", "kind", "status", "owner_id", "parent_id", "attempts", "max_attempts",
+                  "run_at", "last_error", "result", "created_at", "finished_at")
+
+
+class JobFailed(Exception):
+    """Fails the job for good, without retries."""
+
+
+class Reschedule(Exception):
+    """Puts the job back in the queue without using up an attempt."""
+
+    def __init__(self, delay, payload=None, result=None):
+        super().__init__(delay)
+        self.delay = delay
+        self.payload = payload
+        self.result = result
+
+
+# -------------------------
+# Statements
+# -------------------------
+ENQUEUE_SQL = """
+    INSERT INTO jobs (kind, payload, owner_id, parent_id, dedupe_key, max_attempts)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (dedupe_key) DO NOTHING
+    RETURNING id
+"""
+ACTIVE_ID_SQL = "SELECT id FROM jobs WHERE dedupe_key = %s"
+CLAIM_SQL = """
+    UPDATE jobs
+    SET status = 'running', attempts = attempts + 1,
+        locked_at = now(), locked_by = %s
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND run_at <= now()
+        ORDER BY run_at, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, attempts, max_attempts
+"""
+DONE_SQL = """
+    UPDATE jobs
+    SET status = 'done', result = %s, finished_at = now(), dedupe_key = NULL,
+        locked_at = NULL, locked_by = NULL
+    WHERE id = %s
+"""
+RETRY_SQL = """
+    UPDATE jobs
+    SET status = 'queued', run_at = now() + make_interval(secs => %s), last_error = %s,
+        locked_at = NULL, locked_by = NULL
+    WHERE id = %s
+"""
+FAILED_SQL = """
+    UPDATE jobs
+    SET status = 'failed', last_error = %s, finished_at = now(), dedupe_key = NULL,
+        locked_at = NULL, locked_by = NULL
+    WHERE id = %s
+"""
+RESCHEDULE_SQL = """
+    UPDATE jobs
+    SET status = 'queued', run_at = now() + make_interval(secs => %s), attempts = attempts - 1,
+        payload = %s, result = %s, locked_at = NULL, locked_by = NULL
+    WHERE id = %s
+"""
+# Locks older than JOB_LOCK_TIMEOUT: the worker is gone
+REAP_SQL = """
+    UPDATE jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+        dedupe_key = CASE WHEN attempts >= max_attempts THEN NULL ELSE dedupe_key END,
+        run_at = now(), last_error = 'worker lost (locked by ' || locked_by || ')',
+        locked_at = NULL, locked_by = NULL
+    WHERE status = 'running' AND locked_at < now() - make_interval(secs => %s)
+    RETURNING id
+"""
+CHILD_COUNTS_SQL = "SELECT status, COUNT(*) FROM jobs WHERE parent_id = %s GROUP BY status"
+STICKER_OWNERS_SQL = """
+    SELECT id FROM owners
+    WHERE qr_path IS NOT NULL AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+STATUS_SQL = f"SELECT {', '.join(STATUS_COLUMNS)} FROM jobs WHERE id = %s"
+QUEUE_STATS_SQL = """
+    SELECT kind, status, COUNT(*),
+           EXTRACT(EPOCH FROM now() - MIN(run_at) FILTER (WHERE run_at <= now()))
+    FROM jobs
+    WHERE status IN ('queued', 'running') OR finished_at > now() - interval '1 hour'
+    GROUP BY kind, status
+"""
+
+
+def _execute(sql, params, fetch=None):
+    conn = get_db_connection()
+    c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor if fetch == "dict" else None)
+    try:
+        c.execute(sql, params)
+        rows = c.fetchall() if fetch else None
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+        conn.close()
+
+
+# -------------------------
+# Enqueueing
+# -------------------------
+def enqueue(kind, payload, owner_id=None, parent_id=None, dedupe_key=None,
+            max_attempts=JOB_MAX_ATTEMPTS):
+    """Queue a job and return its id.
+
+    With dedupe_key, a job with the same key that is still queued or
+    running (or waiting to retry) is returned instead of queueing a
+    second one.
+    """
+    params = (kind, psycopg2.extras.Json(payload), owner_id, parent_id, dedupe_key, max_attempts)
+    for _ in range(3):
+        rows = _execute(ENQUEUE_SQL, params, fetch=True)
+        if rows:
+            return rows[0][0]
+        rows = _execute(ACTIVE_ID_SQL, (dedupe_key,), fetch=True)
+        if rows:
+            return rows[0][0]
+        # Finished in between: queue a fresh one
+    raise RuntimeError(f"could not enqueue {kind} job {dedupe_key}")
+
+
+def enqueue_render(owner_id, base_url, template=DEFAULT_TEMPLATE, parent_id=None):
+    return enqueue(
+        "render_sticker",
+        {"owner_id": owner_id, "base_url": base_url, "template": template},
+        owner_id=owner_id,
+        parent_id=parent_id,
+        dedupe_key=f"render_sticker:{owner_id}:{template}",
+    )
+
+
+def enqueue_rerender(base_url, template=DEFAULT_TEMPLATE, concurrency=RERENDER_CONCURRENCY):
+    if template not in TEMPLATES:
+        raise ValueError(f"unknown template {template!r}")
+    return enqueue(
+        "rerender_all",
+        {"base_url": base_url, "template": template, "concurrency": concurrency,
+         "after": "", "exhausted": False},
+        dedupe_key=f"rerender_all:{template}",
+    )
+
+
+# -------------------------
+# Handlers
+# -------------------------
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def prerender_variants():
+    # (fmt, size) of everything the dashboard and downloads ask /sticker/ for
+    variants = [(fmt, None) for fmt in THUMB_FORMATS + VECTOR_FORMATS]
+    variants += [(fmt, size) for size in STICKER_THUMB_SIZES for fmt in THUMB_FORMATS]
+    return variants
+
+
+def render_owner_sticker(owner_id, base_url, template=DEFAULT_TEMPLATE):
+    """Render one owner's sticker and point owners.qr_path at it.
+
+    Same result as the old inline /generate; also what it still runs when
+    the queue is off.
+    """
+    card = storage.owner_card(owner_id)
+    if card is None:
+        raise JobFailed(f"no owner {owner_id}")
+    code = owner_code(owner_id, card.get("short_id"))
+    qr_url = qr_url_for(base_url, code)
+
+    if STICKER_WRITE_FILES:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        qr_path = f"{OUTPUT_DIR}/{owner_id}.png"
+        save_variants(render_variants(qr_url, template), qr_path)
+        save_vector_files(qr_url, qr_path, template)
+    else:
+        # /sticker/<code>.png renders on demand; warm a shared disk cache
+        qr_path = f"sticker/{code}.png"
+        if STICKER_DISK_CACHE:
+            for fmt, size in prerender_variants():
+                get_sticker(qr_url, template, fmt, size)
+
+    storage.set_qr_path(owner_id, qr_path)
+    return qr_path
+
+
+@handler("render_sticker")
+def render_sticker_job(payload, job):
+    qr_path = render_owner_sticker(
+        payload["owner_id"], payload["base_url"], payload.get("template", DEFAULT_TEMPLATE)
+    )
+    return {"qr_path": qr_path}
+
+
+def child_counts(job_id):
+    rows = _execute(CHILD_COUNTS_SQL, (job_id,), fetch=True)
+    return {status: count for status, count in rows}
+
+
+@handler("rerender_all")
+def rerender_all_job(payload, job):
+    counts = child_counts(job["id"])
+    outstanding = sum(counts.get(status, 0) for status in ACTIVE)
+
+    room = payload["concurrency"] - outstanding
+    if room > 0 and not payload["exhausted"]:
+        owner_ids = [row[0] for row in _execute(STICKER_OWNERS_SQL, (payload["after"], room), fetch=True)]
+        for owner_id in owner_ids:
+            enqueue_render(owner_id, payload["base_url"], payload["template"], parent_id=job["id"])
+        if owner_ids:
+            payload["after"] = owner_ids[-1]
+        payload["exhausted"] = len(owner_ids) < room
+        counts["queued"] = counts.get("queued", 0) + len(owner_ids)
+        outstanding += len(owner_ids)
+
+    progress = {
+        "template": payload["template"],
+        "enqueued": sum(counts.values()),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "outstanding": outstanding,
+    }
+    if payload["exhausted"] and not outstanding:
+        return progress
+    raise Reschedule(JOB_POLL_INTERVAL, payload, progress)
+
+
+# -------------------------
+# Running jobs
+# -------------------------
+def claim(worker_name):
+    rows = _execute(CLAIM_SQL, (worker_name,), fetch="dict")
+    return dict(rows[0]) if rows else None
+
+
+def backoff(attempts):
+    delay = min(JOB_BACKOFF_BASE * 2 ** (attempts - 1), JOB_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def run_job(job):
+    func = HANDLERS.get(job["kind"])
+    start = time.perf_counter()
+    try:
+        if func is None:
+            raise JobFailed(f"unknown job kind {job['kind']!r}")
+        result = func(job["payload"], job)
+    except Reschedule as r:
+        payload = job["payload"] if r.payload is None else r.payload
+        _execute(RESCHEDULE_SQL, (r.delay, psycopg2.extras.Json(payload),
+                                  psycopg2.extras.Json(r.result), job["id"]))
+        return "rescheduled"
+    except JobFailed as e:
+        _execute(FAILED_SQL, (str(e), job["id"]))
+        print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+        return "failed"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] >= job["max_attempts"]:
+            _execute(FAILED_SQL, (error, job["id"]))
+            print(f"Job {job['id']} ({job['kind']}) failed after {job['attempts']} attempts: {error}")
+            return "failed"
+        delay = backoff(job["attempts"])
+        _execute(RETRY_SQL, (delay, error, job["id"]))
+        print(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, "
+              f"retrying in {delay:.0f}s: {error}")
+        return "retry"
+
+    _execute(DONE_SQL, (psycopg2.extras.Json(result), job["id"]))
+    print(f"Job {job['id']} ({job['kind']}) done in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return "done"
+
+
+def reap_stale():
+    rows = _execute(REAP_SQL, (JOB_LOCK_TIMEOUT,), fetch=True)
+    if rows:
+        print(f"Requeued {len(rows)} jobs from lost workers")
+    return len(rows)
+
+
+def _work_loop(stop, worker_name, reaper):
+    last_reap = 0.0
+    while not stop.is_set():
+        try:
+            if reaper and time.monotonic() - last_reap > JOB_LOCK_TIMEOUT / 4:
+                last_reap = time.monotonic()
+                reap_stale()
+            job = claim(worker_name)
+            if job is None:
+                stop.wait(JOB_POLL_INTERVAL)
+                continue
+            # A job that can't record its outcome stays "running" and is
+            # reaped after JOB_LOCK_TIMEOUT
+            run_job(job)
+        except Exception as e:
+            print(f"Job worker {worker_name} error:", e)
+            stop.wait(JOB_POLL_INTERVAL)
+
+
+def work(threads=JOB_WORKER_THREADS):
+    # Rendering is CPU-bound: scale with more worker processes/dynos
+    # rather than many threads. SIGTERM (dyno restart) lets current jobs
+    # finish; anything cut off is reaped later.
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    workers = [
+        threading.Thread(target=_work_loop, args=(stop, f"{name}:{i}", i == 0),
+                         name=f"job-worker-{i}", daemon=True)
+        for i in range(threads)
+    ]
+    for t in workers:
+        t.start()
+    print(f"Job worker {name} started with {threads} threads")
+    while any(t.is_alive() for t in workers):
+        for t in workers:
+            t.join(timeout=1)
+    print(f"Job worker {name} stopped")
+
+
+# -------------------------
+# Status
+# -------------------------
+def _public(row):
+    job = dict(row)
+    for key in ("run_at", "created_at", "finished_at"):
+        if job[key] is not None:
+            job[key] = job[key].isoformat()
+    return job
+
+
+def job_status(job_id):
+    rows = _execute(STATUS_SQL, (job_id,), fetch="dict")
+    return _public(rows[0]) if rows else None
+
+
+def queue_stats():
+    stats = {}
+    for kind, status, count, oldest in _execute(QUEUE_STATS_SQL, (), fetch=True):
+        entry = stats.setdefault(kind, {})
+        entry[status] = count
+        if status == "queued" and oldest is not None:
+            entry["oldest_ready_s"] = round(float(oldest), 1)
+    return stats
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("worker", help="claim and run jobs until SIGTERM")
+    p.add_argument("--threads", type=int, default=JOB_WORKER_THREADS)
+    p = sub.add_parser("rerender", help="queue a re-render of every issued sticker")
+    p.add_argument("--base-url", required=True, help="public site URL used in the QR")
+    p.add_argument("--template", default=DEFAULT_TEMPLATE, choices=sorted(TEMPLATES))
+    p.add_argument("--concurrency", type=int, default=RERENDER_CONCURRENCY)
+    p = sub.add_parser("status", help="print a job")
+    p.add_argument("job_id", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        work(args.threads)
+    elif args.command == "rerender":
+        job_id = enqueue_rerender(args.base_url, args.template, args.concurrency)
+        print(f"queued rerender_all job {job_id}: python jobs.py status {job_id}")
+    else:
+        job = job_status(args.job_id)
+        if job is None:
+            sys.exit(f"no job {args.job_id}")
+        print(json.dumps(job, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Prometheus-style metrics, served as text on /metrics.
+
+    http_request_duration_seconds   per route and method (streamed
+                                    responses until the last chunk)
+    http_requests_total             per route, method and status
+    db_query_duration_seconds       per statement label ("insert scan_logs",
+                                    "select owners", ...), Postgres or SQLite
+    db_pool_acquire_seconds         waiting for + opening a pooled connection
+    sticker_render_seconds          per stage: qr_encode, composite, and
+                                    <variant>_encode per output file
+    sticker_bytes_total             encoded bytes per output variant
+    scans_total                     /q/<uid> hits per outcome (logged,
+                                    duplicate, bot, head, prefetch)
+    scan_rows_written_total         scan / location rows actually written
+
+Recording is a dict update under a per-metric lock. Under gunicorn every
+worker has its own registry; with METRICS_DIR set (gunicorn.conf.py sets
+it) each worker writes a snapshot to METRICS_DIR/<pid>.json every
+METRICS_FLUSH_INTERVAL seconds, and /metrics sums all snapshots, so
+whichever worker answers the scrape reports the whole dyno. Snapshots of
+exited workers are kept so counters never go backwards; the directory is
+cleared when the gunicorn master starts.
+
+METRICS_TOKEN, when set, is required as "Authorization: Bearer <token>".
+"""
+import atexit
+import functools
+import glob
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+ACQUIRE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5)
+RENDER_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REGISTRY = []
+
+
+# -------------------------
+# Metric types
+# -------------------------
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {_key(labels): value for labels, value in self._values.items()}
+
+    def merge(self, total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, json.loads(key))} {_num(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> per-bucket counts (last one is +Inf), then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {_key(labels): list(series) for labels, series in self._series.items()}
+
+    def merge(self, total, values):
+        for key, series in values.items():
+            if key not in total:
+                total[key] = list(series)
+            elif len(total[key]) == len(series):
+                total[key] = [a + b for a, b in zip(total[key], series)]
+
+    def render(self, values):
+        bounds = [_num(b) for b in self.buckets] + ["+Inf"]
+        for key, series in sorted(values.items()):
+            label_values = json.loads(key)
+            cumulative = 0
+            for bound, n in zip(bounds, series):
+                cumulative += n
+                le = _labels(self.labels + ("le",), label_values + [bound])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_num(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def _key(labels):
+    return json.dumps([str(v) for v in labels])
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# -------------------------
+# Metrics
+# -------------------------
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ("method", "route"), LATENCY_BUCKETS
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests by route and status", ("method", "route", "status")
+)
+DB_QUERY = Histogram(
+    "db_query_duration_seconds", "Database statement latency by statement label",
+    ("statement",), QUERY_BUCKETS
+)
+DB_POOL_ACQUIRE = Histogram(
+    "db_pool_acquire_seconds", "Time to get a connection from the pool",
+    (), ACQUIRE_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Pool checkouts that gave up waiting"
+)
+STICKER_RENDER = Histogram(
+    "sticker_render_seconds", "Sticker rendering time by stage", ("stage",), RENDER_BUCKETS
+)
+STICKER_BYTES = Counter(
+    "sticker_bytes_total", "Encoded sticker bytes by variant", ("variant",)
+)
+SCANS = Counter(
+    "scans_total", "QR page hits by outcome", ("outcome",)
+)
+SCAN_ROWS = Counter(
+    "scan_rows_written_total", "Scan and location rows written", ("kind",)
+)
+
+
+# -------------------------
+# Statement labels
+# -------------------------
+# "insert scan_logs", "update owner_scan_stats", "select owners": the first
+# write in the statement (CTEs included) wins over a SELECT. Only the head
+# of the statement is read; execute_values puts its rows after it.
+WRITE_STATEMENT = re.compile(
+    r"\b(?:(INSERT)\s+INTO|(?<!DO\s)(UPDATE)|(DELETE)\s+FROM)\s+([A-Za-z_][\w.]*)", re.IGNORECASE
+)
+SELECT_FROM = re.compile(r"\bSELECT\b.*?\bFROM\s+([A-Za-z_][\w.]*)", re.IGNORECASE | re.DOTALL)
+FIRST_WORD = re.compile(r"\s*([A-Za-z]+)")
+LABEL_HEAD = 400
+
+
+def statement_label(sql):
+    if isinstance(sql, bytes):
+        sql = sql[:LABEL_HEAD].decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        return "other"
+    return _statement_label(sql[:LABEL_HEAD])
+
+
+@functools.lru_cache(maxsize=256)
+def _statement_label(head):
+    m = WRITE_STATEMENT.search(head)
+    if m:
+        verb = m.group(1) or m.group(2) or m.group(3)
+        return f"{verb.lower()} {m.group(4).lower()}"
+    m = SELECT_FROM.search(head)
+    if m:
+        return f"select {m.group(1).lower()}"
+    m = FIRST_WORD.match(head)
+    return m.group(1).lower() if m else "other"
+
+
+def observe_query(sql, seconds):
+    DB_QUERY.observe(seconds, statement_label(sql))
+
+
+# -------------------------
+# Worker snapshots
+# -------------------------
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def snapshot():
+    return {m.name: m.snapshot() for m in REGISTRY}
+
+
+def write_snapshot(directory=METRICS_DIR):
+    if not directory:
+        return
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print("Metrics snapshot not written:", e)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        write_snapshot()
+
+
+def start_flusher():
+    # Once per process; a forked child starts its own
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(write_snapshot)
+
+
+def collect(directory=METRICS_DIR):
+    if not directory:
+        return snapshot()
+    write_snapshot(directory)
+    totals = {m.name: {} for m in REGISTRY}
+    by_name = {m.name: m for m in REGISTRY}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, values in data.items():
+            if name in by_name:
+                by_name[name].merge(totals[name], values)
+    return totals
+
+
+def clear_dir(directory=METRICS_DIR):
+    # gunicorn master on start: snapshots from the previous run are stale
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def exposition(values=None):
+    values = collect() if values is None else values
+    lines = []
+    for m in REGISTRY:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.render(values.get(m.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------
+# Flask integration
+# -------------------------
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        start_flusher()
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def keep_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    # Teardown runs after a streamed body has been sent in full
+    @app.teardown_request
+    def record_request(exc=None):
+        start = g.pop("_metrics_start", None)
+        if start is None:
+            return
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = 500 if exc is not None else g.pop("_metrics_status", 500)
+        HTTP_DURATION.observe(time.perf_counter() - start, request.method, route)
+        HTTP_REQUESTS.inc(request.method, route, status)
+
+    @app.route("/metrics")
+    def metrics():
+        if METRICS_TOKEN:
+            auth = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+                return "Forbidden", 403
+        return Response(exposition(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,170 @@
+"""Versioned Postgres migrations.
+
+    python migrate.py            apply everything pending
+    python migrate.py status     list applied / pending versions
+    python migrate.py contract   also apply "contract" migrations
+
+Migrations live in migrations/ as NNNN_name.sql or NNNN_name.py (with an
+up(conn) function) and run in version order. Each one runs in its own
+transaction and is recorded in schema_migrations. A .sql file whose first
+line is "-- migrate: no-transaction" runs statement by statement in
+autocommit mode instead, which CREATE INDEX CONCURRENTLY needs.
+
+A .sql file whose first line is "-- migrate: contract" removes something
+the previous release still uses (a column it writes, say). The release
+phase runs before the old dynos stop, so plain `migrate.py` holds these
+back. Run `migrate.py contract` once the release that stopped using it
+is the only one serving traffic.
+"""
+import importlib.util
+import os
+import re
+import sys
+
+from db import get_db_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION = "-- migrate: no-transaction"
+CONTRACT = "-- migrate: contract"
+# Arbitrary constant so two deploys never migrate at the same time
+LOCK_ID = 727001
+
+
+def discover():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = re.fullmatch(r"(\d{4})_(\w+)\.(sql|py)", filename)
+        if m:
+            migrations.append((m.group(1), m.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def is_contract(path):
+    if not path.endswith(".sql"):
+        return False
+    with open(path) as f:
+        return f.readline().startswith(CONTRACT)
+
+
+def _ensure_table(conn):
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    c.close()
+
+
+def applied_versions(conn):
+    c = conn.cursor()
+    c.execute("SELECT version FROM schema_migrations")
+    versions = {row[0] for row in c.fetchall()}
+    c.close()
+    return versions
+
+
+def _split_statements(sql):
+    # Good enough for the plain DDL used in no-transaction migrations
+    # (no $$ bodies or semicolons inside strings).
+    return [s.strip() for s in re.split(r";\s*(?:\n|$)", sql) if s.strip()]
+
+
+def _record(c, version, name):
+    c.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+        (version, name)
+    )
+
+
+def apply(conn, version, name, path):
+    if path.endswith(".py"):
+        spec = importlib.util.spec_from_file_location(f"migration_{version}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        conn.autocommit = False
+        module.up(conn)
+        c = conn.cursor()
+        _record(c, version, name)
+        conn.commit()
+        c.close()
+        return
+
+    with open(path) as f:
+        sql = f.read()
+
+    if sql.startswith(NO_TRANSACTION):
+        conn.autocommit = True
+        c = conn.cursor()
+        for statement in _split_statements(sql):
+            c.execute(statement)
+        _record(c, version, name)
+        c.close()
+        return
+
+    conn.autocommit = False
+    c = conn.cursor()
+    c.execute(sql)
+    _record(c, version, name)
+    conn.commit()
+    c.close()
+
+
+def migrate(contract=False):
+    conn = get_db_connection()
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+    try:
+        _ensure_table(conn)
+        done = applied_versions(conn)
+        pending = [m for m in discover() if m[0] not in done]
+        held = [] if contract else [m for m in pending if is_contract(m[2])]
+        pending = [m for m in pending if m not in held]
+        if not pending:
+            print("Database is up to date")
+        for version, name, _ in held:
+            print(f"Holding back {version}_{name} (run: python migrate.py contract)")
+        for version, name, path in pending:
+            print(f"Applying {version}_{name} ...")
+            try:
+                apply(conn, version, name, path)
+            except Exception:
+                if not conn.autocommit:
+                    conn.rollback()
+                print(f"Migration {version}_{name} failed. If it builds an index "
+                      "CONCURRENTLY, drop the INVALID index it left behind before retrying.")
+                raise
+    finally:
+        conn.autocommit = True
+        c.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+        c.close()
+        conn.close()
+
+
+def status():
+    conn = get_db_connection()
+    conn.autocommit = True
+    _ensure_table(conn)
+    done = applied_versions(conn)
+    conn.close()
+    for version, name, path in discover():
+        if version in done:
+            state = "applied"
+        else:
+            state = "held   " if is_contract(path) else "pending"
+        print(f"{state}  {version}_{name}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if command == "up":
+        migrate()
+    elif command == "contract":
+        migrate(contract=True)
+    elif command == "status":
+        status()
+    else:
+        sys.exit(__doc__)
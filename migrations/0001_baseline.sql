@@ -0,0 +1,24 @@
+-- Schema as it existed before migrations were tracked. Safe to run on a
+-- database that already has these tables.
+CREATE TABLE IF NOT EXISTS owners (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    phone TEXT,
+    vehicle TEXT,
+    email TEXT,
+    password_hash TEXT,
+    qr_path TEXT
+);
+
+CREATE TABLE IF NOT EXISTS scan_logs (
+    id SERIAL PRIMARY KEY,
+    owner_id TEXT REFERENCES owners(id),
+    scanned_at TEXT,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    map_link TEXT
+);
+
+ALTER TABLE scan_logs ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+ALTER TABLE scan_logs ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+ALTER TABLE scan_logs ADD COLUMN IF NOT EXISTS map_link TEXT;
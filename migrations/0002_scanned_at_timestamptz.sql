@@ -0,0 +1,19 @@
+-- scanned_at used to be written as a "%Y-%m-%d %H:%M:%S" string in the
+-- app server's local time. Existing values are read in the session
+-- TimeZone, so run this with that zone set (e.g. PGTZ=Asia/Kolkata).
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'scan_logs' AND column_name = 'scanned_at') <> 'timestamp with time zone' THEN
+        ALTER TABLE scan_logs
+            ALTER COLUMN scanned_at TYPE TIMESTAMPTZ
+            USING NULLIF(scanned_at::text, '')::timestamptz;
+    END IF;
+END
+$$;
+
+UPDATE scan_logs SET scanned_at = now() WHERE scanned_at IS NULL;
+
+ALTER TABLE scan_logs
+    ALTER COLUMN scanned_at SET DEFAULT now(),
+    ALTER COLUMN scanned_at SET NOT NULL;
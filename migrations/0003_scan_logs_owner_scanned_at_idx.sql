@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Dashboard total/last scan/history all filter on owner_id and order by
+-- scanned_at. id breaks ties between scans in the same instant.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scan_logs_owner_scanned_at_idx
+    ON scan_logs (owner_id, scanned_at DESC, id DESC);
@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- login() looks owners up by email. Fails if duplicate emails already
+-- exist; clean those up first.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS owners_email_key
+    ON owners (email);
@@ -0,0 +1,28 @@
+-- One row per owner with the numbers the dashboard header needs, kept up
+-- to date alongside scan inserts and location updates (see scan_stats.py).
+CREATE TABLE IF NOT EXISTS owner_scan_stats (
+    owner_id TEXT PRIMARY KEY REFERENCES owners(id) ON DELETE CASCADE,
+    total_scans BIGINT NOT NULL DEFAULT 0,
+    last_scan_at TIMESTAMPTZ,
+    last_latitude DOUBLE PRECISION,
+    last_longitude DOUBLE PRECISION,
+    last_located_at TIMESTAMPTZ
+);
+
+INSERT INTO owner_scan_stats
+    (owner_id, total_scans, last_scan_at, last_latitude, last_longitude, last_located_at)
+SELECT o.id, COALESCE(c.total_scans, 0), c.last_scan_at,
+       l.latitude, l.longitude, l.scanned_at
+FROM owners o
+LEFT JOIN (
+    SELECT owner_id, COUNT(*) AS total_scans, MAX(scanned_at) AS last_scan_at
+    FROM scan_logs
+    GROUP BY owner_id
+) c ON c.owner_id = o.id
+LEFT JOIN (
+    SELECT DISTINCT ON (owner_id) owner_id, latitude, longitude, scanned_at
+    FROM scan_logs
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ORDER BY owner_id, scanned_at DESC, id DESC
+) l ON l.owner_id = o.id
+ON CONFLICT (owner_id) DO NOTHING;
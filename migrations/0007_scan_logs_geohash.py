@@ -0,0 +1,38 @@
+"""Geohash column for scan locations, backfilled from latitude/longitude.
+
+The "C" collation keeps comparisons in byte order so prefix lookups on the
+hash are plain btree range scans (see geo.prefix_ranges_sql).
+"""
+import psycopg2.extras
+
+import geo
+
+BATCH_SIZE = 5000
+
+
+def up(conn):
+    c = conn.cursor()
+    c.execute('ALTER TABLE scan_logs ADD COLUMN IF NOT EXISTS geohash TEXT COLLATE "C"')
+
+    read = conn.cursor(name="geohash_backfill")
+    read.itersize = BATCH_SIZE
+    read.execute("""
+        SELECT id, latitude, longitude FROM scan_logs
+        WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+    """)
+    total = 0
+    while True:
+        rows = read.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        psycopg2.extras.execute_values(
+            c,
+            "UPDATE scan_logs AS s SET geohash = v.geohash "
+            "FROM (VALUES %s) AS v(id, geohash) WHERE s.id = v.id",
+            [(scan_id, geo.encode(lat, lon)) for scan_id, lat, lon in rows],
+            page_size=BATCH_SIZE,
+        )
+        total += len(rows)
+    read.close()
+    c.close()
+    print(f"  geohash backfilled for {total} scans")
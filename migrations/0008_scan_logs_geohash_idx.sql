@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Nearby/bbox queries range-scan geohash prefixes across all scans; the
+-- owner index lets the dashboard heatmap GROUP BY a prefix from the index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scan_logs_geohash_idx
+    ON scan_logs (geohash) WHERE geohash IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scan_logs_owner_geohash_idx
+    ON scan_logs (owner_id, geohash) WHERE geohash IS NOT NULL;
@@ -0,0 +1,44 @@
+"""Short id behind the /q/<code> short codes (shortcode.py), backfilled
+with random, distinct values for existing owners.
+
+The unique index is built concurrently in the next migration.
+"""
+import psycopg2.extras
+
+import shortcode
+
+BATCH_SIZE = 5000
+
+
+def up(conn):
+    c = conn.cursor()
+    c.execute("ALTER TABLE owners ADD COLUMN IF NOT EXISTS short_id BIGINT")
+
+    read = conn.cursor(name="short_id_backfill")
+    read.itersize = BATCH_SIZE
+    read.execute("SELECT id FROM owners WHERE short_id IS NULL")
+    # Drawn from one set so the backfill itself can't collide
+    used = set()
+    total = 0
+    while True:
+        rows = read.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        values = []
+        for (owner_id,) in rows:
+            short_id = shortcode.new_short_id()
+            while short_id in used:
+                short_id = shortcode.new_short_id()
+            used.add(short_id)
+            values.append((owner_id, short_id))
+        psycopg2.extras.execute_values(
+            c,
+            "UPDATE owners AS o SET short_id = v.short_id "
+            "FROM (VALUES %s) AS v(id, short_id) WHERE o.id = v.id",
+            values,
+            page_size=BATCH_SIZE,
+        )
+        total += len(rows)
+    read.close()
+    c.close()
+    print(f"  short_id backfilled for {total} owners")
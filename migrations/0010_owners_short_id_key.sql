@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- /q/<code> looks owners up by short_id; unique so a code names one owner.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS owners_short_id_key ON owners (short_id);
@@ -0,0 +1,31 @@
+-- Background job queue (see jobs.py). Workers claim the oldest ready row
+-- with FOR UPDATE SKIP LOCKED. dedupe_key is cleared when a job ends
+-- (done or failed), so one identical job can be queued or running at a time.
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    owner_id TEXT REFERENCES owners(id) ON DELETE CASCADE,
+    parent_id BIGINT REFERENCES jobs(id) ON DELETE SET NULL,
+    dedupe_key TEXT UNIQUE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_at TIMESTAMPTZ,
+    locked_by TEXT,
+    last_error TEXT,
+    result JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+-- The claim query: ready jobs in run_at order
+CREATE INDEX IF NOT EXISTS jobs_ready_idx ON jobs (run_at, id) WHERE status = 'queued';
+-- Stale locks left by workers that died
+CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs (locked_at) WHERE status = 'running';
+-- The dashboard's latest job for an owner
+CREATE INDEX IF NOT EXISTS jobs_owner_idx ON jobs (owner_id, id DESC) WHERE owner_id IS NOT NULL;
+-- Progress of a bulk job's children
+CREATE INDEX IF NOT EXISTS jobs_parent_idx ON jobs (parent_id, status) WHERE parent_id IS NOT NULL;
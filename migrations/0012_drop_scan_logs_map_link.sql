@@ -0,0 +1,6 @@
+-- migrate: contract
+-- map_link was a Google Maps URL derived from latitude/longitude and
+-- stored on every row; it is now built at render time. Dynos from the
+-- release before that still insert it, so this only runs once they are
+-- gone: python migrate.py contract (see migrate.py).
+ALTER TABLE scan_logs DROP COLUMN IF EXISTS map_link;
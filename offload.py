@@ -0,0 +1,120 @@
+"""Bounded executor for CPU-heavy request work (password hashing, sticker
+rendering).
+
+Request threads/greenlets hand the work to a small pool of native threads
+and wait for the result, so at most OFFLOAD_THREADS such jobs run per
+worker and scan traffic keeps the rest of the CPU. Callers that can't get
+a slot within OFFLOAD_WAIT seconds get OffloadBusy (a 503) instead of
+queueing without bound.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+OFFLOAD_THREADS = int(os.getenv("OFFLOAD_THREADS", 2))
+# Jobs allowed to wait for a thread, on top of the running ones
+OFFLOAD_QUEUE = int(os.getenv("OFFLOAD_QUEUE", 8))
+OFFLOAD_WAIT = float(os.getenv("OFFLOAD_WAIT", 5))
+
+
+class OffloadBusy(Exception):
+    pass
+
+
+def _counted(counts, fn, args, kwargs):
+    # On the pool thread: note the queries fn ran so run() can credit them
+    # to the calling request (bench's queries per request)
+    before = db.queries_on_this_thread()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        counts.append(db.queries_on_this_thread() - before)
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+class Offloader:
+    def __init__(self, threads=OFFLOAD_THREADS, queue_size=OFFLOAD_QUEUE, wait=OFFLOAD_WAIT):
+        self.threads = threads
+        self.queue_size = queue_size
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+
+        self.submitted = 0
+        self.rejected = 0
+
+    # Threads don't survive a fork: build the pool in the process that uses it
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if _gevent_patched():
+                # Patched threading would give greenlets; gevent's pool
+                # runs on real threads and wakes the hub when done
+                from gevent.threadpool import ThreadPoolExecutor as GeventExecutor
+                self._executor = GeventExecutor(max_workers=self.threads)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="offload"
+                )
+            self._slots = threading.BoundedSemaphore(self.threads + self.queue_size)
+            self._pid = os.getpid()
+
+    def run(self, fn, *args, **kwargs):
+        self._ensure_started()
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            raise OffloadBusy(f"{fn.__name__}: no free slot after {self.wait}s")
+        try:
+            with self._lock:
+                self.submitted += 1
+            if not db.COUNT_QUERIES:
+                return self._executor.submit(fn, *args, **kwargs).result()
+            counts = []
+            try:
+                return self._executor.submit(_counted, counts, fn, args, kwargs).result()
+            finally:
+                db.add_queries(sum(counts))
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threads": self.threads,
+                "queue_size": self.queue_size,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+            }
+
+
+offloader = Offloader()
+
+
+def run(fn, *args, **kwargs):
+    return offloader.run(fn, *args, **kwargs)
+
+
+def offload_stats():
+    return offloader.stats()
+
+
+def init_app(app):
+    @app.errorhandler(OffloadBusy)
+    def busy(e):
+        print("Offload busy:", e)
+        return "Server busy, please try again shortly.", 503, {"Retry-After": "1"}
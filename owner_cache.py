@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------
+# Settings
+# -------------------------
+OWNER_CACHE_SIZE = int(os.getenv("OWNER_CACHE_SIZE", 10000))
+OWNER_CACHE_TTL = float(os.getenv("OWNER_CACHE_TTL", 300))
+# Unknown UIDs are remembered for less time, in case the owner signs up
+OWNER_CACHE_NEGATIVE_TTL = float(os.getenv("OWNER_CACHE_NEGATIVE_TTL", 60))
+
+MISSING = object()
+
+
+# -------------------------
+# LRU + TTL cache
+# -------------------------
+# Per process: invalidate() only reaches the worker that handled the
+# change, other workers pick it up when the TTL runs out.
+class TTLCache:
+    def __init__(self, maxsize=OWNER_CACHE_SIZE, ttl=OWNER_CACHE_TTL,
+                 negative_ttl=OWNER_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()      # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if entry[1] is MISSING:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        ttl = self.negative_ttl if value is MISSING else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+cards = TTLCache()
+# short code -> owner id
+codes = TTLCache()
+
+
+# -------------------------
+# Owner cards for the scan page
+# -------------------------
+def get_owner_card(uid, load):
+    """Return the cached card for uid, or call load(uid) on a miss.
+
+    load returns a dict (name, phone, vehicle) or None for unknown UIDs;
+    both outcomes are cached.
+    """
+    card = cards.get(uid)
+    if card is None:
+        card = load(uid)
+        cards.put(uid, MISSING if card is None else card)
+        return card
+    return None if card is MISSING else card
+
+
+def get_owner_id_for_code(code, load):
+    """Return the owner id for a /q/<code> short code, or None.
+
+    load(code) returns the owner's card plus its "id", or None. A miss
+    also fills the card cache, so a first scan is still one query.
+    """
+    owner_id = codes.get(code)
+    if owner_id is None:
+        card = load(code)
+        if card is None:
+            codes.put(code, MISSING)
+            return None
+        owner_id = card.pop("id")
+        codes.put(code, owner_id)
+        cards.put(owner_id, card)
+        return owner_id
+    return None if owner_id is MISSING else owner_id
+
+
+def invalidate_owner(uid):
+    cards.invalidate(uid)
+
+
+def cache_stats():
+    stats = cards.stats()
+    stats["codes"] = codes.stats()
+    return stats
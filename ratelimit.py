@@ -0,0 +1,241 @@
+"""Token-bucket rate limiting for the public (unauthenticated) endpoints.
+
+Each route has a rule set, e.g. "ip=30/60,uid=120/60": every client IP
+gets a bucket of 30 requests refilled over 60 seconds, every tag (the uid
+in the URL) one of 120 over 60 seconds. Override per route with
+RATELIMIT_<ROUTE>, e.g. RATELIMIT_SCAN="ip=10/60".
+
+Buckets live in process memory by default, so each gunicorn worker
+limits on its own. Set RATELIMIT_REDIS_URL to share them between workers
+and dynos; any Redis-protocol server works, including a local one for
+development. If it can't be reached the in-process buckets take over.
+
+Rejected requests never reach the view (and so never the database).
+"""
+import functools
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import Response, request
+
+import db
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# -------------------------
+# Settings
+# -------------------------
+RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+RATELIMIT_REDIS_URL = os.getenv("RATELIMIT_REDIS_URL")
+RATELIMIT_MAX_KEYS = int(os.getenv("RATELIMIT_MAX_KEYS", 100000))
+# Shed public requests once this many are already queued for a DB
+# connection (0 = the pool size)
+RATELIMIT_SHED_WAITERS = int(os.getenv("RATELIMIT_SHED_WAITERS", 0))
+
+DEFAULT_RULES = {
+    "scan": "ip=30/60,uid=120/60",
+    "location": "ip=30/60",
+    "location_batch": "ip=10/60",
+    "sticker": "ip=60/60",
+}
+SCOPES = ("ip", "uid")
+
+
+def parse_rules(spec):
+    # "ip=30/60,uid=120/60" -> [("ip", 30.0, 0.5), ("uid", 120.0, 2.0)]
+    rules = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        scope, _, limit = part.partition("=")
+        count, _, seconds = limit.partition("/")
+        scope = scope.strip()
+        if scope not in SCOPES:
+            raise ValueError(f"unknown rate limit scope {scope!r} in {spec!r}")
+        burst = float(count)
+        rules.append((scope, burst, burst / float(seconds or 1)))
+    return rules
+
+
+def rules_for(name):
+    return parse_rules(os.getenv(f"RATELIMIT_{name.upper()}", DEFAULT_RULES[name]))
+
+
+# -------------------------
+# Backends
+# -------------------------
+# take(key, burst, rate) -> seconds until a token is available (0 = allowed)
+class MemoryBackend:
+    def __init__(self, max_keys=RATELIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Forgetting the least recently seen client only refills its bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def size(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+# Refill + take in one round trip, atomically for all workers
+TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    def __init__(self, url, fallback):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05,
+                                           socket_connect_timeout=0.05)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+        self.fallback = fallback
+        self.errors = 0
+
+    def take(self, key, burst, rate):
+        try:
+            return float(self.script(keys=[key], args=[burst, rate, time.time()]))
+        except redis.RedisError as e:
+            self.errors += 1
+            if self.errors == 1:
+                print("Rate limit store unavailable, using in-process buckets:", e)
+            return self.fallback.take(key, burst, rate)
+
+    def size(self):
+        return None
+
+
+memory = MemoryBackend()
+if RATELIMIT_REDIS_URL and redis is not None:
+    backend = RedisBackend(RATELIMIT_REDIS_URL, memory)
+else:
+    if RATELIMIT_REDIS_URL:
+        print("RATELIMIT_REDIS_URL is set but the redis package is not installed")
+    backend = memory
+
+counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _count(key):
+    with _counts_lock:
+        counts[key] += 1
+
+
+# -------------------------
+# Cheap rejections
+# -------------------------
+LIMITED_BODY = b"Too many requests, please try again shortly.\n"
+OVERLOADED_BODY = b"Service busy, please try again shortly.\n"
+
+
+@functools.lru_cache(maxsize=128)
+def _headers(retry_after):
+    return (
+        ("Content-Type", "text/plain; charset=utf-8"),
+        ("Retry-After", str(retry_after)),
+        ("Cache-Control", "no-store"),
+    )
+
+
+def limited_response(wait):
+    return Response(LIMITED_BODY, 429, _headers(max(math.ceil(wait), 1)))
+
+
+def overloaded_response():
+    return Response(OVERLOADED_BODY, 503, _headers(1))
+
+
+def client_ip(req=None):
+    # The router appends the address it saw to X-Forwarded-For; anything
+    # before it came from the client and can be made up.
+    if req is None:
+        req = request
+    return req.access_route[-1] if req.access_route else req.remote_addr
+
+
+def _shed():
+    waiters = RATELIMIT_SHED_WAITERS or db.pool.max_size
+    return db.pool.saturated(waiters)
+
+
+# -------------------------
+# Route decorator
+# -------------------------
+def limit(name):
+    rules = rules_for(name)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not RATELIMIT_ENABLED:
+                return view(*args, **kwargs)
+
+            for scope, burst, rate in rules:
+                value = client_ip() if scope == "ip" else kwargs.get("uid")
+                if value is None:
+                    continue
+                wait = backend.take(f"rl:{name}:{scope}:{value}", burst, rate)
+                if wait:
+                    _count(f"{name}:{scope}")
+                    return limited_response(wait)
+
+            if _shed():
+                _count(f"{name}:shed")
+                return overloaded_response()
+
+            _count(f"{name}:allowed")
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def ratelimit_stats():
+    with _counts_lock:
+        snapshot = dict(counts)
+    return {
+        "enabled": RATELIMIT_ENABLED,
+        "backend": type(backend).__name__,
+        "buckets": backend.size(),
+        "rules": {name: os.getenv(f"RATELIMIT_{name.upper()}", spec)
+                  for name, spec in DEFAULT_RULES.items()},
+        "counts": snapshot,
+    }
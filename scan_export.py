@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+from flask import Response, stream_with_context
+
+from db import get_db_connection
+
+# Rows pulled from the server per round trip by the named cursor
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 2000))
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+# -------------------------
+# Server-side cursor
+# -------------------------
+def iter_rows(sql, params=(), fetch_size=EXPORT_FETCH_SIZE, name="scan_export"):
+    # A named cursor keeps the result set on the server; only fetch_size
+    # rows are ever held here, however big the export is.
+    conn = get_db_connection()
+    try:
+        c = conn.cursor(name=name)
+        c.itersize = fetch_size
+        c.execute(sql, params)
+        for row in c:
+            yield row
+        c.close()
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+# -------------------------
+# Encoders
+# -------------------------
+def iter_csv(columns, rows, rows_per_chunk=500):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_value(v) for v in row])
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_ndjson(columns, rows, rows_per_chunk=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({k: _value(v) for k, v in zip(columns, row)}))
+        if len(lines) == rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def export_response(fmt, columns, rows, filename="scans"):
+    # rows: any iterable of tuples, consumed lazily as the body streams
+    encode = iter_csv if fmt == "csv" else iter_ndjson
+    body = encode(columns, rows)
+    return Response(
+        stream_with_context(body),
+        content_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+import threading
+from collections import Counter
+
+from metrics import SCANS
+from owner_cache import TTLCache
+from ratelimit import client_ip
+
+
+# -------------------------
+# Settings
+# -------------------------
+# Repeat scans of the same tag from the same client inside this window are
+# logged once (seconds, 0 turns deduplication off)
+SCAN_DEDUP_WINDOW = float(os.getenv("SCAN_DEDUP_WINDOW", 600))
+SCAN_DEDUP_CACHE_SIZE = int(os.getenv("SCAN_DEDUP_CACHE_SIZE", 50000))
+
+# Link-preview fetchers and crawlers/tools. Most previewers say "bot"
+# (Slackbot, TelegramBot, Discordbot, LinkedInBot, ...). In-app browsers
+# (Instagram, LINE, Snapchat...) are real visitors and must not match.
+BOT_USER_AGENTS = re.compile(
+    r"bot\b|bot/|crawl|spider|slurp|preview|facebookexternalhit|facebookcatalog|"
+    r"^whatsapp/|iframely|embedly|vkshare|w3c_validator|"
+    r"headlesschrome|lighthouse|curl/|wget/|python-requests|python-urllib|"
+    r"go-http-client|okhttp|java/|libwww|httpclient|axios|node-fetch",
+    re.IGNORECASE,
+)
+PREFETCH_HEADERS = ("Purpose", "Sec-Purpose", "X-Purpose", "X-Moz")
+
+
+# -------------------------
+# Classification
+# -------------------------
+def skip_reason(request):
+    """Why this request should not be logged as a scan, or None."""
+    if request.method == "HEAD":
+        return "head"
+    for header in PREFETCH_HEADERS:
+        value = request.headers.get(header, "").lower()
+        if "prefetch" in value or "prerender" in value or "preview" in value:
+            return "prefetch"
+    ua = request.headers.get("User-Agent", "")
+    if not ua or BOT_USER_AGENTS.search(ua):
+        return "bot"
+    return None
+
+
+def fingerprint(request, uid):
+    # The address the router saw, as for rate limits: earlier
+    # X-Forwarded-For entries are up to the client, so a bot rotating them
+    # would get every repeat scan logged
+    client = client_ip(request) or ""
+    ua = request.headers.get("User-Agent", "")
+    raw = f"{client}\0{ua}\0{uid}".encode()
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+# -------------------------
+# Filter
+# -------------------------
+class ScanFilter:
+    def __init__(self, window=SCAN_DEDUP_WINDOW, maxsize=SCAN_DEDUP_CACHE_SIZE):
+        self.window = window
+        # fingerprint -> scan id of the scan that was logged
+        self.recent = TTLCache(maxsize=maxsize, ttl=window, negative_ttl=window)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+        SCANS.inc(outcome)
+
+    def log_scan(self, request, uid, record):
+        """Log a scan via record(uid) unless it should be suppressed.
+
+        Returns the scan id for the page's location token: the new one, the
+        one logged for this client earlier in the window, or None when the
+        request is not a real visit.
+        """
+        reason = skip_reason(request)
+        if reason:
+            self._count(reason)
+            return None
+
+        if self.window <= 0:
+            self._count("logged")
+            return record(uid)
+
+        key = fingerprint(request, uid)
+        scan_id = self.recent.get(key)
+        if scan_id is not None:
+            self._count("duplicate")
+            return scan_id
+
+        scan_id = record(uid)
+        if scan_id is not None:
+            self.recent.put(key, scan_id)
+        self._count("logged")
+        return scan_id
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        suppressed = {k: v for k, v in counts.items() if k != "logged"}
+        return {
+            "logged": counts.get("logged", 0),
+            "suppressed": suppressed,
+            "suppressed_total": sum(suppressed.values()),
+            "window_seconds": self.window,
+            "fingerprints": self.recent.stats(),
+        }
+
+
+scan_filter = ScanFilter()
+
+
+def log_scan(request, uid, record):
+    return scan_filter.log_scan(request, uid, record)
+
+
+def filter_stats():
+    return scan_filter.stats()
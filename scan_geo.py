@@ -0,0 +1,120 @@
+"""Location queries over scan_logs.geohash (see geo.py).
+
+Area lookups first narrow to the geohash cells covering the area (btree
+range scans), then apply the exact bbox / distance test to the few rows
+left. Heatmaps are one GROUP BY on a hash prefix, so the database does the
+binning and only one row per cell comes back.
+"""
+import psycopg2.extras
+
+import geo
+from db import get_db_connection
+
+MAX_AREA_RESULTS = 500
+HEATMAP_PRECISION = 6       # ~1.2km x 0.6km cells
+MAX_COVER_CELLS = 32
+
+DISTANCE_SQL = """
+    2 * %(radius)s * asin(sqrt(
+        power(sin(radians(latitude - %(lat)s) / 2), 2) +
+        cos(radians(%(lat)s)) * cos(radians(latitude)) *
+        power(sin(radians(longitude - %(lon)s) / 2), 2)
+    ))
+"""
+
+
+def _query(sql, params):
+    conn = get_db_connection()
+    c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    c.execute(sql, params)
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return rows
+
+
+def _owner_clause(owner_id, params):
+    if owner_id is None:
+        return ""
+    params.append(owner_id)
+    return "AND owner_id = %s"
+
+
+# -------------------------
+# Area lookups
+# -------------------------
+def scans_in_bbox(min_lat, min_lon, max_lat, max_lon, owner_id=None,
+                  limit=MAX_AREA_RESULTS):
+    cells = geo.cover_bbox(min_lat, min_lon, max_lat, max_lon, MAX_COVER_CELLS)
+    cover, params = geo.prefix_ranges_sql("geohash", cells)
+    owner = _owner_clause(owner_id, params)
+    params += [min_lat, max_lat, min_lon, max_lon, limit]
+    return _query(
+        f"""
+        SELECT id AS scan_id, owner_id, scanned_at, latitude, longitude
+        FROM scan_logs
+        WHERE {cover} {owner}
+          AND latitude BETWEEN %s AND %s
+          AND longitude BETWEEN %s AND %s
+        ORDER BY scanned_at DESC, id DESC
+        LIMIT %s
+        """,
+        params,
+    )
+
+
+def scans_near(latitude, longitude, radius_m, owner_id=None,
+               limit=MAX_AREA_RESULTS):
+    cells = geo.cover_bbox(*geo.radius_bbox(latitude, longitude, radius_m),
+                           max_cells=MAX_COVER_CELLS)
+    cover, params = geo.prefix_ranges_sql("geohash", cells)
+    owner = _owner_clause(owner_id, params)
+    # Positional params first, then the distance expression's own values
+    distance = DISTANCE_SQL % {"radius": geo.EARTH_RADIUS_M, "lat": "%s", "lon": "%s"}
+    return _query(
+        f"""
+        SELECT * FROM (
+            SELECT id AS scan_id, owner_id, scanned_at, latitude, longitude,
+                   {distance} AS distance_m
+            FROM scan_logs
+            WHERE {cover} {owner}
+        ) s
+        WHERE distance_m <= %s
+        ORDER BY distance_m, scanned_at DESC
+        LIMIT %s
+        """,
+        [latitude, latitude, longitude] + params + [radius_m, limit],
+    )
+
+
+# -------------------------
+# Heatmap
+# -------------------------
+def heatmap(owner_id, precision=HEATMAP_PRECISION):
+    rows = _query(
+        """
+        SELECT left(geohash, %s) AS cell, COUNT(*) AS scans, MAX(scanned_at) AS last_scan_at
+        FROM scan_logs
+        WHERE owner_id = %s AND geohash IS NOT NULL
+        GROUP BY 1
+        ORDER BY 2 DESC
+        """,
+        (precision, owner_id),
+    )
+    return heatmap_cells(rows)
+
+
+def heatmap_cells(rows):
+    # rows: {cell, scans, last_scan_at}
+    cells = []
+    for r in rows:
+        min_lat, min_lon, max_lat, max_lon = geo.decode_bbox(r["cell"])
+        cells.append({
+            "cell": r["cell"],
+            "scans": r["scans"],
+            "last_scan_at": r["last_scan_at"],
+            "latitude": (min_lat + max_lat) / 2,
+            "longitude": (min_lon + max_lon) / 2,
+            "bbox": [min_lat, min_lon, max_lat, max_lon],
+        })
+    return cells
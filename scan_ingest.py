@@ -0,0 +1,459 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extras
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+import scan_stats
+from db import PoolTimeout, get_db_connection
+from metrics import SCAN_ROWS
+
+
+# -------------------------
+# Settings
+# -------------------------
+# "sync" inserts inside the request (old behaviour), "buffered" hands the
+# scan to a background flusher and returns immediately.
+SCAN_INGEST_MODE = os.getenv("SCAN_INGEST_MODE", "sync")
+QUEUE_SIZE = int(os.getenv("SCAN_QUEUE_SIZE", 10000))
+BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", 500))
+FLUSH_INTERVAL = float(os.getenv("SCAN_FLUSH_INTERVAL", 1.0))
+SPILL_DIR = os.getenv("SCAN_SPILL_DIR", "spill")
+# Scan IDs handed out per nextval() round trip in buffered mode
+ID_BLOCK_SIZE = int(os.getenv("SCAN_ID_BLOCK_SIZE", 100))
+# How long the scan page may post a location for its scan
+SCAN_TOKEN_MAX_AGE = int(os.getenv("SCAN_TOKEN_MAX_AGE", 3600))
+# How long a spilled location may wait for its scan row (still queued in
+# another worker, or in a spill file not replayed yet) before it's set aside
+LOCATION_WAIT = int(os.getenv("SCAN_LOCATION_WAIT", 300))
+
+INSERT_SCANS_SQL = "INSERT INTO scan_logs (id, owner_id, scanned_at) VALUES %s"
+# Failures worth retrying a spill file for. Anything else (a duplicate id,
+# a scan for a deleted owner) fails the same way every time, so the file
+# is set aside as .bad instead.
+RETRY_ERRORS = (psycopg2.OperationalError, PoolTimeout, OSError)
+# Scans queued without a reserved id take the next one at insert time
+INSERT_SCANS_TEMPLATE = "(COALESCE(%s, nextval(pg_get_serial_sequence('scan_logs', 'id'))), %s, %s)"
+
+
+# -------------------------
+# Scan tokens
+# -------------------------
+# The scan page gets a signed token naming its scan_logs row, so
+# /log_location can update that exact row and nobody can post locations
+# for arbitrary owners.
+def _token_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt="scan-location")
+
+
+def make_scan_token(scan_id):
+    return _token_serializer().dumps(scan_id)
+
+
+def read_scan_token(token):
+    try:
+        return int(_token_serializer().loads(token, max_age=SCAN_TOKEN_MAX_AGE))
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+
+# -------------------------
+# Write-behind buffer
+# -------------------------
+# Queue items are ("scan", (id, owner_id, scanned_at)) or
+# ("location", (id, latitude, longitude)); a scan's id is None when no
+# block could be reserved (DB down). Scans are inserted before locations
+# in each flush; a location whose scan row isn't in yet (spilled, or
+# queued in another worker) is spilled and retried until it is.
+class ScanBuffer:
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, spill_dir=SPILL_DIR,
+                 id_block_size=ID_BLOCK_SIZE):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.id_block_size = id_block_size
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._ids = []
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.enqueued = 0
+        self.inserted = 0
+        self.located = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.id_blocks = 0
+        self.id_errors = 0
+        self.set_aside = 0
+
+    # The flusher thread doesn't survive a fork, so start it lazily in
+    # whichever process first submits a scan.
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stop = threading.Event()
+            self._ids = []
+            self._thread = threading.Thread(
+                target=self._run, name="scan-flusher", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    # None when no block of ids could be fetched (DB down)
+    def reserve_id(self):
+        self._ensure_started()
+        with self._id_lock:
+            if not self._ids:
+                try:
+                    self._ids = self._fetch_id_block()
+                except (psycopg2.Error, PoolTimeout) as e:
+                    print("Could not reserve scan ids, queueing without one:", e)
+                    self.id_errors += 1
+                    return None
+                self.id_blocks += 1
+            return self._ids.pop()
+
+    def _fetch_id_block(self):
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(
+                """
+                SELECT nextval(pg_get_serial_sequence('scan_logs', 'id'))
+                FROM generate_series(1, %s)
+                """,
+                (self.id_block_size,)
+            )
+            ids = [row[0] for row in c.fetchall()]
+            c.close()
+        finally:
+            conn.close()
+        ids.reverse()
+        return ids
+
+    def _submit(self, kind, values):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, values))
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+        with self._count_lock:
+            self.enqueued += 1
+        return True
+
+    def submit_scan(self, scan_id, owner_id, scanned_at):
+        return self._submit("scan", (scan_id, owner_id, scanned_at))
+
+    def submit_location(self, scan_id, latitude, longitude):
+        return self._submit("location", (scan_id, latitude, longitude))
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = self._take_batch()
+                if batch:
+                    self._flush(batch)
+                else:
+                    # Idle tick: retry anything spilled while the DB was down
+                    self._replay_spill()
+            except Exception as e:
+                # If the flusher died the queue would fill up and drop scans
+                self.errors += 1
+                print("Scan flusher error:", e)
+
+        # Shutdown: flush whatever is left
+        batch = self._drain()
+        while batch:
+            try:
+                self._flush(batch[:self.batch_size])
+            except Exception as e:
+                print("Scan flusher error:", e)
+            batch = batch[self.batch_size:]
+
+    # -------------------------
+    # Flushing
+    # -------------------------
+    def _write(self, events):
+        scans = [values for kind, values in events if kind == "scan"]
+        locations = [values for kind, values in events if kind == "location"]
+
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            if scans:
+                psycopg2.extras.execute_values(
+                    c, INSERT_SCANS_SQL, scans, template=INSERT_SCANS_TEMPLATE,
+                    page_size=self.batch_size
+                )
+                scan_stats.bump_stats(c, scans, page_size=self.batch_size)
+            unmatched = []
+            if locations:
+                unmatched = scan_stats.update_locations(c, locations, page_size=self.batch_size)
+            conn.commit()
+            c.close()
+        finally:
+            conn.close()
+        return len(scans), len(locations) - len(unmatched), unmatched
+
+    def _flush(self, events):
+        self.flushes += 1
+        try:
+            scans, locations, unmatched = self._write(events)
+        except Exception as e:
+            # Spilled whatever the cause; replay sorts out what to retry
+            self.errors += 1
+            print("Scan flush failed, spilling to disk:", e)
+            self._spill(events)
+            return
+        self.inserted += scans
+        self.located += locations
+        SCAN_ROWS.inc("scan", amount=scans)
+        SCAN_ROWS.inc("location", amount=locations)
+        if unmatched:
+            self._spill([("location", values) for values in unmatched])
+        self._replay_spill()
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"scans.{os.getpid()}.ndjson")
+
+    def _unique_path(self, suffix):
+        # Never the live spill file's name, so renames can't overwrite it
+        return os.path.join(self.spill_dir, f"scans.{os.getpid()}.{time.time_ns()}.{suffix}")
+
+    def _spill(self, events):
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(), "a") as f:
+                for kind, values in events:
+                    f.write(json.dumps([kind, values]) + "\n")
+        except OSError as e:
+            print("Scan spill failed, dropping events:", e)
+            with self._count_lock:
+                self.dropped += len(events)
+            return
+        self.spilled += len(events)
+
+    def _replay_spill(self):
+        for path in glob.glob(os.path.join(self.spill_dir, "scans.*.ndjson")):
+            # Claim the file; another worker may get there first
+            claimed = f"{path}.replay.{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                if not self._replay_file(claimed):
+                    return
+            except Exception as e:
+                # Unreadable: set the file aside rather than strand or retry it
+                print("Scan spill replay failed, setting the file aside:", e)
+                os.rename(claimed, self._unique_path("bad"))
+
+    def _read_spill(self, path):
+        events = []
+        bad = []
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    kind, values = json.loads(line)
+                    # Older spill files still carry map_link on location events
+                    events.append((kind, tuple(values[:3]) if kind == "location" else tuple(values)))
+                except (ValueError, TypeError):
+                    # Cut short by a worker that died mid-write
+                    bad.append(line.rstrip("\n") + "\n")
+        if bad:
+            print(f"Setting aside {len(bad)} unreadable spilled events")
+            self._set_aside(bad)
+        return events
+
+    def _set_aside(self, lines):
+        with open(self._unique_path("bad"), "w") as f:
+            f.writelines(lines)
+        self.set_aside += len(lines)
+
+    # A new spill file; never the live one, whose owner may be appending
+    def _write_spill_file(self, events, suffix="ndjson", mtime=None):
+        tmp = self._unique_path("tmp")
+        with open(tmp, "w") as f:
+            for kind, values in events:
+                f.write(json.dumps([kind, values]) + "\n")
+        if mtime is not None:
+            os.utime(tmp, (mtime, mtime))
+        os.replace(tmp, self._unique_path(suffix))
+
+    # Spill files (claimed or not) that may still hold scans
+    def _pending_spill(self, claimed):
+        pattern = os.path.join(self.spill_dir, "scans.*.ndjson*")
+        return any(path != claimed and ".held." not in path for path in glob.glob(pattern))
+
+    # Locations replayed before their scan row exists. The scan may be in a
+    # spill file not replayed yet, so keep them, dated like the file they
+    # came from, until LOCATION_WAIT has passed with nothing else pending.
+    def _hold_locations(self, locations, claimed):
+        events = [("location", values) for values in locations]
+        written = os.path.getmtime(claimed)
+        try:
+            if time.time() - written < LOCATION_WAIT or self._pending_spill(claimed):
+                self._write_spill_file(events, suffix="held.ndjson", mtime=written)
+                return
+            print(f"Setting aside {len(events)} locations with no scan row")
+            self._set_aside([json.dumps([kind, values]) + "\n" for kind, values in events])
+        except OSError as e:
+            print("Could not keep unmatched locations, dropping them:", e)
+            with self._count_lock:
+                self.dropped += len(events)
+
+    # False when the DB is unavailable again (stop replaying for now)
+    def _replay_file(self, claimed):
+        events = self._read_spill(claimed)
+        try:
+            # One transaction, so a failure never half-applies the file
+            scans, locations, unmatched = self._write(events) if events else (0, 0, [])
+        except RETRY_ERRORS:
+            # Put the events back for next time under a new name: the owner
+            # of the original may have started a fresh spill file since
+            try:
+                self._write_spill_file(events)
+            except OSError:
+                # Can't rewrite it: put the claimed file back as it is
+                os.rename(claimed, self._unique_path("ndjson"))
+            else:
+                os.remove(claimed)
+            return False
+        except psycopg2.Error as e:
+            print("Spilled scans rejected by the database, setting them aside:", e)
+            self._set_aside([json.dumps([kind, values]) + "\n" for kind, values in events])
+            os.remove(claimed)
+            return True
+        if unmatched:
+            self._hold_locations(unmatched, claimed)
+        os.remove(claimed)
+        self.replayed += len(events) - len(unmatched)
+        self.inserted += scans
+        self.located += locations
+        return True
+
+    def shutdown(self, timeout=10):
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        depth = self._queue.qsize() if self._pid == os.getpid() else 0
+        return {
+            "mode": SCAN_INGEST_MODE,
+            "queue_depth": depth,
+            "queue_size": self.queue_size,
+            "enqueued": self.enqueued,
+            "inserted": self.inserted,
+            "located": self.located,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "id_blocks": self.id_blocks,
+            "id_errors": self.id_errors,
+            "set_aside": self.set_aside,
+        }
+
+
+buffer = ScanBuffer()
+atexit.register(buffer.shutdown)
+
+
+# -------------------------
+# Entry points for routes
+# -------------------------
+# record_scan returns the scan_logs id (None if it couldn't be assigned).
+# In sync mode scanned_at comes from the column default; buffered scans
+# carry their own timestamp since they are inserted later. Without a
+# reserved id (DB down) the scan is still queued, and spilled if the
+# outage lasts; only its location can't be tied to it.
+def record_scan(owner_id):
+    if SCAN_INGEST_MODE == "buffered":
+        scan_id = buffer.reserve_id()
+        scanned_at = datetime.now(timezone.utc).isoformat()
+        buffer.submit_scan(scan_id, owner_id, scanned_at)
+        return scan_id
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(scan_stats.RECORD_SCAN_SQL, (owner_id,))
+    scan_id = c.fetchone()[0]
+    conn.commit()
+    c.close()
+    conn.close()
+    SCAN_ROWS.inc("scan")
+    return scan_id
+
+
+def record_location(scan_id, latitude, longitude):
+    record_locations([(scan_id, latitude, longitude)])
+
+
+# locations: [(scan_id, latitude, longitude)], applied in one round trip
+def record_locations(locations):
+    if SCAN_INGEST_MODE == "buffered":
+        for scan_id, latitude, longitude in locations:
+            buffer.submit_location(scan_id, latitude, longitude)
+        return
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    unmatched = scan_stats.update_locations(c, locations, page_size=max(len(locations), 1))
+    conn.commit()
+    c.close()
+    conn.close()
+    SCAN_ROWS.inc("location", amount=len(locations) - len(unmatched))
+
+
+def ingest_stats():
+    return buffer.stats()
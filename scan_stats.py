@@ -0,0 +1,148 @@
+"""Per-owner scan summary (owner_scan_stats).
+
+The table is maintained in the same transaction as scan inserts and
+location updates (see scan_ingest.py), so the dashboard header is a
+primary-key lookup. If it ever drifts, recompute it from scan_logs:
+
+    python scan_stats.py rebuild             every owner
+    python scan_stats.py rebuild ID [ID ...] just these owners
+"""
+import sys
+from collections import defaultdict
+
+import psycopg2.extras
+
+import geo
+from db import get_db_connection
+
+BUMP_STATS_SET = """
+    total_scans = owner_scan_stats.total_scans + EXCLUDED.total_scans,
+    last_scan_at = GREATEST(owner_scan_stats.last_scan_at, EXCLUDED.last_scan_at)
+"""
+
+# Single scan: insert the log row and bump the summary in one round trip
+RECORD_SCAN_SQL = f"""
+    WITH s AS (
+        INSERT INTO scan_logs (owner_id) VALUES (%s)
+        RETURNING id, owner_id, scanned_at
+    ), stats AS (
+        INSERT INTO owner_scan_stats (owner_id, total_scans, last_scan_at)
+        SELECT owner_id, 1, scanned_at FROM s
+        ON CONFLICT (owner_id) DO UPDATE SET {BUMP_STATS_SET}
+    )
+    SELECT id FROM s
+"""
+
+# Batched scans: one row per owner with (owner_id, count, latest scanned_at)
+BUMP_STATS_SQL = f"""
+    INSERT INTO owner_scan_stats (owner_id, total_scans, last_scan_at)
+    VALUES %s
+    ON CONFLICT (owner_id) DO UPDATE SET {BUMP_STATS_SET}
+"""
+BUMP_STATS_TEMPLATE = "(%s, %s, %s::timestamptz)"
+
+# Location updates by scan id; the newest located scan per owner wins.
+# Returns the ids that matched a scan_logs row.
+UPDATE_LOCATIONS_SQL = """
+    WITH u AS (
+        UPDATE scan_logs AS s
+        SET latitude = v.latitude, longitude = v.longitude, geohash = v.geohash
+        FROM (VALUES %s) AS v(id, latitude, longitude, geohash)
+        WHERE s.id = v.id
+        RETURNING s.id, s.owner_id, s.scanned_at, s.latitude, s.longitude
+    ), latest AS (
+        SELECT DISTINCT ON (owner_id) owner_id, scanned_at, latitude, longitude
+        FROM u
+        ORDER BY owner_id, scanned_at DESC, id DESC
+    ), stats AS (
+        UPDATE owner_scan_stats AS st
+        SET last_latitude = latest.latitude,
+            last_longitude = latest.longitude,
+            last_located_at = latest.scanned_at
+        FROM latest
+        WHERE st.owner_id = latest.owner_id
+          AND (st.last_located_at IS NULL OR latest.scanned_at >= st.last_located_at)
+    )
+    SELECT id FROM u
+"""
+LOCATION_TEMPLATE = "(%s, %s::double precision, %s::double precision, %s)"
+
+REBUILD_SQL = """
+    INSERT INTO owner_scan_stats
+        (owner_id, total_scans, last_scan_at, last_latitude, last_longitude, last_located_at)
+    SELECT o.id, COALESCE(c.total_scans, 0), c.last_scan_at,
+           l.latitude, l.longitude, l.scanned_at
+    FROM owners o
+    LEFT JOIN (
+        SELECT owner_id, COUNT(*) AS total_scans, MAX(scanned_at) AS last_scan_at
+        FROM scan_logs
+        GROUP BY owner_id
+    ) c ON c.owner_id = o.id
+    LEFT JOIN (
+        SELECT DISTINCT ON (owner_id) owner_id, latitude, longitude, scanned_at
+        FROM scan_logs
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY owner_id, scanned_at DESC, id DESC
+    ) l ON l.owner_id = o.id
+    {where}
+    ON CONFLICT (owner_id) DO UPDATE SET
+        total_scans = EXCLUDED.total_scans,
+        last_scan_at = EXCLUDED.last_scan_at,
+        last_latitude = EXCLUDED.last_latitude,
+        last_longitude = EXCLUDED.last_longitude,
+        last_located_at = EXCLUDED.last_located_at
+"""
+
+
+def stats_rows(scans):
+    # scans: [(id, owner_id, scanned_at)] -> [(owner_id, count, latest)]
+    counts = defaultdict(int)
+    latest = {}
+    for _, owner_id, scanned_at in scans:
+        counts[owner_id] += 1
+        if owner_id not in latest or scanned_at > latest[owner_id]:
+            latest[owner_id] = scanned_at
+    return [(owner_id, counts[owner_id], latest[owner_id]) for owner_id in counts]
+
+
+def bump_stats(c, scans, page_size=500):
+    psycopg2.extras.execute_values(
+        c, BUMP_STATS_SQL, stats_rows(scans),
+        template=BUMP_STATS_TEMPLATE, page_size=page_size
+    )
+
+
+def update_locations(c, locations, page_size=500):
+    # locations: [(scan_id, lat, lon)]; the geohash is derived here so the
+    # queue and spill files keep their shape. Returns the locations whose
+    # scan row isn't there (yet); those were not applied.
+    rows = [(scan_id, lat, lon, geo.encode(lat, lon)) for scan_id, lat, lon in locations]
+    matched = psycopg2.extras.execute_values(
+        c, UPDATE_LOCATIONS_SQL, rows,
+        template=LOCATION_TEMPLATE, page_size=page_size, fetch=True
+    )
+    matched = {row[0] for row in matched}
+    return [loc for loc in locations if loc[0] not in matched]
+
+
+def rebuild(owner_ids=None):
+    conn = get_db_connection()
+    c = conn.cursor()
+    # Hold off concurrent scan transactions (they upsert into this table)
+    # so the recount sees a consistent scan_logs.
+    c.execute("LOCK TABLE owner_scan_stats IN SHARE ROW EXCLUSIVE MODE")
+    if owner_ids:
+        c.execute(REBUILD_SQL.format(where="WHERE o.id = ANY(%s)"), (list(owner_ids),))
+    else:
+        c.execute(REBUILD_SQL.format(where=""))
+    count = c.rowcount
+    conn.commit()
+    c.close()
+    conn.close()
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit(__doc__)
+    print(f"Rebuilt stats for {rebuild(sys.argv[2:])} owners")
@@ -0,0 +1,129 @@
+"""Short codes for QR URLs: /q/<code> instead of /q/<uuid4>.
+
+    https://letstrackme.com/q/3f0c2a9e-1b7d-4c55-9e1a-2b3c4d5e6f70   version 7, 45x45
+    https://letstrackme.com/q/k3Xa9QzB                                version 4, 33x33
+
+(ERROR_CORRECT_H.) Fewer modules in the same print area are bigger
+modules: quicker to decode from a distance and cheaper to render.
+
+A code is owners.short_id, a random BIGINT under a unique index, written
+in base62. IDs are drawn from [62^7, 62^8) so every code is exactly
+SHORT_CODE_LENGTH characters. They are random rather than sequential on
+purpose: the scan page shows the owner's phone number, and 2.1e14 values
+are far too sparse to walk (a signup colliding with an existing code is
+as unlikely, and the unique index would reject it).
+
+UUID links keep working: /q/ accepts either, so printed stickers stay
+valid. Owners from before short codes get one with
+
+    python shortcode.py backfill --base-url https://letstrackme.com
+
+which then reissues their static/qr/ sticker files with the short URL
+(batch_stickers.py; --no-reissue to only assign codes). /sticker/ URLs
+are built from the code, so on-demand stickers change URL (and content)
+by themselves.
+"""
+import argparse
+import secrets
+import string
+
+BASE62 = string.digits + string.ascii_letters
+SHORT_CODE_LENGTH = 8
+MIN_SHORT_ID = 62 ** (SHORT_CODE_LENGTH - 1)
+MAX_SHORT_ID = 62 ** SHORT_CODE_LENGTH - 1
+
+_DIGITS = {ch: i for i, ch in enumerate(BASE62)}
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def encode(n):
+    if n < 0:
+        raise ValueError("short ids are non-negative")
+    chars = []
+    while True:
+        n, digit = divmod(n, 62)
+        chars.append(BASE62[digit])
+        if not n:
+            return "".join(reversed(chars))
+
+
+def decode(code):
+    # None for anything that isn't a short code (a UUID, a typo)
+    if not is_short_code(code):
+        return None
+    n = 0
+    for ch in code:
+        n = n * 62 + _DIGITS[ch]
+    return n
+
+
+def is_short_code(value):
+    return (len(value) == SHORT_CODE_LENGTH and value[0] != "0"
+            and all(ch in _DIGITS for ch in value))
+
+
+def new_short_id():
+    return MIN_SHORT_ID + secrets.randbelow(MAX_SHORT_ID - MIN_SHORT_ID + 1)
+
+
+def new_short_ids(count):
+    # Distinct among themselves (a backfill inserts them in one go)
+    ids = set()
+    while len(ids) < count:
+        ids.add(new_short_id())
+    return list(ids)
+
+
+def owner_code(owner_id, short_id):
+    # What goes after /q/ and /sticker/: the short code once the owner has one
+    return encode(short_id) if short_id is not None else owner_id
+
+
+# -------------------------
+# Backfill
+# -------------------------
+def backfill(base_url=None, reissue=True, processes=None):
+    from sticker_cache import STICKER_WRITE_FILES
+    from storage import storage
+
+    assigned = storage.assign_short_ids()
+    print(f"short codes assigned to {assigned} owners ({storage.name})")
+
+    if not reissue or not STICKER_WRITE_FILES:
+        return
+    if storage.name != "postgres":
+        print("static/qr/ files not reissued: batch_stickers.py needs Postgres")
+        return
+
+    import batch_stickers
+
+    # Every owner with a file sticker, including ones that already had a
+    # code (their files may predate it). The state file lets an
+    # interrupted run pick up where it stopped
+    rendered = batch_stickers.run(
+        batch_stickers.iter_owner_ids("qr_path LIKE 'static/qr/%'"),
+        base_url,
+        processes=processes,
+        state_path="shortcode-reissue.state",
+    )
+    print(f"reissued {rendered} stickers")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Short QR codes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="give owners without one a short code, reissue stickers")
+    p.add_argument("--base-url", help="public site URL used in the QR (needed to reissue)")
+    p.add_argument("--no-reissue", action="store_true", help="only assign codes")
+    p.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if not args.no_reissue and not args.base_url:
+        parser.error("--base-url is required to reissue stickers (or pass --no-reissue)")
+    backfill(args.base_url, reissue=not args.no_reissue, processes=args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import functools
+import os
+
+import qrcode
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from metrics import STICKER_RENDER
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# -------------------------
+# Sticker templates
+# -------------------------
+# A template describes everything on the sticker except the QR itself.
+# Positions are either absolute pixels, "center", or (anchor, offset)
+# where anchor is one of the layout points computed in _layout().
+TEMPLATES = {
+    "v1": {
+        "size": 720,
+        "outer_radius": 60,
+        "background": "#FFD500",
+
+        "card": {
+            "margin": 55,
+            "bottom_space": 160,
+            "radius": 40,
+            "fill": "white",
+        },
+
+        "qr": {
+            "size": 400,
+            "color": "#166077",
+            "background": "white",
+            "version": 3,
+            "error_correction": qrcode.constants.ERROR_CORRECT_H,
+            "box_size": 10,
+            "border": 1,
+        },
+
+        "fonts": {
+            "regular": ("arial.ttf", 26),
+            "bold": ("arialbd.ttf", 36),
+        },
+
+        "texts": [
+            {
+                "text": "letstrackme.com",
+                "font": "regular",
+                "fill": "#111111",
+                "x": "center",
+                "y": ("qr_bottom", 18),
+            },
+            {
+                "text": "Scan Me",
+                "font": "regular",
+                "fill": "#111111",
+                "box": (220, 40),
+                "angle": 90,
+                "x": ("card_left", 10),
+                "y": ("qr_top", 80),
+            },
+            {
+                "text": "Scan Me",
+                "font": "regular",
+                "fill": "#111111",
+                "box": (220, 40),
+                "angle": -90,
+                "x": ("card_right", -55),
+                "y": ("qr_top", 80),
+            },
+            {
+                "text": "SCAN TO CONTACT OWNER",
+                "font": "bold",
+                "fill": "#166077",
+                "x": "center",
+                "y": ("bottom", -70),
+            },
+        ],
+    },
+}
+
+DEFAULT_TEMPLATE = os.environ.get("STICKER_TEMPLATE", "v1")
+
+# "numpy": QR tile straight from the module matrix at a whole-pixel module
+# pitch (sharp edges). "pil": qrcode's image, resized to fit (blurred
+# edges); also what runs when numpy isn't installed.
+QR_RASTERIZER = os.environ.get("QR_RASTERIZER", "numpy" if np is not None else "pil")
+# Rendered QR tiles kept per process, keyed by the module matrix
+QR_TILE_CACHE = int(os.environ.get("QR_TILE_CACHE", 32))
+
+
+def qr_url_for(base_url, code):
+    # code: shortcode.owner_code(), the short code or an owner UUID
+    return f"{base_url.rstrip('/')}/q/{code}"
+
+
+# -------------------------
+# Template compilation
+# -------------------------
+def _layout(spec):
+    size = spec["size"]
+    card = spec["card"]
+    qr_size = spec["qr"]["size"]
+
+    card_left = card["margin"]
+    card_top = card["margin"]
+    card_right = size - card["margin"]
+    card_bottom = size - card["bottom_space"]
+
+    qr_left = card_left + (card_right - card_left - qr_size) // 2
+    qr_top = card_top + (card_bottom - card_top - qr_size) // 2
+
+    return {
+        "center": size // 2,
+        "bottom": size,
+        "card_left": card_left,
+        "card_top": card_top,
+        "card_right": card_right,
+        "card_bottom": card_bottom,
+        "qr_left": qr_left,
+        "qr_top": qr_top,
+        "qr_bottom": qr_top + qr_size,
+    }
+
+
+def resolve(pos, layout):
+    if isinstance(pos, int):
+        return pos
+    if isinstance(pos, str):
+        return layout[pos]
+    anchor, offset = pos
+    return layout[anchor] + offset
+
+
+def _load_font(path, size):
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=None)
+def template_layout(name=DEFAULT_TEMPLATE):
+    # Spec and layout points only (no fonts, nothing rasterised)
+    spec = TEMPLATES[name]
+    return spec, _layout(spec)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(name=DEFAULT_TEMPLATE):
+    spec = TEMPLATES[name]
+    size = spec["size"]
+    layout = _layout(spec)
+    fonts = {key: _load_font(*value) for key, value in spec["fonts"].items()}
+
+    base = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(base)
+
+    # Outer rounded box
+    draw.rounded_rectangle(
+        (0, 0, size, size),
+        radius=spec["outer_radius"],
+        fill=spec["background"]
+    )
+
+    # Inner card
+    draw.rounded_rectangle(
+        (layout["card_left"], layout["card_top"],
+         layout["card_right"], layout["card_bottom"]),
+        radius=spec["card"]["radius"],
+        fill=spec["card"]["fill"]
+    )
+
+    # Text (plain and rotated)
+    for item in spec["texts"]:
+        x = resolve(item["x"], layout)
+        y = resolve(item["y"], layout)
+        font = fonts[item["font"]]
+
+        if "angle" not in item:
+            draw.text((x, y), item["text"], fill=item["fill"], font=font, anchor="mm")
+            continue
+
+        w, h = item["box"]
+        label = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+        ImageDraw.Draw(label).text(
+            (w // 2, h // 2), item["text"], fill=item["fill"], font=font, anchor="mm"
+        )
+        label = label.rotate(item["angle"], expand=True)
+        base.paste(label, (x, y), label)
+
+    return {
+        "name": name,
+        "spec": spec,
+        "layout": layout,
+        "fonts": fonts,
+        "base": base,
+        "qr_box": (layout["qr_left"], layout["qr_top"], spec["qr"]["size"]),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def scaled_template(name, size):
+    # (base, qr_box) for a sticker size x size px. Only the base (the same
+    # for every owner) is resampled; the QR is drawn at the new size.
+    compiled = compile_template(name)
+    full = compiled["spec"]["size"]
+    if size == full:
+        return compiled["base"], compiled["qr_box"]
+    base = compiled["base"].resize((size, size), Image.LANCZOS)
+    return base, tuple(round(v * size / full) for v in compiled["qr_box"])
+
+
+# -------------------------
+# Rendering
+# -------------------------
+def build_qr(qr_url, template=DEFAULT_TEMPLATE):
+    qr_spec = TEMPLATES[template]["qr"]
+
+    qr = qrcode.QRCode(
+        version=qr_spec["version"],
+        error_correction=qr_spec["error_correction"],
+        box_size=qr_spec["box_size"],
+        border=qr_spec["border"]
+    )
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+    return qr
+
+
+def qr_matrix(qr_url, template=DEFAULT_TEMPLATE):
+    # Rows of booleans (True = dark module), quiet-zone border included
+    return build_qr(qr_url, template).get_matrix()
+
+
+def module_pitch(modules, size):
+    # Whole pixels per module, as large as fits in size
+    return max(size // modules, 1)
+
+
+def rasterize_matrix(matrix, size, color, background):
+    """RGBA QR tile of size x size pixels from a module matrix.
+
+    Modules are module_pitch() pixels square, centred; the leftover
+    pixels (fewer than one module) widen the quiet zone. Modules are
+    coloured first (one uint32 RGBA per module, plus an extra light module
+    for the margin), then every pixel column and row picks its module by
+    index: two 1-D gathers (columns first, so rows come out contiguous).
+    """
+    m = np.asarray(matrix, dtype=np.uint8)
+    n = m.shape[0]
+    pitch = module_pitch(n, size)
+    offset = (size - n * pitch) // 2
+
+    index = (np.arange(size) - offset) // pitch
+    index[(index < 0) | (index >= n)] = n
+    padded = np.zeros((n + 1, n + 1), dtype=np.uint8)
+    padded[:n, :n] = m
+
+    palette = np.array(
+        [ImageColor.getcolor(background, "RGBA"), ImageColor.getcolor(color, "RGBA")],
+        dtype=np.uint8
+    ).view(np.uint32).ravel()
+    pixels = palette[padded][:, index][index]
+    return Image.fromarray(pixels.view(np.uint8).reshape(size, size, 4), "RGBA")
+
+
+@functools.lru_cache(maxsize=QR_TILE_CACHE)
+def _cached_tile(packed, n, size, color, background):
+    matrix = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=n * n).reshape(n, n)
+    return rasterize_matrix(matrix, size, color, background)
+
+
+def qr_tile(matrix, qr_spec, size=None):
+    # The packed matrix is the cache key: re-rendering the same owner (PNG,
+    # WebP) rasterises once. Callers must not modify the tile.
+    m = np.asarray(matrix, dtype=bool)
+    return _cached_tile(
+        np.packbits(m).tobytes(), m.shape[0],
+        size or qr_spec["size"], qr_spec["color"], qr_spec["background"]
+    )
+
+
+def make_qr_image(qr_url, template=DEFAULT_TEMPLATE, rasterizer=None, size=None):
+    qr_spec = TEMPLATES[template]["qr"]
+    qr = build_qr(qr_url, template)
+
+    if (rasterizer or QR_RASTERIZER) == "numpy":
+        return qr_tile(qr.get_matrix(), qr_spec, size)
+
+    qr_img = qr.make_image(
+        fill_color=qr_spec["color"],
+        back_color=qr_spec["background"]
+    ).convert("RGBA")
+
+    if size is None:
+        return qr_img.resize((qr_spec["size"], qr_spec["size"]))
+
+    # Scaled down (thumbnails): whole-pixel modules, like the numpy tile,
+    # since blurred module edges cost more bytes than the full-size sticker
+    n = len(qr.get_matrix())
+    pitch = module_pitch(n, size)
+    offset = (size - n * pitch) // 2
+    tile = Image.new("RGBA", (size, size), qr_spec["background"])
+    tile.paste(qr_img.resize((n * pitch, n * pitch), Image.NEAREST), (offset, offset))
+    return tile
+
+
+def render_sticker(qr_url, template=DEFAULT_TEMPLATE, rasterizer=None, size=None):
+    # size: a smaller copy (thumbnails), drawn at size x size px
+    if size is None:
+        compiled = compile_template(template)
+        base, (qr_x, qr_y, _) = compiled["base"], compiled["qr_box"]
+        qr_size = None
+    else:
+        base, (qr_x, qr_y, qr_size) = scaled_template(template, size)
+
+    with STICKER_RENDER.time("qr_encode"):
+        qr_img = make_qr_image(qr_url, template, rasterizer, qr_size)
+    with STICKER_RENDER.time("composite"):
+        sticker = base.copy()
+        # The QR tile is opaque: a plain copy, no alpha blending
+        sticker.paste(qr_img, (qr_x, qr_y))
+    return sticker
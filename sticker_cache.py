@@ -0,0 +1,165 @@
+"""Stickers rendered on demand: /sticker/<code>.<fmt>[?t=<template>&size=<px>].
+
+A sticker is a pure function of (QR URL, template, format, size), so any
+dyno can render it and nothing has to live on local disk. Encoded bytes
+are kept in a per-process LRU bounded by STICKER_CACHE_BYTES; with
+STICKER_DISK_CACHE set they are also written there and read back on a
+memory miss (optional, e.g. a mounted volume).
+
+The ETag is derived from the inputs, not the bytes, so If-None-Match is
+answered with a 304 without rendering. Short-code URLs carrying the
+template (?t=v1, what sticker_url() builds) never change content and are
+served immutable; /sticker/<uuid> URLs are not, their QR switches to the
+short code once the owner has one. Bump STICKER_RENDER_VERSION when the
+renderers change output.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from sticker import DEFAULT_TEMPLATE, QR_RASTERIZER, render_sticker
+from sticker_variants import STICKER_THUMB_SIZES, THUMB_FORMATS, encode, quantize
+from sticker_vector import VECTOR_FORMATS, render_vector
+
+STICKER_CACHE_BYTES = int(os.getenv("STICKER_CACHE_BYTES", 32 * 1024 * 1024))
+STICKER_DISK_CACHE = os.getenv("STICKER_DISK_CACHE")
+# /generate still writes static/qr/ files unless this is 0
+STICKER_WRITE_FILES = os.getenv("STICKER_WRITE_FILES", "1") == "1"
+STICKER_RENDER_VERSION = "3"
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Unversioned URLs follow DEFAULT_TEMPLATE, which can change on deploy
+UNVERSIONED = "public, max-age=3600"
+
+
+# -------------------------
+# Byte-bounded LRU
+# -------------------------
+class ByteLRU:
+    def __init__(self, max_bytes=STICKER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()      # key -> bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._data[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+cache = ByteLRU()
+
+
+# -------------------------
+# Rendering
+# -------------------------
+def valid_variant(fmt, size):
+    if fmt in VECTOR_FORMATS:
+        return size is None
+    if fmt in THUMB_FORMATS:
+        return size is None or size in STICKER_THUMB_SIZES
+    return False
+
+
+def sticker_etag(qr_url, template, fmt, size=None):
+    # The numpy and PIL rasterizers draw different pixels: a dyno without
+    # numpy must not answer with another dyno's ETag
+    raw = f"{STICKER_RENDER_VERSION}\0{QR_RASTERIZER}\0{template}\0{qr_url}\0{fmt}\0{size or ''}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def render_variant(qr_url, template, fmt, size=None):
+    if fmt in VECTOR_FORMATS:
+        return render_vector(qr_url, fmt, template)
+    return encode(quantize(render_sticker(qr_url, template, size=size)), fmt)
+
+
+def _disk_path(etag, fmt):
+    return os.path.join(STICKER_DISK_CACHE, f"{etag}.{fmt}")
+
+
+def get_sticker(qr_url, template, fmt, size=None, render=render_variant):
+    """(etag, bytes): memory, then the disk cache, then render(...)."""
+    etag = sticker_etag(qr_url, template, fmt, size)
+    data = cache.get(etag)
+    if data is not None:
+        return etag, data
+
+    if STICKER_DISK_CACHE:
+        try:
+            with open(_disk_path(etag, fmt), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+
+    if data is None:
+        data = render(qr_url, template, fmt, size)
+        if STICKER_DISK_CACHE:
+            try:
+                os.makedirs(STICKER_DISK_CACHE, exist_ok=True)
+                tmp = f"{_disk_path(etag, fmt)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, _disk_path(etag, fmt))
+            except OSError as e:
+                print("Sticker not written to disk cache:", e)
+
+    cache.put(etag, data)
+    return etag, data
+
+
+# -------------------------
+# URLs
+# -------------------------
+def sticker_url(code, fmt, size=None, template=DEFAULT_TEMPLATE):
+    # code: the owner's short code (or UUID), so a new code is a new URL
+    url = f"/sticker/{code}.{fmt}?t={template}"
+    return f"{url}&size={size}" if size else url
+
+
+def sticker_cache_stats():
+    stats = cache.stats()
+    stats["disk_cache"] = STICKER_DISK_CACHE
+    return stats
@@ -0,0 +1,171 @@
+"""Raster sticker files: the render_sticker() image in its optimized forms.
+
+    <id>.png              palette PNG (optimize=True) for print/download
+    <id>.webp             lossless WebP of the same palette image
+    <id>-208.webp/.png    dashboard preview thumbnails, 1x
+    <id>-416.webp/.png    2x
+
+The sticker is flat colours plus anti-aliased edges, so quantizing to
+STICKER_PALETTE_COLORS loses nothing visible and is a quarter of the RGBA
+PNG. Lossless WebP beats lossy here. Thumbnails are rendered at their own
+size with whole-pixel QR modules rather than resampled from the full
+sticker: blurred module edges made them bigger than the full-size files.
+Bytes and encode time of every variant go to /metrics and /debug/stickers;
+`python sticker_variants.py` prints them for one render next to the plain
+RGBA PNG.
+"""
+import io
+import os
+import sys
+import threading
+import time
+
+from PIL import Image
+
+from metrics import STICKER_BYTES, STICKER_RENDER
+from sticker import DEFAULT_TEMPLATE, render_sticker
+
+STICKER_PALETTE_COLORS = int(os.getenv("STICKER_PALETTE_COLORS", 64))
+# Lossless WebP effort 0-100: size barely moves, encode time does
+STICKER_WEBP_EFFORT = int(os.getenv("STICKER_WEBP_EFFORT", 50))
+# The dashboard shows the sticker at 208 CSS px
+STICKER_THUMB_SIZES = (208, 416)
+THUMB_FORMATS = ("webp", "png")
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def quantize(image):
+    return image.quantize(
+        colors=STICKER_PALETTE_COLORS,
+        method=Image.Quantize.FASTOCTREE,
+        dither=Image.Dither.NONE,
+    )
+
+
+def encode(palette_image, fmt):
+    buf = io.BytesIO()
+    if fmt == "png":
+        palette_image.save(buf, "PNG", optimize=True)
+    else:
+        palette_image.convert("RGBA").save(buf, "WEBP", lossless=True, quality=STICKER_WEBP_EFFORT)
+    return buf.getvalue()
+
+
+def variant_suffixes():
+    # [(name, size or None, fmt, file suffix)]
+    variants = [("png", None, "png", ".png"), ("webp", None, "webp", ".webp")]
+    for size in STICKER_THUMB_SIZES:
+        for fmt in THUMB_FORMATS:
+            variants.append((f"{fmt}_{size}", size, fmt, f"-{size}.{fmt}"))
+    return variants
+
+
+def render_variants(qr_url, template=DEFAULT_TEMPLATE):
+    # {size: image}: the full sticker (None) and one render per thumbnail size
+    images = {None: render_sticker(qr_url, template)}
+    for size in STICKER_THUMB_SIZES:
+        images[size] = render_sticker(qr_url, template, size=size)
+    return images
+
+
+def encode_variants(images):
+    """{name: (bytes, seconds)} for every variant of one render_variants().
+
+    Variants of the same size share one quantize; its time is included in
+    each of them (what that variant alone would cost).
+    """
+    out = {}
+    palettes = {}
+    for name, size, fmt, _ in variant_suffixes():
+        if size not in palettes:
+            start = time.perf_counter()
+            palettes[size] = (quantize(images[size]), time.perf_counter() - start)
+        palette_image, prepare_seconds = palettes[size]
+        start = time.perf_counter()
+        data = encode(palette_image, fmt)
+        seconds = prepare_seconds + time.perf_counter() - start
+        out[name] = (data, seconds)
+        _record(name, len(data), seconds)
+    return out
+
+
+# -------------------------
+# Files
+# -------------------------
+def variant_path(png_path, suffix):
+    return os.path.splitext(png_path)[0] + suffix
+
+
+def write_variants(encoded, png_path):
+    # Returns {name: {"bytes", "ms"}}
+    report = {}
+    for name, _, _, suffix in variant_suffixes():
+        data, seconds = encoded[name]
+        with open(variant_path(png_path, suffix), "wb") as f:
+            f.write(data)
+        report[name] = {"bytes": len(data), "ms": round(seconds * 1000, 2)}
+    return report
+
+
+def save_variants(images, png_path):
+    return write_variants(encode_variants(images), png_path)
+
+
+# -------------------------
+# Stats
+# -------------------------
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(name, size, seconds):
+    STICKER_RENDER.observe(seconds, f"{name}_encode")
+    STICKER_BYTES.inc(name, amount=size)
+    with _stats_lock:
+        count, total_bytes, total_seconds = _stats.get(name, (0, 0, 0.0))
+        _stats[name] = (count + 1, total_bytes + size, total_seconds + seconds)
+
+
+def variant_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        name: {
+            "encoded": count,
+            "avg_bytes": round(total_bytes / count),
+            "avg_ms": round(total_seconds * 1000 / count, 2),
+        }
+        for name, (count, total_bytes, total_seconds) in stats.items()
+    }
+
+
+# -------------------------
+# Report
+# -------------------------
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    url = argv[0] if argv else "https://letstrackme.com/q/00000000-0000-0000-0000-000000000000"
+    template = argv[1] if len(argv) > 1 else DEFAULT_TEMPLATE
+    images = render_variants(url, template)
+
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    images[None].save(buf, "PNG")
+    baseline = len(buf.getvalue())
+    print(f"{'rgba png (before)':<20} {baseline:>8} B {(time.perf_counter() - start) * 1000:>8.1f} ms")
+
+    encoded = encode_variants(images)
+    for name, (data, seconds) in encoded.items():
+        print(f"{name:<20} {len(data):>8} B {seconds * 1000:>8.1f} ms"
+              f"  ({len(data) / baseline:.0%} of before)")
+
+    # A thumbnail bigger than the full-size file means it's being blurred
+    for name, size, fmt, _ in variant_suffixes():
+        if size is not None and len(encoded[name][0]) >= len(encoded[fmt][0]):
+            print(f"WARNING: {name} is not smaller than the full-size {fmt}")
+
+
+if __name__ == "__main__":
+    main()
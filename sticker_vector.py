@@ -0,0 +1,287 @@
+"""Vector stickers: the render_sticker() design as SVG or PDF.
+
+Drawn straight from the QR module matrix and the template layout (nothing
+is rasterised), so the output prints sharp at any size and is a few KB.
+Dark modules are merged into horizontal runs, one path/rect per run.
+
+Text is set in Arial (SVG, falling back to Helvetica) or the PDF base font
+Helvetica, which has the same metrics; fonts are not embedded. The PDF page
+is STICKER_PDF_WIDTH_MM wide.
+"""
+import math
+import os
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from PIL import ImageColor
+
+from metrics import STICKER_BYTES, STICKER_RENDER
+from sticker import DEFAULT_TEMPLATE, module_pitch, qr_matrix, resolve, template_layout
+
+VECTOR_FORMATS = ("svg", "pdf")
+
+STICKER_PDF_WIDTH_MM = float(os.getenv("STICKER_PDF_WIDTH_MM", 100))
+
+SVG_FONT_FAMILY = "Arial, Helvetica, sans-serif"
+SVG_FONT_WEIGHTS = {"regular": "normal", "bold": "bold"}
+PDF_FONTS = {"regular": "Helvetica", "bold": "Helvetica-Bold"}
+
+# PIL's "mm" anchor centres text on the middle of Arial's ascent/descent;
+# the baseline sits this far (in em) below that point
+TEXT_MIDDLE = 0.3465
+
+# Bezier handle length for a quarter circle
+KAPPA = 0.5523
+
+# Advance widths (1/1000 em) of characters 32..126
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+FONT_WIDTHS = {"Helvetica": HELVETICA_WIDTHS, "Helvetica-Bold": HELVETICA_BOLD_WIDTHS}
+
+
+# -------------------------
+# Shapes
+# -------------------------
+def module_runs(matrix):
+    # [(x, y, length)] of consecutive dark modules in each row
+    runs = []
+    for y, row in enumerate(matrix):
+        x, n = 0, len(row)
+        while x < n:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < n and row[x]:
+                x += 1
+            runs.append((start, y, x - start))
+    return runs
+
+
+def sticker_shapes(qr_url, template=DEFAULT_TEMPLATE):
+    """The sticker as a list of drawing operations, in template pixels:
+
+        ("rect", x, y, w, h, radius, fill)
+        ("modules", x, y, module_size, runs, fill)
+        ("text", cx, cy, angle, text, font_key, size, fill)
+    """
+    spec, layout = template_layout(template)
+    size = spec["size"]
+    card = spec["card"]
+    qr_spec = spec["qr"]
+
+    with STICKER_RENDER.time("qr_encode"):
+        matrix = qr_matrix(qr_url, template)
+
+    qr_left, qr_top, qr_size = layout["qr_left"], layout["qr_top"], qr_spec["size"]
+    # Same whole-pixel module pitch and centring as sticker.rasterize_matrix()
+    pitch = module_pitch(len(matrix), qr_size)
+    offset = (qr_size - len(matrix) * pitch) // 2
+    shapes = [
+        ("rect", 0, 0, size, size, spec["outer_radius"], spec["background"]),
+        ("rect", layout["card_left"], layout["card_top"],
+         layout["card_right"] - layout["card_left"], layout["card_bottom"] - layout["card_top"],
+         card["radius"], card["fill"]),
+        ("rect", qr_left, qr_top, qr_size, qr_size, 0, qr_spec["background"]),
+        ("modules", qr_left + offset, qr_top + offset, pitch, module_runs(matrix), qr_spec["color"]),
+    ]
+
+    for item in spec["texts"]:
+        x = resolve(item["x"], layout)
+        y = resolve(item["y"], layout)
+        font_size = spec["fonts"][item["font"]][1]
+        angle = item.get("angle", 0)
+        if angle:
+            # compile_template() pastes the rotated label box with its top
+            # left corner at (x, y)
+            w, h = item["box"]
+            a = math.radians(angle)
+            x += (abs(w * math.cos(a)) + abs(h * math.sin(a))) / 2
+            y += (abs(w * math.sin(a)) + abs(h * math.cos(a))) / 2
+        shapes.append(("text", x, y, angle, item["text"], item["font"], font_size, item["fill"]))
+
+    return spec, shapes
+
+
+def _n(value):
+    text = f"{value:.3f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+# -------------------------
+# SVG
+# -------------------------
+def render_svg(qr_url, template=DEFAULT_TEMPLATE):
+    spec, shapes = sticker_shapes(qr_url, template)
+    size = spec["size"]
+
+    with STICKER_RENDER.time("svg_encode"):
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="0 0 {size} {size}">'
+        ]
+        for shape in shapes:
+            kind = shape[0]
+            if kind == "rect":
+                _, x, y, w, h, r, fill = shape
+                parts.append(
+                    f'<rect x="{_n(x)}" y="{_n(y)}" width="{_n(w)}" height="{_n(h)}" '
+                    f'rx="{_n(r)}" fill={quoteattr(fill)}/>'
+                )
+            elif kind == "modules":
+                _, x, y, module, runs, fill = shape
+                d = "".join(f"M{rx} {ry}h{n}v1h-{n}z" for rx, ry, n in runs)
+                parts.append(
+                    f'<path transform="translate({_n(x)} {_n(y)}) scale({_n(module)})" '
+                    f'shape-rendering="crispEdges" fill={quoteattr(fill)} d="{d}"/>'
+                )
+            else:
+                _, cx, cy, angle, text, font, font_size, fill = shape
+                rotate = f' transform="rotate({_n(-angle)} {_n(cx)} {_n(cy)})"' if angle else ""
+                parts.append(
+                    f'<text x="{_n(cx)}" y="{_n(cy + TEXT_MIDDLE * font_size)}"{rotate} '
+                    f'text-anchor="middle" font-family="{SVG_FONT_FAMILY}" '
+                    f'font-weight="{SVG_FONT_WEIGHTS.get(font, "normal")}" '
+                    f'font-size="{font_size}" fill={quoteattr(fill)}>{escape(text)}</text>'
+                )
+        parts.append("</svg>")
+        return ("\n".join(parts) + "\n").encode()
+
+
+# -------------------------
+# PDF
+# -------------------------
+def text_width(text, base_font, font_size):
+    widths = FONT_WIDTHS[base_font]
+    units = sum(widths[ord(ch) - 32] if 32 <= ord(ch) <= 126 else 556 for ch in text)
+    return units * font_size / 1000
+
+
+def _pdf_color(color):
+    r, g, b = ImageColor.getrgb(color)[:3]
+    return f"{_n(r / 255)} {_n(g / 255)} {_n(b / 255)} rg"
+
+
+def _pdf_string(text):
+    raw = text.encode("cp1252", "replace").decode("latin-1")
+    return "(" + raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def _pdf_rounded_rect(x, y, w, h, r):
+    r = min(r, w / 2, h / 2)
+    if r <= 0:
+        return f"{_n(x)} {_n(y)} {_n(w)} {_n(h)} re"
+    k = KAPPA * r
+    right, bottom = x + w, y + h
+    points = [
+        ("m", (x + r, y)),
+        ("l", (right - r, y)),
+        ("c", (right - r + k, y, right, y + r - k, right, y + r)),
+        ("l", (right, bottom - r)),
+        ("c", (right, bottom - r + k, right - r + k, bottom, right - r, bottom)),
+        ("l", (x + r, bottom)),
+        ("c", (x + r - k, bottom, x, bottom - r + k, x, bottom - r)),
+        ("l", (x, y + r)),
+        ("c", (x, y + r - k, x + r - k, y, x + r, y)),
+    ]
+    return " ".join(" ".join(_n(v) for v in values) + " " + op for op, values in points) + " h"
+
+
+def _pdf_document(content, width, height, fonts):
+    # fonts: [(resource name, base font)]
+    font_refs = " ".join(f"/{name} {5 + i} 0 R" for i, (name, _) in enumerate(fonts))
+    stream = zlib.compress(content)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_n(width)} {_n(height)}] "
+         f"/Resources << /Font << {font_refs} >> >> /Contents 4 0 R >>").encode(),
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    for _, base_font in fonts:
+        objects.append(
+            f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} "
+            f"/Encoding /WinAnsiEncoding >>".encode()
+        )
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref
+    )
+    return bytes(out)
+
+
+def render_pdf(qr_url, template=DEFAULT_TEMPLATE, width_mm=STICKER_PDF_WIDTH_MM):
+    spec, shapes = sticker_shapes(qr_url, template)
+    size = spec["size"]
+    page = width_mm * 72 / 25.4
+    scale = page / size
+
+    with STICKER_RENDER.time("pdf_encode"):
+        fonts = {}
+        # Template pixels, y pointing down like the raster render
+        ops = ["q", f"{_n(scale)} 0 0 {_n(-scale)} 0 {_n(page)} cm"]
+        for shape in shapes:
+            kind = shape[0]
+            if kind == "rect":
+                _, x, y, w, h, r, fill = shape
+                ops.append(f"{_pdf_color(fill)} {_pdf_rounded_rect(x, y, w, h, r)} f")
+            elif kind == "modules":
+                _, x, y, module, runs, fill = shape
+                ops.append(f"q {_pdf_color(fill)} {_n(module)} 0 0 {_n(module)} {_n(x)} {_n(y)} cm")
+                ops.extend(f"{rx} {ry} {n} 1 re" for rx, ry, n in runs)
+                ops.append("f Q")
+            else:
+                _, cx, cy, angle, text, font, font_size, fill = shape
+                base_font = PDF_FONTS.get(font, "Helvetica")
+                name = fonts.setdefault(base_font, f"F{len(fonts) + 1}")
+                a = math.radians(angle)
+                cos, sin = math.cos(a), math.sin(a)
+                ops.append(
+                    f"q {_n(cos)} {_n(-sin)} {_n(sin)} {_n(cos)} {_n(cx)} {_n(cy)} cm "
+                    f"BT {_pdf_color(fill)} /{name} {font_size} Tf "
+                    f"1 0 0 -1 {_n(-text_width(text, base_font, font_size) / 2)} "
+                    f"{_n(TEXT_MIDDLE * font_size)} Tm {_pdf_string(text)} Tj ET Q"
+                )
+        ops.append("Q")
+        content = "\n".join(ops).encode("latin-1")
+        return _pdf_document(content, page, page, [(n, f) for f, n in fonts.items()])
+
+
+RENDERERS = {"svg": render_svg, "pdf": render_pdf}
+
+
+def render_vector(qr_url, fmt, template=DEFAULT_TEMPLATE):
+    return RENDERERS[fmt](qr_url, template)
+
+
+def save_vector_files(qr_url, png_path, template=DEFAULT_TEMPLATE):
+    # static/qr/<id>.svg and .pdf next to the PNG
+    base = os.path.splitext(png_path)[0]
+    for fmt in VECTOR_FORMATS:
+        data = render_vector(qr_url, fmt, template)
+        STICKER_BYTES.inc(fmt, amount=len(data))
+        with open(f"{base}.{fmt}", "wb") as f:
+            f.write(data)
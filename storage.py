@@ -0,0 +1,99 @@
+"""Owner / scan / location storage behind one interface.
+
+    STORAGE_BACKEND=postgres (default)  the db.py pool, migrations/ and the
+                                        scan_ingest.py write path
+    STORAGE_BACKEND=sqlite              a local file (SQLITE_PATH) in WAL
+                                        mode: no network round trips, for
+                                        single-node deployments and local
+                                        benchmarks
+
+Rows come back as dicts (iter_scans yields tuples, it feeds streams) with
+timezone-aware datetimes, whatever the backend.
+"""
+import os
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+
+
+class Storage:
+    name = None
+
+    # -------------------------
+    # Owners
+    # -------------------------
+    def create_owner(self, uid, name, phone, vehicle, email, password_hash):
+        # Also assigns the owner a short_id (shortcode.py)
+        raise NotImplementedError
+
+    def find_login(self, email):
+        # {id, name, password_hash} or None
+        raise NotImplementedError
+
+    def owner_card(self, uid):
+        # {name, phone, vehicle, short_id} or None
+        raise NotImplementedError
+
+    def owner_by_short_id(self, short_id):
+        # {id, name, phone, vehicle, short_id} or None
+        raise NotImplementedError
+
+    def assign_short_ids(self):
+        # Gives every owner without a short_id one; returns how many
+        raise NotImplementedError
+
+    def owner_summary(self, uid):
+        # {name, vehicle, total_scans} or None
+        raise NotImplementedError
+
+    def set_qr_path(self, owner_id, qr_path):
+        raise NotImplementedError
+
+    def dashboard(self, owner_id, limit):
+        # (owner with scan stats and latest render job or None, newest
+        # `limit` scans)
+        raise NotImplementedError
+
+    # -------------------------
+    # Scans
+    # -------------------------
+    def record_scan(self, owner_id):
+        # Returns the new scan id (None if it couldn't be assigned)
+        raise NotImplementedError
+
+    def scan_page(self, owner_id, before, limit):
+        # Scans older than before=(scanned_at, id), newest first
+        raise NotImplementedError
+
+    def iter_scans(self, owner_id=None):
+        # (id, owner_id, scanned_at, latitude, longitude): one owner's scans
+        # newest first, or every scan by id. Streams; never loads them all.
+        raise NotImplementedError
+
+    # -------------------------
+    # Locations
+    # -------------------------
+    def record_locations(self, locations):
+        # locations: [(scan_id, latitude, longitude)]
+        raise NotImplementedError
+
+    def scans_in_bbox(self, min_lat, min_lon, max_lat, max_lon, owner_id=None, limit=None):
+        raise NotImplementedError
+
+    def scans_near(self, latitude, longitude, radius_m, owner_id=None, limit=None):
+        raise NotImplementedError
+
+    def heatmap(self, owner_id, precision):
+        raise NotImplementedError
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "postgres":
+        from storage_postgres import PostgresStorage
+        return PostgresStorage()
+    if backend == "sqlite":
+        from storage_sqlite import SQLiteStorage
+        return SQLiteStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r} (postgres or sqlite)")
+
+
+storage = create_storage()
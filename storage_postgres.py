@@ -0,0 +1,202 @@
+import psycopg2.extras
+
+import scan_geo
+import scan_ingest
+import shortcode
+from db import get_db_connection
+from scan_export import iter_rows
+from storage import Storage
+
+# Owner, summary and the first page of history in one round trip. Owner
+# columns repeat on every row; scan columns are NULL when the owner has
+# no scans yet.
+DASHBOARD_SQL = """
+    WITH owner AS (
+        SELECT o.id, o.short_id, o.name, o.vehicle, o.qr_path,
+               COALESCE(st.total_scans, 0) AS total_scans,
+               st.last_scan_at, st.last_latitude, st.last_longitude,
+               j.id AS render_job_id, j.status AS render_job_status
+        FROM owners o
+        LEFT JOIN owner_scan_stats st ON st.owner_id = o.id
+        -- Latest sticker render (jobs.py), for the "being rendered" notice
+        LEFT JOIN LATERAL (
+            SELECT id, status FROM jobs
+            WHERE owner_id = o.id AND kind = 'render_sticker'
+            ORDER BY id DESC
+            LIMIT 1
+        ) j ON true
+        WHERE o.id = %s
+    )
+    SELECT owner.*, s.id AS scan_id, s.scanned_at, s.latitude, s.longitude
+    FROM owner
+    LEFT JOIN LATERAL (
+        SELECT id, scanned_at, latitude, longitude
+        FROM scan_logs
+        WHERE owner_id = owner.id
+        ORDER BY scanned_at DESC, id DESC
+        LIMIT %s
+    ) s ON true
+    ORDER BY s.scanned_at DESC, s.id DESC
+"""
+OWNER_COLUMNS = ("id", "short_id", "name", "vehicle", "qr_path", "total_scans",
+                 "last_scan_at", "last_latitude", "last_longitude",
+                 "render_job_id", "render_job_status")
+SCAN_COLUMNS = ("scan_id", "scanned_at", "latitude", "longitude")
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def _fetch(self, sql, params, one=False):
+        conn = get_db_connection()
+        c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        c.execute(sql, params)
+        rows = c.fetchone() if one else c.fetchall()
+        c.close()
+        conn.close()
+        return rows
+
+    def _execute(self, sql, params):
+        conn = get_db_connection()
+        c = conn.cursor()
+        try:
+            c.execute(sql, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
+            conn.close()
+
+    # -------------------------
+    # Owners
+    # -------------------------
+    def create_owner(self, uid, name, phone, vehicle, email, password_hash):
+        self._execute(
+            """
+            INSERT INTO owners (id, name, phone, vehicle, email, password_hash, short_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            (uid, name, phone, vehicle, email, password_hash, shortcode.new_short_id())
+        )
+
+    def find_login(self, email):
+        row = self._fetch(
+            "SELECT id, name, password_hash FROM owners WHERE email=%s", (email,), one=True
+        )
+        return dict(row) if row else None
+
+    def owner_card(self, uid):
+        row = self._fetch(
+            "SELECT name, phone, vehicle, short_id FROM owners WHERE id=%s", (uid,), one=True
+        )
+        return dict(row) if row else None
+
+    def owner_by_short_id(self, short_id):
+        row = self._fetch(
+            "SELECT id, name, phone, vehicle, short_id FROM owners WHERE short_id=%s",
+            (short_id,), one=True
+        )
+        return dict(row) if row else None
+
+    def assign_short_ids(self):
+        conn = get_db_connection()
+        c = conn.cursor()
+        try:
+            c.execute("SELECT id FROM owners WHERE short_id IS NULL")
+            owner_ids = [row[0] for row in c.fetchall()]
+            if owner_ids:
+                psycopg2.extras.execute_values(
+                    c,
+                    "UPDATE owners AS o SET short_id = v.short_id "
+                    "FROM (VALUES %s) AS v(id, short_id) "
+                    "WHERE o.id = v.id AND o.short_id IS NULL",
+                    list(zip(owner_ids, shortcode.new_short_ids(len(owner_ids)))),
+                    page_size=1000
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
+            conn.close()
+        return len(owner_ids)
+
+    def owner_summary(self, uid):
+        row = self._fetch(
+            """
+            SELECT o.name, o.vehicle, COALESCE(st.total_scans, 0) AS total_scans
+            FROM owners o
+            LEFT JOIN owner_scan_stats st ON st.owner_id = o.id
+            WHERE o.id = %s
+            """,
+            (uid,), one=True
+        )
+        return dict(row) if row else None
+
+    def set_qr_path(self, owner_id, qr_path):
+        self._execute("UPDATE owners SET qr_path=%s WHERE id=%s", (qr_path, owner_id))
+
+    def dashboard(self, owner_id, limit):
+        rows = self._fetch(DASHBOARD_SQL, (owner_id, limit))
+        if not rows:
+            return None, []
+        owner = {k: rows[0][k] for k in OWNER_COLUMNS}
+        scans = [{k: r[k] for k in SCAN_COLUMNS} for r in rows if r["scan_id"] is not None]
+        return owner, scans
+
+    # -------------------------
+    # Scans
+    # -------------------------
+    def record_scan(self, owner_id):
+        return scan_ingest.record_scan(owner_id)
+
+    def scan_page(self, owner_id, before, limit):
+        rows = self._fetch(
+            """
+            SELECT id AS scan_id, scanned_at, latitude, longitude
+            FROM scan_logs
+            WHERE owner_id = %s AND (scanned_at, id) < (%s, %s)
+            ORDER BY scanned_at DESC, id DESC
+            LIMIT %s
+            """,
+            (owner_id, before[0], before[1], limit)
+        )
+        return [dict(r) for r in rows]
+
+    def iter_scans(self, owner_id=None):
+        # Server-side cursor: rows arrive EXPORT_FETCH_SIZE at a time
+        if owner_id is None:
+            return iter_rows(
+                "SELECT id, owner_id, scanned_at, latitude, longitude FROM scan_logs ORDER BY id",
+                name="all_scans"
+            )
+        return iter_rows(
+            """
+            SELECT id, owner_id, scanned_at, latitude, longitude
+            FROM scan_logs
+            WHERE owner_id=%s
+            ORDER BY scanned_at DESC, id DESC
+            """,
+            (owner_id,),
+            name="owner_scans"
+        )
+
+    # -------------------------
+    # Locations
+    # -------------------------
+    def record_locations(self, locations):
+        scan_ingest.record_locations(locations)
+
+    def scans_in_bbox(self, min_lat, min_lon, max_lat, max_lon, owner_id=None,
+                      limit=scan_geo.MAX_AREA_RESULTS):
+        return scan_geo.scans_in_bbox(min_lat, min_lon, max_lat, max_lon, owner_id, limit)
+
+    def scans_near(self, latitude, longitude, radius_m, owner_id=None,
+                   limit=scan_geo.MAX_AREA_RESULTS):
+        return scan_geo.scans_near(latitude, longitude, radius_m, owner_id, limit)
+
+    def heatmap(self, owner_id, precision):
+        return scan_geo.heatmap(owner_id, precision)
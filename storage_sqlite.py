@@ -0,0 +1,459 @@
+"""SQLite storage: one local file, no network round trips.
+
+Tuned for a web process with several threads on one node:
+
+    WAL journal        readers never block the writer (and vice versa)
+    synchronous=NORMAL fsync at checkpoints, not every commit (WAL keeps
+                       committed data safe from app crashes)
+    busy_timeout       writers queue for the lock instead of failing
+    BEGIN IMMEDIATE    writes take the lock up front, so two writers can't
+                       deadlock upgrading from a read
+    one connection per thread, with sqlite3's prepared statement cache;
+    statements are module constants so every call is a cache hit
+
+The schema is created (or the old pre-Postgres data.db upgraded) on first
+use and tracked with PRAGMA user_version.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import db
+import geo
+import scan_geo
+import shortcode
+from metrics import SCAN_ROWS
+from storage import Storage
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", 32))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", 256))
+SQLITE_FETCH_SIZE = int(os.getenv("SQLITE_FETCH_SIZE", 2000))
+
+SCHEMA_VERSION = 2
+# Stored as UTC text that sorts in time order
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime(TIME_FORMAT)
+
+
+def _to_db_time(value):
+    return value.astimezone(timezone.utc).strftime(TIME_FORMAT)
+
+
+def _from_db_time(value):
+    if value is None:
+        return None
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+# -------------------------
+# Statements
+# -------------------------
+INSERT_OWNER_SQL = """
+    INSERT INTO owners (id, name, phone, vehicle, email, password_hash, short_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+FIND_LOGIN_SQL = "SELECT id, name, password_hash FROM owners WHERE email = ?"
+OWNER_CARD_SQL = "SELECT name, phone, vehicle, short_id FROM owners WHERE id = ?"
+OWNER_BY_SHORT_ID_SQL = "SELECT id, name, phone, vehicle, short_id FROM owners WHERE short_id = ?"
+MISSING_SHORT_IDS_SQL = "SELECT id FROM owners WHERE short_id IS NULL"
+SET_SHORT_ID_SQL = "UPDATE owners SET short_id = ? WHERE id = ? AND short_id IS NULL"
+OWNER_SUMMARY_SQL = """
+    SELECT o.name, o.vehicle, COALESCE(st.total_scans, 0) AS total_scans
+    FROM owners o
+    LEFT JOIN owner_scan_stats st ON st.owner_id = o.id
+    WHERE o.id = ?
+"""
+SET_QR_PATH_SQL = "UPDATE owners SET qr_path = ? WHERE id = ?"
+DASHBOARD_OWNER_SQL = """
+    SELECT o.id, o.short_id, o.name, o.vehicle, o.qr_path,
+           COALESCE(st.total_scans, 0) AS total_scans,
+           st.last_scan_at, st.last_latitude, st.last_longitude,
+           NULL AS render_job_id, NULL AS render_job_status
+    FROM owners o
+    LEFT JOIN owner_scan_stats st ON st.owner_id = o.id
+    WHERE o.id = ?
+"""
+FIRST_PAGE_SQL = """
+    SELECT id AS scan_id, scanned_at, latitude, longitude
+    FROM scan_logs
+    WHERE owner_id = ?
+    ORDER BY scanned_at DESC, id DESC
+    LIMIT ?
+"""
+SCAN_PAGE_SQL = """
+    SELECT id AS scan_id, scanned_at, latitude, longitude
+    FROM scan_logs
+    WHERE owner_id = ? AND (scanned_at, id) < (?, ?)
+    ORDER BY scanned_at DESC, id DESC
+    LIMIT ?
+"""
+OWNER_SCANS_SQL = """
+    SELECT id, owner_id, scanned_at, latitude, longitude
+    FROM scan_logs
+    WHERE owner_id = ?
+    ORDER BY scanned_at DESC, id DESC
+"""
+ALL_SCANS_SQL = "SELECT id, owner_id, scanned_at, latitude, longitude FROM scan_logs ORDER BY id"
+
+INSERT_SCAN_SQL = "INSERT INTO scan_logs (owner_id, scanned_at) VALUES (?, ?)"
+BUMP_STATS_SQL = """
+    INSERT INTO owner_scan_stats (owner_id, total_scans, last_scan_at) VALUES (?, 1, ?)
+    ON CONFLICT (owner_id) DO UPDATE SET
+        total_scans = total_scans + 1,
+        last_scan_at = max(COALESCE(last_scan_at, ''), excluded.last_scan_at)
+"""
+UPDATE_LOCATION_SQL = "UPDATE scan_logs SET latitude = ?, longitude = ?, geohash = ? WHERE id = ?"
+LOCATED_SCANS_SQL = """
+    SELECT id, owner_id, scanned_at, latitude, longitude
+    FROM scan_logs
+    WHERE id IN (SELECT value FROM json_each(?))
+"""
+UPDATE_LAST_LOCATION_SQL = """
+    UPDATE owner_scan_stats
+    SET last_latitude = ?, last_longitude = ?, last_located_at = ?
+    WHERE owner_id = ? AND (last_located_at IS NULL OR last_located_at <= ?)
+"""
+HEATMAP_SQL = """
+    SELECT substr(geohash, 1, ?) AS cell, COUNT(*) AS scans, MAX(scanned_at) AS last_scan_at
+    FROM scan_logs
+    WHERE owner_id = ? AND geohash IS NOT NULL
+    GROUP BY cell
+    ORDER BY scans DESC
+"""
+
+
+# -------------------------
+# Schema
+# -------------------------
+# CREATE ... IF NOT EXISTS plus column checks, so the same steps build a
+# fresh file and upgrade the old data.db (owners without logins,
+# scanned_at in local time)
+TABLES = [
+    """CREATE TABLE IF NOT EXISTS owners (
+        id TEXT PRIMARY KEY, name TEXT, phone TEXT, vehicle TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS scan_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner_id TEXT, scanned_at TEXT, latitude REAL, longitude REAL
+    )""",
+]
+COLUMNS = [
+    ("owners", "email", "TEXT"),
+    ("owners", "password_hash", "TEXT"),
+    ("owners", "qr_path", "TEXT"),
+    ("scan_logs", "geohash", "TEXT"),
+    ("owners", "short_id", "INTEGER"),
+]
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS owners_email_key ON owners (email)",
+    """CREATE INDEX IF NOT EXISTS scan_logs_owner_scanned_at_idx
+        ON scan_logs (owner_id, scanned_at DESC, id DESC)""",
+    """CREATE INDEX IF NOT EXISTS scan_logs_geohash_idx
+        ON scan_logs (geohash) WHERE geohash IS NOT NULL""",
+    """CREATE INDEX IF NOT EXISTS scan_logs_owner_geohash_idx
+        ON scan_logs (owner_id, geohash) WHERE geohash IS NOT NULL""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS owners_short_id_key ON owners (short_id)",
+    """CREATE TABLE IF NOT EXISTS owner_scan_stats (
+        owner_id TEXT PRIMARY KEY REFERENCES owners (id) ON DELETE CASCADE,
+        total_scans INTEGER NOT NULL DEFAULT 0,
+        last_scan_at TEXT,
+        last_latitude REAL,
+        last_longitude REAL,
+        last_located_at TEXT
+    )""",
+]
+REBUILD_STATS_SQL = """
+    INSERT OR REPLACE INTO owner_scan_stats
+        (owner_id, total_scans, last_scan_at, last_latitude, last_longitude, last_located_at)
+    SELECT o.id,
+           (SELECT COUNT(*) FROM scan_logs s WHERE s.owner_id = o.id),
+           (SELECT MAX(scanned_at) FROM scan_logs s WHERE s.owner_id = o.id),
+           l.latitude, l.longitude, l.scanned_at
+    FROM owners o
+    LEFT JOIN scan_logs l ON l.id = (
+        SELECT id FROM scan_logs s
+        WHERE s.owner_id = o.id AND s.latitude IS NOT NULL AND s.longitude IS NOT NULL
+        ORDER BY s.scanned_at DESC, s.id DESC
+        LIMIT 1
+    )
+"""
+
+
+def _assign_short_ids(conn):
+    owner_ids = [row[0] for row in conn.execute(MISSING_SHORT_IDS_SQL)]
+    conn.executemany(SET_SHORT_ID_SQL, zip(shortcode.new_short_ids(len(owner_ids)), owner_ids))
+    return len(owner_ids)
+
+
+def _ensure_schema(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            conn.execute("COMMIT")
+            return
+        for sql in TABLES:
+            conn.execute(sql)
+        for table, column, decl in COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+        # Up to version 1 (the old data.db): once only, the UTC conversion
+        # is not idempotent
+        if version < 1:
+            # Old rows: local-time "YYYY-MM-DD HH:MM:SS" -> UTC in TIME_FORMAT
+            conn.execute(
+                "UPDATE scan_logs SET scanned_at = strftime('%Y-%m-%d %H:%M:%f', scanned_at, 'utc') "
+                "WHERE scanned_at IS NOT NULL"
+            )
+            located = conn.execute(
+                "SELECT id, latitude, longitude FROM scan_logs "
+                "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE scan_logs SET geohash = ? WHERE id = ?",
+                [(geo.encode(lat, lon), scan_id) for scan_id, lat, lon in located]
+            )
+        # Version 2: short codes for existing owners
+        _assign_short_ids(conn)
+        for sql in INDEXES:
+            conn.execute(sql)
+        if version < 1:
+            conn.execute(REBUILD_STATS_SQL)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# -------------------------
+# Query counting and timing
+# -------------------------
+# The same hooks as db.InstrumentedCursor: /metrics histograms, and
+# bench.py's queries per request via db.count_queries()
+class InstrumentedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            db.record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            db.record_query(sql, time.perf_counter() - start)
+
+
+# -------------------------
+# Storage
+# -------------------------
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256,
+                               timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                               factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA foreign_keys = ON")
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    _ensure_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    # One connection per thread (and per process: never reuse across a fork)
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _one(self, sql, params):
+        row = self._conn().execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    # -------------------------
+    # Owners
+    # -------------------------
+    def create_owner(self, uid, name, phone, vehicle, email, password_hash):
+        with self._write() as conn:
+            conn.execute(INSERT_OWNER_SQL, (uid, name, phone, vehicle, email, password_hash,
+                                            shortcode.new_short_id()))
+
+    def find_login(self, email):
+        return self._one(FIND_LOGIN_SQL, (email,))
+
+    def owner_card(self, uid):
+        return self._one(OWNER_CARD_SQL, (uid,))
+
+    def owner_by_short_id(self, short_id):
+        return self._one(OWNER_BY_SHORT_ID_SQL, (short_id,))
+
+    def assign_short_ids(self):
+        with self._write() as conn:
+            return _assign_short_ids(conn)
+
+    def owner_summary(self, uid):
+        return self._one(OWNER_SUMMARY_SQL, (uid,))
+
+    def set_qr_path(self, owner_id, qr_path):
+        with self._write() as conn:
+            conn.execute(SET_QR_PATH_SQL, (qr_path, owner_id))
+
+    def dashboard(self, owner_id, limit):
+        owner = self._one(DASHBOARD_OWNER_SQL, (owner_id,))
+        if owner is None:
+            return None, []
+        owner["last_scan_at"] = _from_db_time(owner["last_scan_at"])
+        rows = self._conn().execute(FIRST_PAGE_SQL, (owner_id, limit)).fetchall()
+        return owner, [self._scan(r) for r in rows]
+
+    # -------------------------
+    # Scans
+    # -------------------------
+    def _scan(self, row):
+        scan = dict(row)
+        scan["scanned_at"] = _from_db_time(scan["scanned_at"])
+        return scan
+
+    def record_scan(self, owner_id):
+        now = _now()
+        with self._write() as conn:
+            scan_id = conn.execute(INSERT_SCAN_SQL, (owner_id, now)).lastrowid
+            conn.execute(BUMP_STATS_SQL, (owner_id, now))
+        SCAN_ROWS.inc("scan")
+        return scan_id
+
+    def scan_page(self, owner_id, before, limit):
+        rows = self._conn().execute(
+            SCAN_PAGE_SQL, (owner_id, _to_db_time(before[0]), before[1], limit)
+        ).fetchall()
+        return [self._scan(r) for r in rows]
+
+    def iter_scans(self, owner_id=None):
+        if owner_id is None:
+            c = self._conn().execute(ALL_SCANS_SQL)
+        else:
+            c = self._conn().execute(OWNER_SCANS_SQL, (owner_id,))
+        try:
+            while True:
+                rows = c.fetchmany(SQLITE_FETCH_SIZE)
+                if not rows:
+                    break
+                for r in rows:
+                    yield (r[0], r[1], _from_db_time(r[2]), r[3], r[4])
+        finally:
+            c.close()
+
+    # -------------------------
+    # Locations
+    # -------------------------
+    def record_locations(self, locations):
+        if not locations:
+            return
+        with self._write() as conn:
+            conn.executemany(
+                UPDATE_LOCATION_SQL,
+                [(lat, lon, geo.encode(lat, lon), scan_id) for scan_id, lat, lon in locations]
+            )
+            # Newest located scan per owner becomes the dashboard's last location
+            ids = json.dumps([scan_id for scan_id, _, _ in locations])
+            latest = {}
+            for r in conn.execute(LOCATED_SCANS_SQL, (ids,)):
+                key = (r["scanned_at"], r["id"])
+                if r["owner_id"] not in latest or key > latest[r["owner_id"]][0]:
+                    latest[r["owner_id"]] = (key, r)
+            conn.executemany(
+                UPDATE_LAST_LOCATION_SQL,
+                [(r["latitude"], r["longitude"], r["scanned_at"], owner_id, r["scanned_at"])
+                 for owner_id, (_, r) in latest.items()]
+            )
+        SCAN_ROWS.inc("location", amount=len(locations))
+
+    def _area_rows(self, cells, owner_id, extra_sql="", extra_params=(), limit=None):
+        cover, params = geo.prefix_ranges_sql("geohash", cells, placeholder="?")
+        sql = f"SELECT id AS scan_id, owner_id, scanned_at, latitude, longitude FROM scan_logs WHERE {cover}"
+        if owner_id is not None:
+            sql += " AND owner_id = ?"
+            params.append(owner_id)
+        sql += extra_sql
+        params.extend(extra_params)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._scan(r) for r in self._conn().execute(sql, params)]
+
+    def scans_in_bbox(self, min_lat, min_lon, max_lat, max_lon, owner_id=None,
+                      limit=scan_geo.MAX_AREA_RESULTS):
+        cells = geo.cover_bbox(min_lat, min_lon, max_lat, max_lon, scan_geo.MAX_COVER_CELLS)
+        return self._area_rows(
+            cells, owner_id,
+            " AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?"
+            " ORDER BY scanned_at DESC, id DESC",
+            (min_lat, max_lat, min_lon, max_lon),
+            limit,
+        )
+
+    def scans_near(self, latitude, longitude, radius_m, owner_id=None,
+                   limit=scan_geo.MAX_AREA_RESULTS):
+        cells = geo.cover_bbox(*geo.radius_bbox(latitude, longitude, radius_m),
+                               max_cells=scan_geo.MAX_COVER_CELLS)
+        # The covering cells leave few candidates; the exact distance test
+        # runs here rather than as a registered SQL function
+        scans = []
+        for scan in self._area_rows(cells, owner_id):
+            distance = geo.distance_m(latitude, longitude, scan["latitude"], scan["longitude"])
+            if distance <= radius_m:
+                scan["distance_m"] = distance
+                scans.append(scan)
+        scans.sort(key=lambda s: (s["distance_m"], -s["scanned_at"].timestamp()))
+        return scans[:limit]
+
+    def heatmap(self, owner_id, precision):
+        rows = [dict(r) for r in self._conn().execute(HEATMAP_SQL, (precision, owner_id))]
+        for r in rows:
+            r["last_scan_at"] = _from_db_time(r["last_scan_at"])
+        return scan_geo.heatmap_cells(rows)
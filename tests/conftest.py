@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules under test live at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app signs sessions with it
+os.environ.setdefault("SECRET_KEY", "test")
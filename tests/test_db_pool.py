@@ -0,0 +1,144 @@
+import threading
+import time
+
+import psycopg2.extensions
+import pytest
+
+import db
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.status = psycopg2.extensions.STATUS_READY
+        self.autocommit = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnect:
+    def __init__(self):
+        self.conns = []
+
+    def __call__(self):
+        conn = FakeConn()
+        self.conns.append(conn)
+        return conn
+
+
+def make_pool(**kwargs):
+    connect = FakeConnect()
+    return ConnectionPool(min_size=0, max_size=2, timeout=0.05, check_after=60,
+                          connect=connect, **kwargs), connect
+
+
+def test_connections_are_reused():
+    pool, connect = make_pool()
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(connect.conns) == 1
+
+
+def test_dirty_connections_are_reset():
+    pool, _ = make_pool()
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.STATUS_IN_TRANSACTION
+    conn.autocommit = True
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert conn.autocommit is False
+
+
+def test_closed_connections_are_replaced():
+    pool, connect = make_pool()
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    assert pool.getconn() is not conn
+    assert len(connect.conns) == 2
+
+
+def test_fill_warms_up_to_min_size():
+    pool, connect = make_pool()
+    pool.min_size = 2
+    pool.fill()
+    pool.fill()
+    assert len(connect.conns) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_timeout_when_exhausted():
+    pool, _ = make_pool()
+    pool.getconn()
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiter_gets_a_released_connection():
+    pool, _ = make_pool()
+    pool.timeout = 5
+    held = [pool.getconn(), pool.getconn()]
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+    waiter.start()
+    time.sleep(0.05)
+    pool.putconn(held[0])
+    waiter.join(5)
+    assert got == [held[0]]
+    assert pool.stats()["waits"] == 1
+
+
+def test_failed_connect_frees_the_slot():
+    def refuse():
+        raise psycopg2.OperationalError("connection refused")
+
+    pool = ConnectionPool(min_size=0, max_size=1, timeout=0.05, connect=refuse)
+    for _ in range(3):
+        with pytest.raises(psycopg2.OperationalError):
+            pool.getconn()
+    assert pool.stats()["in_use"] == 0
+
+
+def test_forked_child_never_uses_parent_connections(monkeypatch):
+    pool, connect = make_pool()
+    held = pool.getconn()
+    idle = pool.getconn()
+    pool.putconn(idle)
+
+    monkeypatch.setattr(db.os, "getpid", lambda: -1)
+    # Handing back a connection inherited from the parent is ignored
+    pool.putconn(held)
+    assert not held.closed
+    child_conn = pool.getconn()
+    assert child_conn not in (held, idle)
+    assert len(connect.conns) == 3
+    # The parent's checkout doesn't count against the child
+    assert pool.stats()["in_use"] == 1
+    assert pool.stats()["idle"] == 0
+    assert not idle.closed
+
+
+def test_saturated_only_with_waiters():
+    pool, _ = make_pool()
+    pool.timeout = 5
+    held = [pool.getconn(), pool.getconn()]
+    assert not pool.saturated(1)
+    waiter = threading.Thread(target=lambda: pool.putconn(pool.getconn()))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while not pool.saturated(1) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert pool.saturated(1)
+    pool.putconn(held[0])
+    waiter.join(5)
+    assert not pool.saturated(1)
@@ -0,0 +1,31 @@
+import geo
+
+
+def test_encode_known_point():
+    assert geo.encode(57.64911, 10.40744) == "u4pruydqq"
+    assert geo.encode(57.64911, 10.40744, precision=5) == "u4pru"
+
+
+def test_decode_bbox_contains_point():
+    lat, lon = -33.8688, 151.2093
+    lat_lo, lon_lo, lat_hi, lon_hi = geo.decode_bbox(geo.encode(lat, lon))
+    assert lat_lo <= lat <= lat_hi
+    assert lon_lo <= lon <= lon_hi
+
+
+def test_cover_bbox_covers_every_point():
+    box = (12.90, 77.50, 13.05, 77.70)
+    cells = geo.cover_bbox(*box, max_cells=32)
+    assert 0 < len(cells) <= 32
+    assert len({len(c) for c in cells}) == 1
+    precision = len(cells[0])
+    steps = 20
+    for i in range(steps + 1):
+        for j in range(steps + 1):
+            lat = box[0] + (box[2] - box[0]) * i / steps
+            lon = box[1] + (box[3] - box[1]) * j / steps
+            assert geo.encode(lat, lon, precision) in cells
+
+
+def test_cover_bbox_tiny_box_is_one_cell():
+    assert geo.cover_bbox(10.0, 10.0, 10.0, 10.0) == [geo.encode(10.0, 10.0)]
@@ -0,0 +1,17 @@
+import db
+from offload import Offloader
+
+
+def test_offloaded_queries_count_for_the_caller():
+    def two_queries():
+        db.record_query("SELECT 1", 0.001)
+        db.record_query("SELECT 2", 0.001)
+        return "done"
+
+    db.count_queries()
+    try:
+        before = db.queries_on_this_thread()
+        assert Offloader(threads=1).run(two_queries) == "done"
+        assert db.queries_on_this_thread() - before == 2
+    finally:
+        db.count_queries(False)
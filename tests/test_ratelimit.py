@@ -0,0 +1,63 @@
+import pytest
+
+import ratelimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_parse_rules():
+    assert ratelimit.parse_rules("ip=30/60, uid=120/60,") == [
+        ("ip", 30.0, 0.5),
+        ("uid", 120.0, 2.0),
+    ]
+
+
+def test_parse_rules_unknown_scope():
+    with pytest.raises(ValueError):
+        ratelimit.parse_rules("user=10/60")
+
+
+def test_default_rules_parse():
+    for name in ratelimit.DEFAULT_RULES:
+        assert ratelimit.rules_for(name)
+
+
+def test_memory_backend_burst_then_wait(clock):
+    backend = ratelimit.MemoryBackend()
+    assert [backend.take("k", 3, 1.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.take("k", 3, 1.0) == pytest.approx(1.0)
+    # Other keys have their own bucket
+    assert backend.take("other", 3, 1.0) == 0.0
+
+
+def test_memory_backend_refills(clock):
+    backend = ratelimit.MemoryBackend()
+    for _ in range(2):
+        backend.take("k", 2, 0.5)
+    assert backend.take("k", 2, 0.5) > 0
+    clock.now += 2
+    assert backend.take("k", 2, 0.5) == 0.0
+
+
+def test_memory_backend_forgets_least_recent_key(clock):
+    backend = ratelimit.MemoryBackend(max_keys=2)
+    backend.take("a", 1, 0.1)
+    backend.take("b", 1, 0.1)
+    backend.take("a", 1, 0.1)
+    backend.take("c", 1, 0.1)
+    assert backend.size() == 2
+    # "b" was evicted, so it starts with a full bucket again
+    assert backend.take("b", 1, 0.1) == 0.0
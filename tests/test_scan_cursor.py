@@ -0,0 +1,37 @@
+import base64
+from datetime import datetime, timezone
+
+import pytest
+
+from app import app, decode_scan_cursor, encode_scan_cursor
+
+
+def test_cursor_round_trip():
+    row = {"scanned_at": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+           "scan_id": 42}
+    assert decode_scan_cursor(encode_scan_cursor(row)) == (row["scanned_at"], 42)
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "not base64!",
+    base64.urlsafe_b64encode(b"2024-05-01T12:00:00").decode(),
+    base64.urlsafe_b64encode(b"2024-05-01T12:00:00|abc").decode(),
+    base64.urlsafe_b64encode(b"yesterday|1").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+])
+def test_invalid_cursor(value):
+    assert decode_scan_cursor(value) is None
+
+
+def test_invalid_cursor_is_a_400():
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["owner_id"] = "owner"
+    response = client.get("/dashboard/scans?cursor=garbage")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "invalid cursor"}
+
+
+def test_scan_pages_need_a_login():
+    assert app.test_client().get("/dashboard/scans?cursor=x").status_code == 401
@@ -0,0 +1,89 @@
+import pytest
+from flask import Flask, request
+
+from scan_filter import ScanFilter, skip_reason
+
+app = Flask(__name__)
+PHONE = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile/15E148"
+
+
+def req(method="GET", headers=None):
+    headers = {"User-Agent": PHONE, **(headers or {})}
+    return app.test_request_context("/q/uid", method=method, headers=headers)
+
+
+@pytest.mark.parametrize("ua", [
+    "WhatsApp/2.23.20.0",
+    "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)",
+    "facebookexternalhit/1.1",
+    "TelegramBot (like TwitterBot)",
+    "curl/8.4.0",
+    "python-requests/2.31.0",
+    "",
+])
+def test_bots_are_skipped(ua):
+    with req(headers={"User-Agent": ua}):
+        assert skip_reason(request) == "bot"
+
+
+def test_in_app_browsers_are_visitors():
+    ua = PHONE + " Instagram 300.0.0.0"
+    with req(headers={"User-Agent": ua}):
+        assert skip_reason(request) is None
+
+
+def test_head_and_prefetch_are_skipped():
+    with req(method="HEAD"):
+        assert skip_reason(request) == "head"
+    with req(headers={"Sec-Purpose": "prefetch;prerender"}):
+        assert skip_reason(request) == "prefetch"
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, uid):
+        self.calls += 1
+        return 100 + self.calls
+
+
+def test_repeat_scans_are_logged_once():
+    scans = ScanFilter(window=600, maxsize=100)
+    record = Recorder()
+    with req(headers={"X-Forwarded-For": "1.2.3.4"}):
+        first = scans.log_scan(request, "uid", record)
+    # A spoofed X-Forwarded-For prefix is still the same client
+    with req(headers={"X-Forwarded-For": "9.9.9.9, 1.2.3.4"}):
+        again = scans.log_scan(request, "uid", record)
+    assert first == again == 101
+    assert record.calls == 1
+    assert scans.stats()["suppressed"] == {"duplicate": 1}
+
+
+def test_other_clients_and_tags_are_logged():
+    scans = ScanFilter(window=600, maxsize=100)
+    record = Recorder()
+    with req(headers={"X-Forwarded-For": "1.2.3.4"}):
+        scans.log_scan(request, "uid", record)
+        scans.log_scan(request, "other-uid", record)
+    with req(headers={"X-Forwarded-For": "5.6.7.8"}):
+        scans.log_scan(request, "uid", record)
+    assert record.calls == 3
+
+
+def test_window_zero_logs_every_scan():
+    scans = ScanFilter(window=0, maxsize=100)
+    record = Recorder()
+    with req():
+        scans.log_scan(request, "uid", record)
+        scans.log_scan(request, "uid", record)
+    assert record.calls == 2
+
+
+def test_bots_are_not_recorded():
+    scans = ScanFilter(window=600, maxsize=100)
+    record = Recorder()
+    with req(headers={"User-Agent": "Discordbot/2.0"}):
+        assert scans.log_scan(request, "uid", record) is None
+    assert record.calls == 0
@@ -0,0 +1,240 @@
+import json
+import os
+import time
+
+import psycopg2
+import pytest
+
+import scan_ingest
+from scan_ingest import ScanBuffer
+
+EVENTS = [
+    ("scan", (1, "owner", "2024-05-01T12:00:00+00:00")),
+    ("location", (1, 12.97, 77.59)),
+]
+
+
+class FakeWrite:
+    # missing: scan ids with no scan_logs row, so their locations don't match
+    def __init__(self, fail=False, missing=()):
+        self.fail = fail
+        self.missing = set(missing)
+        self.batches = []
+
+    def __call__(self, events):
+        if self.fail:
+            raise psycopg2.OperationalError("database is down")
+        self.batches.append(list(events))
+        scans = sum(1 for kind, _ in events if kind == "scan")
+        unmatched = [v for kind, v in events if kind == "location" and v[0] in self.missing]
+        return scans, len(events) - scans - len(unmatched), unmatched
+
+
+@pytest.fixture
+def buffer(tmp_path):
+    return ScanBuffer(spill_dir=str(tmp_path), flush_interval=0.01)
+
+
+def spill_files(buffer):
+    return [name for name in os.listdir(buffer.spill_dir) if name.endswith(".ndjson")]
+
+
+def test_failed_flush_spills_to_disk(buffer):
+    buffer._write = FakeWrite(fail=True)
+    buffer._flush(EVENTS)
+    assert buffer.errors == 1
+    assert buffer.spilled == 2
+    (name,) = spill_files(buffer)
+    with open(os.path.join(buffer.spill_dir, name)) as f:
+        assert [json.loads(line) for line in f] == [[k, list(v)] for k, v in EVENTS]
+
+
+def test_spill_is_replayed_once_the_db_is_back(buffer):
+    buffer._write = FakeWrite(fail=True)
+    buffer._flush(EVENTS)
+
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    assert write.batches == [EVENTS]
+    assert buffer.replayed == 2
+    assert (buffer.inserted, buffer.located) == (1, 1)
+    assert os.listdir(buffer.spill_dir) == []
+
+
+def test_failed_replay_keeps_the_file(buffer):
+    buffer._write = FakeWrite(fail=True)
+    buffer._flush(EVENTS)
+    buffer._replay_spill()
+    assert len(spill_files(buffer)) == 1
+    assert buffer.replayed == 0
+
+
+def test_old_spill_files_drop_map_link(buffer):
+    path = os.path.join(buffer.spill_dir, "scans.1.ndjson")
+    with open(path, "w") as f:
+        f.write(json.dumps(["location", [1, 12.97, 77.59, "https://maps"]]) + "\n")
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    assert write.batches == [[("location", (1, 12.97, 77.59))]]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params):
+        self.conn.queries += 1
+        self.rows = [(n,) for n in range(1, params[0] + 1)]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    queries = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+def test_reserve_id_hands_out_a_block(buffer, monkeypatch):
+    conn = FakeConn()
+    monkeypatch.setattr(scan_ingest, "get_db_connection", lambda: conn)
+    buffer.id_block_size = 3
+    try:
+        assert [buffer.reserve_id() for _ in range(4)] == [1, 2, 3, 1]
+        assert conn.queries == buffer.id_blocks == 2
+    finally:
+        buffer.shutdown()
+
+
+def test_reserve_id_without_db_returns_none(buffer, monkeypatch):
+    def down():
+        raise psycopg2.OperationalError("database is down")
+
+    monkeypatch.setattr(scan_ingest, "get_db_connection", down)
+    try:
+        assert buffer.reserve_id() is None
+        assert buffer.id_errors == 1
+    finally:
+        buffer.shutdown()
+
+
+def test_truncated_line_is_set_aside(buffer):
+    path = os.path.join(buffer.spill_dir, "scans.1.ndjson")
+    with open(path, "w") as f:
+        f.write(json.dumps(["scan", [1, "owner", "2024-05-01T12:00:00+00:00"]]) + "\n")
+        f.write('["location", [1, 12.9')
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    assert write.batches == [[EVENTS[0]]]
+    assert buffer.set_aside == 1
+    (bad,) = os.listdir(buffer.spill_dir)
+    assert bad.endswith(".bad")
+
+
+def test_rejected_file_is_set_aside_not_retried(buffer):
+    buffer._write = FakeWrite(fail=True)
+    buffer._flush(EVENTS)
+
+    def reject(events):
+        raise psycopg2.IntegrityError("duplicate key value")
+
+    buffer._write = reject
+    buffer._replay_spill()
+    assert spill_files(buffer) == []
+    assert buffer.set_aside == 2
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    assert write.batches == []
+
+
+def test_put_back_keeps_a_newer_spill_file(buffer):
+    buffer._write = FakeWrite(fail=True)
+    buffer._flush(EVENTS)
+    live = buffer._spill_path()
+
+    def down_after_new_spill(events):
+        # The owning worker spills again while its old file is being replayed
+        with open(live, "w") as f:
+            f.write(json.dumps(["scan", [2, "owner", "2024-05-01T12:00:02+00:00"]]) + "\n")
+        raise psycopg2.OperationalError("database is down")
+
+    buffer._write = down_after_new_spill
+    buffer._replay_spill()
+    assert len(spill_files(buffer)) == 2
+
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    replayed = sorted(event for batch in write.batches for event in batch)
+    assert replayed == sorted(EVENTS + [("scan", (2, "owner", "2024-05-01T12:00:02+00:00"))])
+
+
+def test_flusher_survives_unexpected_errors(buffer):
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    buffer._replay_spill = broken
+    buffer._ensure_started()
+    try:
+        deadline = time.monotonic() + 5
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(calls) >= 3
+        assert buffer._thread.is_alive()
+    finally:
+        buffer.shutdown()
+
+
+def held_files(buffer):
+    return [name for name in os.listdir(buffer.spill_dir) if ".held." in name]
+
+
+def test_location_waits_for_its_spilled_scan(buffer):
+    # Its scan sits in another worker's queue or spill file
+    buffer._write = FakeWrite(missing={1})
+    buffer._flush([EVENTS[1]])
+    assert buffer.located == 0
+    assert len(held_files(buffer)) == 1
+
+    with open(os.path.join(buffer.spill_dir, "scans.1.ndjson"), "w") as f:
+        f.write(json.dumps(list(EVENTS[0])) + "\n")
+    buffer._write = write = FakeWrite()
+    buffer._replay_spill()
+    assert sorted(event for batch in write.batches for event in batch) == sorted(EVENTS)
+    assert buffer.located == 1
+    assert os.listdir(buffer.spill_dir) == []
+
+
+def test_unmatched_location_is_kept_while_scans_are_pending(buffer, monkeypatch):
+    monkeypatch.setattr(scan_ingest, "LOCATION_WAIT", 0)
+    with open(os.path.join(buffer.spill_dir, "scans.1.ndjson.replay.2"), "w") as f:
+        f.write(json.dumps(list(EVENTS[0])) + "\n")
+    buffer._write = FakeWrite(missing={1})
+    buffer._flush([EVENTS[1]])
+    assert len(held_files(buffer)) == 1
+    assert buffer.set_aside == 0
+
+
+def test_orphaned_location_is_set_aside_after_the_wait(buffer, monkeypatch):
+    buffer._write = FakeWrite(missing={1, 2})
+    buffer._flush([EVENTS[1], ("location", (2, 1.0, 2.0))])
+    buffer._flush([("location", (2, 1.0, 2.0))])
+    assert len(held_files(buffer)) == 2
+    assert buffer.set_aside == 0
+
+    # Held files can't hold each other up once the wait is over
+    monkeypatch.setattr(scan_ingest, "LOCATION_WAIT", 0)
+    buffer._replay_spill()
+    assert held_files(buffer) == []
+    assert buffer.set_aside == 3
+    assert buffer.located == 0
@@ -0,0 +1,42 @@
+import pytest
+
+import shortcode
+
+
+def test_encode_decode_round_trip():
+    for n in (shortcode.MIN_SHORT_ID, shortcode.MAX_SHORT_ID, shortcode.new_short_id()):
+        code = shortcode.encode(n)
+        assert len(code) == shortcode.SHORT_CODE_LENGTH
+        assert shortcode.decode(code) == n
+
+
+def test_encode_small_numbers():
+    assert shortcode.encode(0) == "0"
+    assert shortcode.encode(61) == "Z"
+    assert shortcode.encode(62) == "10"
+    with pytest.raises(ValueError):
+        shortcode.encode(-1)
+
+
+@pytest.mark.parametrize("value", [
+    "3f0c2a9e-1b7d-4c55-9e1a-2b3c4d5e6f70",   # UUID
+    "0k3Xa9Qz",                               # leading zero: not 8 significant digits
+    "k3Xa9Qz",                                # too short
+    "k3Xa9QzBx",                              # too long
+    "k3Xa-QzB",                               # not base62
+    "",
+])
+def test_not_a_short_code(value):
+    assert not shortcode.is_short_code(value)
+    assert shortcode.decode(value) is None
+
+
+def test_new_short_ids_are_distinct_and_in_range():
+    ids = shortcode.new_short_ids(500)
+    assert len(set(ids)) == 500
+    assert all(shortcode.MIN_SHORT_ID <= n <= shortcode.MAX_SHORT_ID for n in ids)
+
+
+def test_owner_code_falls_back_to_uuid():
+    assert shortcode.owner_code("some-uuid", None) == "some-uuid"
+    assert shortcode.owner_code("some-uuid", shortcode.MIN_SHORT_ID) == "10000000"
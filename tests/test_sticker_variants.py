@@ -0,0 +1,19 @@
+import sticker
+from sticker_variants import encode_variants, render_variants, variant_suffixes
+
+URL = "https://letstrackme.com/q/00000000-0000-0000-0000-000000000000"
+
+
+def test_thumbnails_are_rendered_at_their_size():
+    rasterizers = ["pil"] + (["numpy"] if sticker.np is not None else [])
+    for size in (208, 416):
+        for rasterizer in rasterizers:
+            image = sticker.render_sticker(URL, rasterizer=rasterizer, size=size)
+            assert image.size == (size, size)
+
+
+def test_thumbnails_are_smaller_than_the_full_size_files():
+    encoded = encode_variants(render_variants(URL))
+    for name, size, fmt, _ in variant_suffixes():
+        if size is not None:
+            assert len(encoded[name][0]) < len(encoded[fmt][0]), name
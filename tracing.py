@@ -0,0 +1,153 @@
+"""Request trace recording for bench.py.
+
+With TRACE_FILE set, every request (except static files and /debug) is
+appended to that file as one JSON line, sanitized on the way out:
+
+    owner ids, session owner, emails and client addresses become keyed
+    hashes ({uid:1a2b3c4d}, ...) so the same owner/client keeps the same
+    placeholder; passwords, names, phones and scan tokens become fixed
+    placeholders; coordinates are rounded to ~100m; pagination cursors are
+    dropped.
+
+bench.py replay maps the placeholders back onto seeded bench owners.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from flask import g, request, session
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", 1))
+
+SKIP_PREFIXES = ("/static/", "/debug/")
+KEPT_HEADERS = ("User-Agent", "Content-Type", "Purpose", "Sec-Purpose")
+ID_ARGS = {"uid", "owner_id", "code"}
+COORD_KEYS = {"lat", "lon", "latitude", "longitude"}
+DROPPED_QUERY = {"cursor"}
+TEXT_FIELDS = {"name", "phone", "vehicle"}
+
+RULE_ARG = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+_lock = threading.Lock()
+
+
+def placeholder(kind, value, key):
+    digest = hmac.new(key, f"{kind}:{value}".encode(), hashlib.sha256).hexdigest()[:8]
+    return "{%s:%s}" % (kind, digest)
+
+
+# -------------------------
+# Sanitizing
+# -------------------------
+def _round(value, places=3):
+    try:
+        return round(float(value), places)
+    except (TypeError, ValueError):
+        return value
+
+
+def _path(key):
+    if request.url_rule is None:
+        return request.path
+    args = request.view_args or {}
+
+    def arg(m):
+        name = m.group(1)
+        value = args.get(name, "")
+        return placeholder("uid", value, key) if name in ID_ARGS else str(value)
+    return RULE_ARG.sub(arg, request.url_rule.rule)
+
+
+def _query():
+    query = {}
+    for k, v in request.args.items():
+        if k in DROPPED_QUERY:
+            continue
+        if k in COORD_KEYS:
+            v = _round(v)
+        elif k == "bbox":
+            v = ",".join(str(_round(p)) for p in v.split(","))
+        query[k] = v
+    return query
+
+
+def _form(key):
+    form = {}
+    for k, v in request.form.items():
+        if k == "password":
+            v = "{password}"
+        elif k == "email":
+            v = placeholder("email", v.strip().lower(), key)
+        elif k in TEXT_FIELDS:
+            v = "{text}"
+        form[k] = v
+    return form
+
+
+def _json(value):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k == "scan_token":
+                out[k] = "{scan_token}"
+            elif k in COORD_KEYS:
+                out[k] = _round(v)
+            else:
+                out[k] = _json(v)
+        return out
+    if isinstance(value, list):
+        return [_json(v) for v in value]
+    return value
+
+
+def trace_record(response, key):
+    record = {
+        "ts": round(time.time(), 3),
+        "method": request.method,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "path": _path(key),
+        "query": _query(),
+        "headers": {h: request.headers[h] for h in KEPT_HEADERS if h in request.headers},
+        "client": placeholder("client", ",".join(request.access_route), key),
+        "owner": placeholder("uid", session["owner_id"], key) if "owner_id" in session else None,
+        "status": response.status_code,
+        "ms": round((time.perf_counter() - g._trace_start) * 1000, 3),
+    }
+    if request.is_json:
+        record["json"] = _json(request.get_json(silent=True))
+    elif request.form:
+        record["form"] = _form(key)
+    return record
+
+
+# -------------------------
+# Recorder
+# -------------------------
+def init_app(app, path=TRACE_FILE, sample=TRACE_SAMPLE):
+    if not path:
+        return
+    print(f"Recording request traces to {path}")
+
+    @app.before_request
+    def start_trace():
+        g._trace_start = time.perf_counter()
+
+    @app.after_request
+    def write_trace(response):
+        if request.path.startswith(SKIP_PREFIXES) or "_trace_start" not in g:
+            return response
+        if sample < 1 and random.random() >= sample:
+            return response
+        try:
+            line = json.dumps(trace_record(response, (app.secret_key or "").encode()))
+            with _lock, open(path, "a") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print("Trace not recorded:", e)
+        return response